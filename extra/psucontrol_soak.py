@@ -0,0 +1,554 @@
+# coding=utf-8
+"""
+Soak and replay harness for PSU Control.
+
+Runs the plugin against an in-process virtual GPIO chip and a simulated
+printer, replays G-code streams and fires API/toggle storms while reporting
+latency percentiles, thread counts, memory growth and divergence between the
+commanded and sensed PSU state.
+
+Requires OctoPrint and this plugin to be installed in the same environment:
+
+    python extra/psucontrol_soak.py --duration 3600 --gcode part.gcode --toggle-rate 0.5
+"""
+from __future__ import absolute_import
+
+__author__ = "Shawn Bruce <kantlivelong@gmail.com>"
+__license__ = "GNU Affero General Public License http://www.gnu.org/licenses/agpl.html"
+__copyright__ = "Copyright (C) 2017 Shawn Bruce - Released under terms of the AGPLv3 License"
+
+
+import argparse
+import json
+import logging
+import random
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import types
+
+import octoprint_psucontrol
+from octoprint.events import Events
+
+
+########################################################################################################################
+# Virtual GPIO
+
+class VirtualGPIOChip(object):
+    """A GPIO chip whose sense line follows the switch line after a delay, like a real PSU."""
+    def __init__(self, switch_line, sense_line, invert_switch=False, invert_sense=False, rise_delay=0.5, fall_delay=0.2, glitch_rate=0.0):
+        self.switch_line = switch_line
+        self.sense_line = sense_line
+        self.invert_switch = invert_switch
+        self.invert_sense = invert_sense
+        self.rise_delay = rise_delay
+        self.fall_delay = fall_delay
+        self.glitch_rate = glitch_rate
+
+        self._lock = threading.Lock()
+        self._levels = dict()
+        self._powered = False
+        self._power_changed_at = 0
+
+    def write(self, line, value):
+        with self._lock:
+            self._levels[line] = bool(value)
+            if line == self.switch_line:
+                powered = bool(value) ^ self.invert_switch
+                if powered != self._powered:
+                    self._powered = powered
+                    self._power_changed_at = time.time()
+
+    def is_powered(self):
+        with self._lock:
+            delay = self.rise_delay if self._powered else self.fall_delay
+            if time.time() - self._power_changed_at < delay:
+                return not self._powered
+            return self._powered
+
+    def read(self, line):
+        if line == self.sense_line:
+            v = self.is_powered() ^ self.invert_sense
+            if self.glitch_rate and random.random() < self.glitch_rate:
+                v = not v
+            return v
+
+        with self._lock:
+            return self._levels.get(line, False)
+
+
+class VirtualGPIO(object):
+    chip = None
+
+    def __init__(self, path=None, line=None, direction=None, bias=None, **kwargs):
+        self.name = "virtual{}".format(line)
+        self.path = path
+        self.line = line
+        self.direction = direction
+        if direction in ('low', 'high'):
+            self.chip.write(line, direction == 'high')
+
+    def read(self):
+        return self.chip.read(self.line)
+
+    def write(self, value):
+        self.chip.write(self.line, value)
+
+    def close(self):
+        pass
+
+
+########################################################################################################################
+# Simulated OctoPrint environment
+
+class SimSettings(object):
+    def __init__(self, defaults, overrides):
+        self._defaults = defaults
+        self._values = dict(overrides)
+        self._global = dict()
+        self._scripts = dict()
+
+    def get(self, path, **kwargs):
+        if path[0] in self._values:
+            return self._values[path[0]]
+        return self._defaults.get(path[0])
+
+    def get_int(self, path, **kwargs):
+        v = self.get(path)
+        return None if v is None else int(v)
+
+    def get_float(self, path, **kwargs):
+        v = self.get(path)
+        return None if v is None else float(v)
+
+    def get_boolean(self, path, **kwargs):
+        v = self.get(path)
+        return None if v is None else bool(v)
+
+    def set(self, path, value, **kwargs):
+        self._values[path[0]] = value
+
+    def remove(self, path, **kwargs):
+        self._values.pop(path[0], None)
+
+    def save(self, *args, **kwargs):
+        pass
+
+    def global_get(self, path, **kwargs):
+        return self._global.get(tuple(path))
+
+    def global_set(self, path, value, **kwargs):
+        self._global[tuple(path)] = value
+
+    def listScripts(self, script_type):
+        return list(self._scripts.keys())
+
+    def saveScript(self, script_type, name, script):
+        self._scripts[name] = script
+
+
+class SimEventBus(object):
+    def __init__(self):
+        self.counts = dict()
+        self._lock = threading.Lock()
+
+    def fire(self, event, payload=None):
+        with self._lock:
+            self.counts[event] = self.counts.get(event, 0) + 1
+
+
+class SimPluginManager(object):
+    def __init__(self):
+        self.plugin_implementations = dict()
+        self.plugins = dict()
+        self.message_count = 0
+
+    def send_plugin_message(self, identifier, data):
+        self.message_count += 1
+
+
+class SimComm(object):
+    def _log(self, message):
+        pass
+
+
+class SimPrinter(object):
+    """A printer with first order heater dynamics that only heats while the PSU is powered."""
+    def __init__(self, chip, ambient=22.0, heat_tau=30.0, cool_tau=120.0, connect_delay=0.5):
+        self.chip = chip
+        self.ambient = ambient
+        self.heat_tau = heat_tau
+        self.cool_tau = cool_tau
+        self.connect_delay = connect_delay
+        self.plugin = None
+
+        self._lock = threading.Lock()
+        self.heaters = dict(tool0=dict(actual=ambient, target=0.0), bed=dict(actual=ambient, target=0.0))
+        self.state = "CLOSED"
+        self.printing = False
+        self.job = None
+        self.command_count = 0
+
+    def tick(self, dt):
+        powered = self.chip.is_powered()
+        with self._lock:
+            for heater in self.heaters.values():
+                if powered and heater['target'] > 0:
+                    heater['actual'] += (heater['target'] - heater['actual']) * min(1.0, dt / self.heat_tau)
+                else:
+                    heater['actual'] += (self.ambient - heater['actual']) * min(1.0, dt / self.cool_tau)
+
+        if not powered and self.state == "OPERATIONAL":
+            self.state = "ERROR"
+
+    def _finish_connect(self):
+        if self.chip.is_powered():
+            self.state = "OPERATIONAL"
+            self.plugin.hook_gcode_received(SimComm(), "start")
+        else:
+            self.state = "CLOSED"
+
+    def connect(self, *args, **kwargs):
+        self.state = "CONNECTING"
+        t = threading.Timer(self.connect_delay, self._finish_connect)
+        t.daemon = True
+        t.start()
+
+    def disconnect(self, *args, **kwargs):
+        self.state = "CLOSED"
+
+    def is_closed_or_error(self, *args, **kwargs):
+        return self.state in ("CLOSED", "ERROR")
+
+    def is_operational(self, *args, **kwargs):
+        return self.state == "OPERATIONAL"
+
+    def is_printing(self, *args, **kwargs):
+        return self.printing
+
+    def is_paused(self, *args, **kwargs):
+        return False
+
+    def is_ready(self, *args, **kwargs):
+        return self.is_operational() and not self.printing
+
+    def get_state_id(self, *args, **kwargs):
+        return "PRINTING" if self.printing else self.state
+
+    def get_current_connection(self, *args, **kwargs):
+        return (self.state, None, None, None)
+
+    def get_current_job(self, *args, **kwargs):
+        return dict(file=dict(name=self.job))
+
+    def get_current_temperatures(self, *args, **kwargs):
+        with self._lock:
+            return dict((k, dict(v)) for k, v in self.heaters.items())
+
+    def set_temperature(self, heater, value, *args, **kwargs):
+        with self._lock:
+            if heater in self.heaters:
+                self.heaters[heater]['target'] = float(value)
+        self._queue("M104 S{}".format(value) if heater.startswith("tool") else "M140 S{}".format(value))
+
+    def _queue(self, line):
+        self.command_count += 1
+        gcode = line.split(' ', 1)[0]
+        return self.plugin.hook_gcode_queuing(SimComm(), "queuing", line, None, gcode)
+
+    def commands(self, commands, *args, **kwargs):
+        if not isinstance(commands, (list, tuple)):
+            commands = [commands]
+        for line in commands:
+            self.apply(line)
+            self._queue(line)
+
+    def script(self, name, *args, **kwargs):
+        pass
+
+    def select_file(self, path, sd, printAfterSelect=False, *args, **kwargs):
+        self.job = path
+
+    def cancel_print(self, *args, **kwargs):
+        self.printing = False
+
+    def apply(self, line):
+        parts = line.split()
+        if not parts:
+            return
+        heater = dict(M104='tool0', M109='tool0', M140='bed', M190='bed').get(parts[0])
+        if heater is None:
+            return
+        for p in parts[1:]:
+            if p.startswith('S'):
+                try:
+                    with self._lock:
+                        self.heaters[heater]['target'] = float(p[1:])
+                except ValueError:
+                    pass
+
+
+########################################################################################################################
+# Metrics
+
+class Metrics(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = dict()
+        self.errors = dict()
+        self.divergences = 0
+        self.divergent_seconds = 0.0
+        self.thread_counts = []
+        self.memory = []
+
+    def record(self, name, duration):
+        with self._lock:
+            self.latencies.setdefault(name, []).append(duration)
+
+    def error(self, name):
+        with self._lock:
+            self.errors[name] = self.errors.get(name, 0) + 1
+
+    @staticmethod
+    def _percentile(values, p):
+        if not values:
+            return None
+        values = sorted(values)
+        k = min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))
+        return values[k]
+
+    def summary(self):
+        with self._lock:
+            latencies = dict((k, list(v)) for k, v in self.latencies.items())
+
+        result = dict(latency=dict(), errors=dict(self.errors), divergences=self.divergences,
+                      divergentSeconds=round(self.divergent_seconds, 3))
+        for name, values in latencies.items():
+            result['latency'][name] = dict(count=len(values),
+                                           p50=self._percentile(values, 50),
+                                           p90=self._percentile(values, 90),
+                                           p99=self._percentile(values, 99),
+                                           max=max(values))
+
+        if self.thread_counts:
+            result['threads'] = dict(min=min(self.thread_counts), max=max(self.thread_counts), last=self.thread_counts[-1])
+        if len(self.memory) > 1:
+            result['memory'] = dict(start=self.memory[0], last=self.memory[-1], growth=self.memory[-1] - self.memory[0])
+        return result
+
+
+def rss_kb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except (IOError, OSError, ValueError):
+        pass
+    return None
+
+
+########################################################################################################################
+# Harness
+
+class SoakHarness(object):
+    def __init__(self, args):
+        self.args = args
+        self.stop_event = threading.Event()
+        self.metrics = Metrics()
+
+        self.chip = VirtualGPIOChip(switch_line=17, sense_line=27,
+                                    rise_delay=args.rise_delay, fall_delay=args.fall_delay,
+                                    glitch_rate=args.glitch_rate)
+        VirtualGPIO.chip = self.chip
+
+        octoprint_psucontrol.HAS_GPIO = True
+        octoprint_psucontrol.periphery = types.SimpleNamespace(GPIO=VirtualGPIO, CdevGPIO=VirtualGPIO, version="virtual")
+        octoprint_psucontrol.PSUControl.get_gpio_devs = lambda self: ['/dev/gpiochip-virtual']
+
+        if not hasattr(Events, "PLUGIN_PSUCONTROL_PSU_STATE_CHANGED"):
+            Events.PLUGIN_PSUCONTROL_PSU_STATE_CHANGED = "plugin_psucontrol_psu_state_changed"
+
+        settings = dict(GPIODevice='/dev/gpiochip-virtual',
+                        switchingMethod='GPIO',
+                        onoffGPIOPin=17,
+                        sensingMethod='GPIO',
+                        senseGPIOPin=27,
+                        sensePollingInterval=1,
+                        postOnDelay=2.0,
+                        autoOn=True,
+                        powerOffWhenIdle=True,
+                        idleTimeout=1,
+                        idleTimeoutWaitTemp=50)
+        for item in args.setting:
+            k, v = item.split('=', 1)
+            try:
+                settings[k] = json.loads(v)
+            except ValueError:
+                settings[k] = v
+
+        self.printer = SimPrinter(self.chip, connect_delay=args.connect_delay)
+
+        plugin = octoprint_psucontrol.PSUControl()
+        plugin._identifier = "psucontrol"
+        plugin._plugin_version = "soak"
+        plugin._logger = logging.getLogger("octoprint.plugins.psucontrol")
+        plugin._settings = SimSettings(plugin.get_settings_defaults(), settings)
+        plugin._printer = self.printer
+        plugin._event_bus = SimEventBus()
+        plugin._plugin_manager = SimPluginManager()
+        plugin._data_folder = tempfile.mkdtemp(prefix="psucontrol-soak-")
+        self.printer.plugin = plugin
+        self.plugin = plugin
+
+    def _timed(self, name, function, *args):
+        start = time.time()
+        try:
+            function(*args)
+        except Exception:
+            self.metrics.error(name)
+            logging.getLogger("soak").exception("Error in {}".format(name))
+        self.metrics.record(name, time.time() - start)
+
+    def _heater_loop(self):
+        last = time.time()
+        while not self.stop_event.wait(0.1):
+            now = time.time()
+            self.printer.tick(now - last)
+            last = now
+
+    def _replay_loop(self):
+        if not self.args.gcode:
+            return
+
+        period = 1.0 / self.args.rate
+        while not self.stop_event.is_set():
+            for path in self.args.gcode:
+                self.printer.job = path
+                self.printer.printing = True
+                with open(path, 'r') as f:
+                    for line in f:
+                        if self.stop_event.is_set():
+                            return
+                        line = line.split(';', 1)[0].strip()
+                        if not line:
+                            continue
+                        self.printer.apply(line)
+                        self._timed("queue", self.printer._queue, line)
+                        time.sleep(period)
+                self.printer.printing = False
+                self.printer.job = None
+
+                if self.stop_event.wait(self.args.idle_gap):
+                    return
+
+    def _storm_loop(self):
+        if self.args.toggle_rate <= 0:
+            return
+
+        actions = [("toggle", self.plugin.toggle_psu),
+                   ("on", self.plugin.turn_psu_on),
+                   ("off", self.plugin.turn_psu_off),
+                   ("state", self.plugin.get_psu_state)]
+        while not self.stop_event.wait(random.expovariate(self.args.toggle_rate)):
+            name, function = random.choice(actions)
+            self._timed(name, function)
+
+    def _monitor_loop(self):
+        divergent_since = None
+        last_report = time.time()
+
+        while not self.stop_event.wait(0.25):
+            now = time.time()
+            state = self.plugin._powerState.state
+            if state in ("ON", "OFF"):
+                commanded = state == "ON"
+                if commanded != self.chip.is_powered() or commanded != bool(self.plugin.isPSUOn):
+                    if divergent_since is None:
+                        divergent_since = now
+                    elif now - divergent_since > self.args.settle_time:
+                        self.metrics.divergences += 1
+                        self.metrics.divergent_seconds += now - divergent_since
+                        divergent_since = now
+                else:
+                    divergent_since = None
+            else:
+                divergent_since = None
+
+            if now - last_report >= self.args.report_interval:
+                last_report = now
+                self.metrics.thread_counts.append(threading.active_count())
+                self.metrics.memory.append(rss_kb() or tracemalloc.get_traced_memory()[0] // 1024)
+                self.report()
+
+    def report(self, final=False):
+        summary = self.metrics.summary()
+        summary['final'] = final
+        summary['events'] = dict(self.plugin._event_bus.counts)
+        summary['pluginMessages'] = self.plugin._plugin_manager.message_count
+        summary['stats'] = self.plugin.get_stats()
+        print(json.dumps(summary, sort_keys=True, default=str))
+        sys.stdout.flush()
+
+    def run(self):
+        tracemalloc.start()
+
+        self.plugin.on_settings_initialized()
+        self.plugin.on_after_startup()
+
+        self.metrics.thread_counts.append(threading.active_count())
+        self.metrics.memory.append(rss_kb() or tracemalloc.get_traced_memory()[0] // 1024)
+
+        threads = [threading.Thread(target=self._heater_loop, name="soak-heaters"),
+                   threading.Thread(target=self._replay_loop, name="soak-replay"),
+                   threading.Thread(target=self._monitor_loop, name="soak-monitor")]
+        threads += [threading.Thread(target=self._storm_loop, name="soak-storm-{}".format(i)) for i in range(self.args.storm_threads)]
+
+        for t in threads:
+            t.daemon = True
+            t.start()
+
+        try:
+            self.stop_event.wait(self.args.duration)
+        except KeyboardInterrupt:
+            pass
+
+        self.stop_event.set()
+        for t in threads:
+            t.join(10)
+
+        self.report(final=True)
+        return 1 if self.metrics.divergences or self.metrics.errors else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Soak test PSU Control against a virtual GPIO chip and printer.")
+    parser.add_argument("--duration", type=float, default=600, help="Run time in seconds.")
+    parser.add_argument("--gcode", action="append", default=[], help="G-code file to replay. May be repeated.")
+    parser.add_argument("--rate", type=float, default=50, help="G-code lines per second.")
+    parser.add_argument("--idle-gap", type=float, default=120, help="Seconds to stay idle between replayed files.")
+    parser.add_argument("--toggle-rate", type=float, default=0.2, help="Mean API/toggle calls per second per storm thread.")
+    parser.add_argument("--storm-threads", type=int, default=4, help="Number of concurrent API/toggle storm threads.")
+    parser.add_argument("--rise-delay", type=float, default=0.5, help="Seconds until the sense line follows power on.")
+    parser.add_argument("--fall-delay", type=float, default=0.2, help="Seconds until the sense line follows power off.")
+    parser.add_argument("--glitch-rate", type=float, default=0.0, help="Probability of a flipped sense read.")
+    parser.add_argument("--connect-delay", type=float, default=0.5, help="Seconds until the simulated firmware responds.")
+    parser.add_argument("--settle-time", type=float, default=10, help="Seconds a commanded/sensed mismatch may last.")
+    parser.add_argument("--report-interval", type=float, default=60, help="Seconds between reports.")
+    parser.add_argument("--setting", action="append", default=[], help="Plugin setting override as key=value.")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.WARNING)
+
+    sys.exit(SoakHarness(args).run())
+
+
+if __name__ == "__main__":
+    main()
@@ -12,13 +12,23 @@ import time
 import subprocess
 import threading
 import glob
+import os
+import json
+import collections
 from flask import make_response, jsonify
 from flask_babel import gettext
 import platform
-from octoprint.util import fqfn
+from octoprint.util import fqfn, atomic_write
+from octoprint.filemanager import valid_file_type
 from octoprint.settings import valid_boolean_trues
 import flask
 from . import cli
+from .tracing import Tracer
+from .scheduler import Scheduler, next_weekly_occurrence, parse_local_datetime, to_timestamp
+from .prescan import PrescanCache
+from .workflow import Workflow, WorkflowError
+from .power_saving import PowerSaving
+from .util import wait_for_path, DebouncedInput, PowerStateMachine, AdaptivePollInterval, SingleFlight, precise_sleep, OutputProtection, SwitchRejected, Preemption
 
 try:
     import periphery
@@ -26,6 +36,12 @@ try:
 except ModuleNotFoundError:
     HAS_GPIO = False
 
+try:
+    from .control_socket import ControlSocketServer
+    HAS_CONTROL_SOCKET = True
+except ImportError:
+    HAS_CONTROL_SOCKET = False
+
 try:
     KERNEL_VERSION = tuple([int(s) for s in platform.release().split(".")[:2]])
 except ValueError:
@@ -70,7 +86,39 @@ class PSUControl(octoprint.plugin.StartupPlugin,
         self._waitForHeaters = False
         self._skipIdleTimer = False
         self._configuredGPIOPins = {}
+        self._senseDebouncer = None
         self._noSensing_isPSUOn = False
+        self._psuStateCondition = threading.Condition()
+        self._firmwareResponseEvent = threading.Event()
+        self._powerState = PowerStateMachine(self._turn_psu_on, self._turn_psu_off)
+        self._tracer = Tracer()
+        self._pollInterval = AdaptivePollInterval()
+        self._scheduler = None
+        self._scheduleRetry = None
+        self._scheduleLock = threading.Lock()
+        self._jobQueued = False
+        self._secondarySenseRequested = False
+        self._lastSecondarySense = None
+        self._lastSecondarySenseTime = 0
+        self._senseStats = dict(primary=0, secondary=0, conflicts=0)
+        self._prescanCache = PrescanCache()
+        self._prescanLock = threading.Lock()
+        self._prescanResult = None
+        self._controlSocket = None
+        self._stateConfirmed = True
+        self._workflow = None
+        self._workflows = collections.OrderedDict()
+        self._workflowLock = threading.Lock()
+        self._preemption = Preemption()
+        self._senseFlight = SingleFlight(self._update_psu_state)
+        self._lastSenseTime = 0
+        self._pulseStats = dict(count=0, lastWidth=None, maxError=0.0)
+        self._outputProtection = OutputProtection()
+        self._powerSaving = PowerSaving()
+        self._runawayBaseline = dict()
+        self._runawayTriggered = False
+        self._emergencyLatch = None
+        self._emergencyStats = dict(count=0, overTarget=0, lastLatency=None, maxLatency=0.0, lastReason=None, lastTime=None)
         self.isPSUOn = False
 
 
@@ -80,6 +128,23 @@ class PSUControl(octoprint.plugin.StartupPlugin,
             switchingMethod = 'GCODE',
             onoffGPIOPin = 0,
             invertonoffGPIOPin = False,
+            switchingGPIOMode = 'LEVEL',
+            switchingGPIOPulseWidth = 250,
+            resetGPIOPin = 0,
+            switchingGPIOConfirmTimeout = 5.0,
+            enableOutputProtection = False,
+            outputMinOnTime = 10.0,
+            outputMinOffTime = 10.0,
+            outputMaxCycles = 10,
+            outputCycleWindow = 60,
+            outputProtectionPolicy = 'QUEUE',
+            outputMaxQueueTime = 30.0,
+            enablePowerSaving = False,
+            powerSavingStopCommands = '',
+            powerSavingStartCommands = '',
+            powerSavingCommandTimeout = 30.0,
+            powerSavingBlockConnect = True,
+            powerSavingPollingInterval = 30,
             onGCodeCommand = 'M80',
             offGCodeCommand = 'M81',
             onSysCommand = '',
@@ -89,17 +154,32 @@ class PSUControl(octoprint.plugin.StartupPlugin,
             pseudoOnGCodeCommand = 'M80',
             pseudoOffGCodeCommand = 'M81',
             postOnDelay = 0.0,
+            powerReadyTimeout = 10.0,
             connectOnPowerOn = False,
+            connectTimeout = 5.0,
             disconnectOnPowerOff = False,
             sensingMethod = 'INTERNAL',
             senseGPIOPin = 0,
             sensePollingInterval = 5,
+            senseAdaptivePolling = False,
+            senseFastPollingInterval = 0.25,
+            senseFastPollingWindow = 10,
+            sensePollingIntervalMax = 60,
             invertsenseGPIOPin = False,
             senseGPIOPinPUD = '',
+            senseGPIODebounce = False,
+            senseGPIODebounceRate = 200,
+            senseGPIODebounceSamples = 16,
+            senseGPIODebounceStableTime = 50,
             senseSystemCommand = '',
             sensingPlugin = '',
+            sensingMethodSecondary = '',
+            secondarySensePollingInterval = 300,
+            senseConflictResolution = 'SECONDARY',
             autoOn = False,
             autoOnTriggerGCodeCommands = "G0,G1,G2,G3,G10,G11,G28,G29,G32,M104,M106,M109,M140,M190",
+            prescanGCode = False,
+            autoOnAtJobStart = False,
             enablePowerOffWarningDialog = True,
             enableNavBar = True,
             enableSideBar = True,
@@ -110,7 +190,19 @@ class PSUControl(octoprint.plugin.StartupPlugin,
             idleIgnoreCommands = 'M105',
             idleTimeoutWaitTemp = 50,
             turnOnWhenApiUploadPrint = False,
-            turnOffWhenError = False
+            turnOffWhenError = False,
+            emergencyOffLatencyTarget = 100,
+            enableRunawayDetection = False,
+            runawayTemperatureRise = 15.0,
+            enableControlSocket = False,
+            controlSocketPath = '',
+            controlSocketMode = '0660',
+            controlSocketGroup = '',
+            enableTracing = False,
+            traceBufferSize = 5000,
+            schedules = [],
+            scheduleNeverOffWhilePrinting = True,
+            scheduleStayOnWhileJobQueued = True
         )
 
 
@@ -136,6 +228,8 @@ class PSUControl(octoprint.plugin.StartupPlugin,
                 v = self._settings.get_float([k])
             elif type(v) == bool:
                 v = self._settings.get_boolean([k])
+            elif type(v) == list:
+                v = self._settings.get([k])
 
             self.config[k] = v
             self._logger.debug("{}: {}".format(k, v))
@@ -148,6 +242,19 @@ class PSUControl(octoprint.plugin.StartupPlugin,
             self._logger.error("Unable to use GPIO for sensingMethod.")
             self.config['sensingMethod'] = ''
 
+        if self.config['sensingMethodSecondary'] == 'GPIO' and not HAS_GPIO:
+            self._logger.error("Unable to use GPIO for sensingMethodSecondary.")
+            self.config['sensingMethodSecondary'] = ''
+
+        if self.config['enableControlSocket'] and not HAS_CONTROL_SOCKET:
+            self._logger.error("Unable to use the control socket, Unix domain sockets are not supported on this platform.")
+            self.config['enableControlSocket'] = False
+
+        if self.config['sensingMethodSecondary'] == self.config['sensingMethod']:
+            self.config['sensingMethodSecondary'] = ''
+
+        self._lastSecondarySense = None
+
         if self.config['enablePseudoOnOff'] and self.config['switchingMethod'] == 'GCODE':
             self._logger.warning("Pseudo On/Off cannot be used in conjunction with GCODE switching. Disabling.")
             self.config['enablePseudoOnOff'] = False
@@ -155,9 +262,86 @@ class PSUControl(octoprint.plugin.StartupPlugin,
         self._autoOnTriggerGCodeCommandsArray = self.config['autoOnTriggerGCodeCommands'].split(',')
         self._idleIgnoreCommandsArray = self.config['idleIgnoreCommands'].split(',')
 
+        self._tracer.configure(self.config['enableTracing'], max(1, self.config['traceBufferSize']))
+        self._outputProtection.configure(self.config['enableOutputProtection'],
+                                         self.config['outputMinOnTime'],
+                                         self.config['outputMinOffTime'],
+                                         self.config['outputMaxCycles'],
+                                         self.config['outputCycleWindow'] * 60,
+                                         self.config['outputProtectionPolicy'],
+                                         self.config['outputMaxQueueTime'])
+
+        self._pollInterval.configure(self.config['sensePollingInterval'],
+                                     self.config['senseFastPollingInterval'],
+                                     self.config['senseFastPollingWindow'],
+                                     self.config['sensePollingIntervalMax'],
+                                     1.5)
+
+
+    def _uses_gpio(self):
+        return 'GPIO' in (self.config['switchingMethod'], self.config['sensingMethod'], self.config['sensingMethodSecondary'])
+
+
+    def _get_state_file(self):
+        return os.path.join(self.get_plugin_data_folder(), "state.json")
+
+
+    def _save_state(self):
+        try:
+            with atomic_write(self._get_state_file(), mode="w") as f:
+                json.dump(dict(isPSUOn=bool(self.isPSUOn), emergencyLatch=self._emergencyLatch, timestamp=time.time()), f)
+        except Exception:
+            self._logger.exception("Unable to save PSU state")
+
+
+    def _restore_state(self):
+        path = self._get_state_file()
+        if not os.path.exists(path):
+            return
+
+        try:
+            with open(path, "r") as f:
+                state = json.load(f)
+            is_on = state.get('isPSUOn')
+            self._emergencyLatch = state.get('emergencyLatch')
+        except Exception:
+            self._logger.exception("Unable to restore PSU state from {}".format(path))
+            return
+
+        if self._emergencyLatch is not None:
+            self._logger.warning("Emergency off is still latched: {}".format(self._emergencyLatch))
+
+        if is_on is None:
+            self._logger.warning("No PSU state found in {}".format(path))
+            return
+        is_on = bool(is_on)
+
+        # configure_gpio drives a level switched output to off, the last state no longer applies
+        if self.config['switchingMethod'] == 'GPIO' and self.config['switchingGPIOMode'] == 'LEVEL':
+            self._logger.info("Not restoring last known PSU state, the GPIO output is reset to off")
+            return
+
+        self._logger.info("Restored last known PSU state: {}".format("on" if is_on else "off"))
+        self.isPSUOn = is_on
+        self._noSensing_isPSUOn = is_on
+        self._powerState.sensed(self.isPSUOn)
+        self._stateConfirmed = False
+
+
+    def _get_state_message(self):
+        return dict(isPSUOn=self.isPSUOn,
+                    confirmed=self._stateConfirmed,
+                    idleTimeLeft=self._idleTimeLeft,
+                    idleTimerOverride=self._idleTimerOverride,
+                    nextSchedule=self._get_next_schedule(),
+                    emergencyLatch=self._emergencyLatch)
+
 
     def on_after_startup(self):
-        if self.config['switchingMethod'] == 'GPIO' or self.config['sensingMethod'] == 'GPIO':
+        self._powerSaving.logger = self._logger
+        self._restore_state()
+
+        if self._uses_gpio():
             self.configure_gpio()
 
         self._check_psu_state_thread = threading.Thread(target=self._check_psu_state)
@@ -166,12 +350,49 @@ class PSUControl(octoprint.plugin.StartupPlugin,
 
         self._start_idle_timer()
 
+        self._scheduler = Scheduler(logger=self._logger)
+        self._scheduler.start()
+        self._reschedule()
+
+        self._start_control_socket()
+
+
+    def _start_control_socket(self):
+        if self._controlSocket is not None:
+            self._controlSocket.stop()
+            self._controlSocket = None
+
+        if not self.config['enableControlSocket']:
+            return
+
+        path = self.config['controlSocketPath'] or os.path.join(self.get_plugin_data_folder(), "control.sock")
+        commands = dict(on=self.turn_psu_on,
+                        off=self.turn_psu_off,
+                        toggle=self.toggle_psu,
+                        status=self.get_psu_state)
+
+        try:
+            self._controlSocket = ControlSocketServer(path, commands, self._logger,
+                                                      mode=int(self.config['controlSocketMode'], 8),
+                                                      group=self.config['controlSocketGroup'])
+        except Exception:
+            self._logger.exception("Unable to create control socket {}".format(path))
+            return
+
+        self._controlSocket.start()
+        self._logger.info("Listening on control socket {}".format(path))
+
 
     def get_gpio_devs(self):
         return sorted(glob.glob('/dev/gpiochip*'))
 
 
     def cleanup_gpio(self):
+        if self._senseDebouncer is not None:
+            self._senseDebouncer.stop()
+            self._senseDebouncer.join()
+            self._senseDebouncer = None
+
         for k, pin in self._configuredGPIOPins.items():
             self._logger.debug("Cleaning up {} pin {}".format(k, pin.name))
             try:
@@ -203,7 +424,23 @@ class PSUControl(octoprint.plugin.StartupPlugin,
                     "Exception while setting up GPIO pin {}".format(self.config['onoffGPIOPin'])
                 )
 
-        if self.config['sensingMethod'] == 'GPIO':
+            if self.config['switchingGPIOMode'] != 'LEVEL':
+                self._logger.info("Switching by {}ms pulses ({})".format(self.config['switchingGPIOPulseWidth'], self.config['switchingGPIOMode']))
+
+            if self.config['switchingGPIOMode'] == 'PULSE' and self.config['sensingMethod'] == 'INTERNAL':
+                self._logger.warning("Pulse switching toggles the PSU, without sensing the PSU may end up in the wrong state.")
+
+            if self.config['switchingGPIOMode'] == 'LATCHING':
+                self._logger.info("Configuring GPIO for reset pin {}".format(self.config['resetGPIOPin']))
+                try:
+                    pin = periphery.GPIO(self.config['GPIODevice'], self.config['resetGPIOPin'], initial_output)
+                    self._configuredGPIOPins['reset'] = pin
+                except Exception:
+                    self._logger.exception(
+                        "Exception while setting up GPIO pin {}".format(self.config['resetGPIOPin'])
+                    )
+
+        if 'GPIO' in (self.config['sensingMethod'], self.config['sensingMethodSecondary']):
             self._logger.info("Using GPIO sensing to determine PSU on/off state.")
             self._logger.info("Configuring GPIO for pin {}".format(self.config['senseGPIOPin']))
 
@@ -228,6 +465,20 @@ class PSUControl(octoprint.plugin.StartupPlugin,
                 self._logger.exception(
                     "Exception while setting up GPIO pin {}".format(self.config['senseGPIOPin'])
                 )
+                return
+
+            if self.config['senseGPIODebounce']:
+                self._logger.info("Debouncing GPIO sensing at {}Hz over {} samples".format(
+                    self.config['senseGPIODebounceRate'], self.config['senseGPIODebounceSamples']))
+                self._senseDebouncer = DebouncedInput(pin.read,
+                                                      self.config['senseGPIODebounceRate'],
+                                                      self.config['senseGPIODebounceSamples'],
+                                                      self.config['senseGPIODebounceStableTime'] / 1000.0,
+                                                      on_change=self.check_psu_state,
+                                                      logger=self._logger)
+                if self._powerSaving.active:
+                    self._senseDebouncer.pause()
+                self._senseDebouncer.start()
 
 
     def _get_plugin_key(self, implementation):
@@ -252,82 +503,274 @@ class PSUControl(octoprint.plugin.StartupPlugin,
 
     def _check_psu_state(self):
         while True:
-            old_isPSUOn = self.isPSUOn
+            with self._tracer.span("check_psu_state"):
+                changed = self._senseFlight()
 
-            self._logger.debug("Polling PSU state...")
+            if self.config['senseAdaptivePolling']:
+                interval = self._pollInterval.next_interval(changed, self._printer.is_printing())
+            else:
+                interval = self.config['sensePollingInterval']
 
-            if self.config['sensingMethod'] == 'GPIO':
-                r = 0
-                try:
+            if self._powerSaving.active:
+                interval = max(interval, self.config['powerSavingPollingInterval'])
+
+            self._check_psu_state_event.wait(interval)
+            self._check_psu_state_event.clear()
+
+
+    def _boost_polling(self):
+        if self.config['senseAdaptivePolling']:
+            self._pollInterval.boost()
+            self.check_psu_state()
+
+
+    def _sense(self, method):
+        if method == 'GPIO':
+            r = 0
+            try:
+                if self._senseDebouncer is not None:
+                    r = self._senseDebouncer.read()
+                else:
                     r = self._configuredGPIOPins['sense'].read()
-                except Exception:
-                    self._logger.exception("Exception while reading GPIO line")
+            except Exception:
+                self._logger.exception("Exception while reading GPIO line")
+
+            self._logger.debug("Result: {}".format(r))
 
-                self._logger.debug("Result: {}".format(r))
+            return r ^ self.config['invertsenseGPIOPin']
+        elif method == 'SYSTEM':
+            new_isPSUOn = False
 
-                new_isPSUOn = r ^ self.config['invertsenseGPIOPin']
+            p = subprocess.Popen(self.config['senseSystemCommand'], shell=True)
+            self._logger.debug("Sensing system command executed. PID={}, Command={}".format(p.pid, self.config['senseSystemCommand']))
+            r = p.wait()
+            self._logger.debug("Sensing system command returned: {}".format(r))
 
-                self.isPSUOn = new_isPSUOn
-            elif self.config['sensingMethod'] == 'SYSTEM':
+            if r == 0:
+                new_isPSUOn = True
+            elif r == 1:
                 new_isPSUOn = False
 
-                p = subprocess.Popen(self.config['senseSystemCommand'], shell=True)
-                self._logger.debug("Sensing system command executed. PID={}, Command={}".format(p.pid, self.config['senseSystemCommand']))
-                while p.poll() is None:
-                    time.sleep(0.1)
-                r = p.returncode
-                self._logger.debug("Sensing system command returned: {}".format(r))
-
-                if r == 0:
-                    new_isPSUOn = True
-                elif r == 1:
-                    new_isPSUOn = False
-
-                self.isPSUOn = new_isPSUOn
-            elif self.config['sensingMethod'] == 'INTERNAL':
-                self.isPSUOn = self._noSensing_isPSUOn
-            elif self.config['sensingMethod'] == 'PLUGIN':
-                p = self.config['sensingPlugin']
-
-                r = False
-
-                if p not in self._sub_plugins:
-                    self._logger.error('Plugin {} is configured for sensing but it is not registered.'.format(p))
-                elif not hasattr(self._sub_plugins[p], 'get_psu_state'):
-                    self._logger.error('Plugin {} is configured for sensing but get_psu_state is not defined.'.format(p))
-                else:
-                    callback = self._sub_plugins[p].get_psu_state
-                    try:
-                        r = callback()
-                    except Exception:
-                        self._logger.exception(
-                            "Error while executing callback {}".format(
-                                callback
-                            ),
-                            extra={"callback": fqfn(callback)},
-                        )
-
-                self.isPSUOn = r
+            return new_isPSUOn
+        elif method == 'INTERNAL':
+            return self._noSensing_isPSUOn
+        elif method == 'PLUGIN':
+            p = self.config['sensingPlugin']
+
+            r = False
+
+            if p not in self._sub_plugins:
+                self._logger.error('Plugin {} is configured for sensing but it is not registered.'.format(p))
+            elif not hasattr(self._sub_plugins[p], 'get_psu_state'):
+                self._logger.error('Plugin {} is configured for sensing but get_psu_state is not defined.'.format(p))
             else:
-                self.isPSUOn = False
+                callback = self._sub_plugins[p].get_psu_state
+                try:
+                    r = callback()
+                except Exception:
+                    self._logger.exception(
+                        "Error while executing callback {}".format(
+                            callback
+                        ),
+                        extra={"callback": fqfn(callback)},
+                    )
+
+            return r
+        else:
+            return False
 
-            self._logger.debug("isPSUOn: {}".format(self.isPSUOn))
 
-            if (old_isPSUOn != self.isPSUOn):
-                self._logger.debug("PSU state changed, firing psu_state_changed event.")
+    def _sense_tiered(self):
+        primary = bool(self._sense(self.config['sensingMethod']))
+        self._senseStats['primary'] += 1
 
-                event = Events.PLUGIN_PSUCONTROL_PSU_STATE_CHANGED
-                self._event_bus.fire(event, payload=dict(isPSUOn=self.isPSUOn))
+        if not self.config['sensingMethodSecondary']:
+            return primary
 
-            if (old_isPSUOn != self.isPSUOn) and self.isPSUOn:
-                self._start_idle_timer()
-            elif (old_isPSUOn != self.isPSUOn) and not self.isPSUOn:
-                self._stop_idle_timer()
+        now = time.time()
+        if (self._secondarySenseRequested or
+                self._lastSecondarySense is None or
+                primary != self._lastSecondarySense or
+                now - self._lastSecondarySenseTime >= self.config['secondarySensePollingInterval']):
+            self._secondarySenseRequested = False
+            self._lastSecondarySense = bool(self._sense(self.config['sensingMethodSecondary']))
+            self._lastSecondarySenseTime = now
+            self._senseStats['secondary'] += 1
+            self._logger.debug("Secondary sensing result: {}".format(self._lastSecondarySense))
 
-            self._plugin_manager.send_plugin_message(self._identifier, dict(isPSUOn=self.isPSUOn))
+        if primary == self._lastSecondarySense:
+            return primary
+
+        self._senseStats['conflicts'] += 1
+        self._logger.debug("Sensing conflict: primary={}, secondary={}".format(primary, self._lastSecondarySense))
+
+        if self.config['senseConflictResolution'] == 'PRIMARY':
+            return primary
+        elif self.config['senseConflictResolution'] == 'ON':
+            return primary or self._lastSecondarySense
+        else:
+            return self._lastSecondarySense
+
+
+    def _request_secondary_sense(self):
+        self._secondarySenseRequested = True
+
+
+    def _update_psu_state(self):
+        old_isPSUOn = self.isPSUOn
+
+        self._logger.debug("Polling PSU state...")
+
+        first_sense = self._lastSenseTime == 0
+        sense_time = time.time()
+        self.isPSUOn = self._sense_tiered()
+        self._lastSenseTime = sense_time
+
+        if self.config['sensingMethod'] != 'INTERNAL':
+            self._stateConfirmed = True
+
+        self._logger.debug("isPSUOn: {}".format(self.isPSUOn))
+
+        self._powerState.sensed(self.isPSUOn)
+
+        if (old_isPSUOn != self.isPSUOn):
+            self._logger.debug("PSU state changed, firing psu_state_changed event.")
+
+            event = Events.PLUGIN_PSUCONTROL_PSU_STATE_CHANGED
+            self._event_bus.fire(event, payload=dict(isPSUOn=self.isPSUOn))
+
+            if self._controlSocket is not None:
+                self._controlSocket.publish(self.isPSUOn)
+
+            self._save_state()
+
+            # a manual override only lasts until the PSU is switched
+            self._idleTimerOverride = False
+
+        if (old_isPSUOn != self.isPSUOn) and self.isPSUOn:
+            self._start_idle_timer()
+        elif (old_isPSUOn != self.isPSUOn) and not self.isPSUOn:
+            self._stop_idle_timer()
+
+        if old_isPSUOn != self.isPSUOn or first_sense:
+            thread = threading.Thread(target=self._exit_power_saving if self.isPSUOn else self._enter_power_saving)
+            thread.daemon = True
+            thread.start()
+
+        self._plugin_manager.send_plugin_message(self._identifier, dict(isPSUOn=self.isPSUOn, confirmed=self._stateConfirmed))
+
+        with self._psuStateCondition:
+            self._psuStateCondition.notify_all()
+
+        return old_isPSUOn != self.isPSUOn
+
+
+    def _get_commands(self, key):
+        return [c.strip() for c in self.config[key].splitlines() if c.strip()]
+
+
+    def _block_connect(self):
+        # G-code switching needs the printer connection to turn the PSU on again
+        return self.config['powerSavingBlockConnect'] and self.config['switchingMethod'] != 'GCODE'
+
+
+    def _enter_power_saving(self):
+        if not self.config['enablePowerSaving']:
+            return
+
+        def cancel_connect():
+            if self._block_connect() and \
+                    self._printer.get_state_id() in ('OPEN_SERIAL', 'DETECT_SERIAL', 'DETECT_BAUDRATE', 'CONNECTING'):
+                self._logger.info("Cancelling printer connection attempt, the PSU is off")
+                self._printer.disconnect()
+
+        with self._tracer.span("power_saving_enter"):
+            duration = self._powerSaving.enter(self._get_commands('powerSavingStopCommands'),
+                                               self.config['powerSavingCommandTimeout'],
+                                               actions=cancel_connect)
+
+        if duration is not None:
+            self._logger.info("Entered power saving in {:.3f}s".format(duration))
+            if self._senseDebouncer is not None:
+                self._senseDebouncer.pause()
+
+
+    def _exit_power_saving(self):
+        with self._tracer.span("power_saving_exit"):
+            duration = self._powerSaving.exit(self._get_commands('powerSavingStartCommands'),
+                                              self.config['powerSavingCommandTimeout'])
+
+        if duration is not None:
+            self._logger.info("Left power saving in {:.3f}s".format(duration))
+            if self._senseDebouncer is not None:
+                self._senseDebouncer.resume()
+            self.check_psu_state()
+
+
+    def _wait_for_psu_state(self, state, timeout, preempt=None):
+        if preempt is None:
+            preempt = self._preemption.begin()
+        deadline = time.time() + timeout
+        next_check = 0
+
+        with self._psuStateCondition:
+            while bool(self.isPSUOn) != state:
+                if preempt.is_preempted():
+                    return False
+
+                now = time.time()
+                remaining = deadline - now
+                if remaining <= 0:
+                    return False
+
+                # keep sensing while waiting rather than relying on the poll interval
+                if now >= next_check:
+                    self.check_psu_state()
+                    next_check = now + 0.1
+                self._psuStateCondition.wait(min(remaining, next_check - now))
+
+        return True
+
+
+    def _get_serial_port(self):
+        port = self._settings.global_get(["serial", "port"])
+        if not port or port == "AUTO":
+            return None
+        return port
+
+
+    def _wait_for_power_ready(self, preempt):
+        # postOnDelay caps the probes, powerReadyTimeout is only used if it is 0
+        timeout = self.config['postOnDelay'] or self.config['powerReadyTimeout']
+        deadline = time.time() + timeout
+        probed = False
+
+        if self.config['sensingMethod'] in ('GPIO', 'SYSTEM', 'PLUGIN'):
+            probed = True
+            if self._wait_for_psu_state(True, timeout, preempt):
+                self._logger.debug("PSU sensed on after {:.3f}s".format(timeout - (deadline - time.time())))
+            elif not preempt.is_preempted():
+                self._logger.warning("PSU not sensed on within {}s".format(timeout))
+
+        port = self._get_serial_port()
+        if self.config['connectOnPowerOn'] and port is not None:
+            probed = True
+            if wait_for_path(port, max(0, deadline - time.time())):
+                self._logger.debug("Serial port {} is available".format(port))
+            else:
+                self._logger.warning("Serial port {} did not appear within {}s".format(port, timeout))
+
+        # without anything to probe fall back to the fixed delay
+        if not probed:
+            preempt.wait(0.1 + self.config['postOnDelay'])
+
+
+    def _wait_for_firmware_response(self):
+        if self._firmwareResponseEvent.wait(self.config['connectTimeout']):
+            self._logger.debug("Received first response from firmware")
+        else:
+            self._logger.warning("No response from firmware within {}s of connecting".format(self.config['connectTimeout']))
 
-            self._check_psu_state_event.wait(self.config['sensePollingInterval'])
-            self._check_psu_state_event.clear()
 
     def _set_start_time(self):
         self._idleStartTime = time.time()
@@ -340,10 +783,10 @@ class PSUControl(octoprint.plugin.StartupPlugin,
         if self._idleStartTime == 0 or not self.config['powerOffWhenIdle'] or \
                 not self._countdown_visible() or self._idleTimerOverride or \
                 self._printer.is_printing() or self._printer.is_paused():
-            self.idleTimeLeft = None
+            self._idleTimeLeft = None
         else:
-            self.idleTimeLeft = time.strftime("%-M:%S", time.gmtime((self.config['idleTimeout'] * 60) - (time.time() - self._idleStartTime)))
-        self._plugin_manager.send_plugin_message(self._identifier, dict(idleTimeLeft=self.idleTimeLeft))
+            self._idleTimeLeft = time.strftime("%-M:%S", time.gmtime((self.config['idleTimeout'] * 60) - (time.time() - self._idleStartTime)))
+        self._plugin_manager.send_plugin_message(self._identifier, dict(idleTimeLeft=self._idleTimeLeft))
 
     def _start_idle_timer(self):
         self._stop_idle_timer()
@@ -389,12 +832,17 @@ class PSUControl(octoprint.plugin.StartupPlugin,
         if self._idleTimerOverride:
             return
 
-        self._logger.info("Idle timeout reached after {} minute(s). Turning heaters off prior to shutting off PSU.".format(self.config['idleTimeout']))
-        if self._wait_for_heaters():
-            self._logger.info("Heaters below temperature.")
-            self.turn_psu_off()
-        else:
-            self._logger.info("Aborted PSU shut down due to activity.")
+        with self._tracer.span("idle_poweroff"):
+            self._logger.info("Idle timeout reached after {} minute(s). Turning heaters off prior to shutting off PSU.".format(self.config['idleTimeout']))
+            with self._tracer.span("wait_for_heaters") as span:
+                heaters_cooled = self._wait_for_heaters()
+                span.set(cooled=heaters_cooled)
+
+            if heaters_cooled:
+                self._logger.info("Heaters below temperature.")
+                self.turn_psu_off()
+            else:
+                self._logger.info("Aborted PSU shut down due to activity.")
 
 
     def _wait_for_heaters(self):
@@ -459,6 +907,163 @@ class PSUControl(octoprint.plugin.StartupPlugin,
             time.sleep(5)
 
 
+    def _reschedule(self):
+        if self._scheduler is None:
+            return
+
+        self._scheduler.clear()
+        self._scheduleRetry = None
+
+        for entry in self.config['schedules']:
+            if not entry.get('enabled', True):
+                continue
+
+            try:
+                if entry.get('type') == 'window':
+                    self._schedule_window_event(entry, True)
+                    self._schedule_window_event(entry, False)
+                elif entry.get('type') == 'once':
+                    when = to_timestamp(parse_local_datetime(entry['at']))
+                    if when <= time.time():
+                        self._logger.debug("Skipping past schedule: {}".format(entry))
+                        continue
+                    self._scheduler.schedule(when, self._run_once_event, args=[entry], name=entry['action'])
+                else:
+                    self._logger.warning("Ignoring schedule of unknown type: {}".format(entry))
+            except (KeyError, ValueError, TypeError):
+                self._logger.warning("Ignoring invalid schedule: {}".format(entry))
+
+        self._send_next_schedule()
+
+
+    def _schedule_window_event(self, entry, on):
+        key = 'on' if on else 'off'
+        if not entry.get(key):
+            return
+
+        dt = next_weekly_occurrence(entry[key], entry.get('days', range(7)))
+        if dt is None:
+            return
+
+        self._logger.debug("Scheduling power {} at {}".format(key, dt))
+        self._scheduler.schedule(to_timestamp(dt), self._run_window_event, args=[entry, on], name=key)
+
+
+    def _run_window_event(self, entry, on):
+        self._schedule_window_event(entry, on)
+        self._dispatch_scheduled_power(on)
+
+
+    def _run_once_event(self, entry):
+        schedules = [e for e in self._settings.get(["schedules"]) if e != entry]
+        self._settings.set(["schedules"], schedules)
+        self._settings.save()
+        self.config['schedules'] = schedules
+
+        self._dispatch_scheduled_power(entry['action'] == 'on')
+
+
+    def _schedule_off_blocked(self):
+        if self.config['scheduleNeverOffWhilePrinting'] and (self._printer.is_printing() or self._printer.is_paused()):
+            return "printing"
+
+        if self.config['scheduleStayOnWhileJobQueued'] and self._jobQueued:
+            return "job queued"
+
+        return None
+
+
+    def _dispatch_scheduled_power(self, on):
+        # switching can take a while, keep it off the scheduler thread so later entries run on time
+        thread = threading.Thread(target=self._scheduled_power, args=(on,))
+        thread.daemon = True
+        thread.start()
+
+
+    def _scheduled_power(self, on):
+        with self._scheduleLock:
+            if self._scheduleRetry is not None:
+                self._scheduler.cancel(self._scheduleRetry)
+                self._scheduleRetry = None
+
+            if on and self._emergencyLatch is not None:
+                self._logger.warning("Scheduled power on skipped, emergency off is latched: {}".format(self._emergencyLatch))
+                self._send_next_schedule()
+                return
+
+            reason = None if on else self._schedule_off_blocked()
+            if reason is not None:
+                self._logger.info("Scheduled power off postponed ({})".format(reason))
+                self._scheduleRetry = self._scheduler.schedule(time.time() + 60, self._dispatch_scheduled_power, args=[False], name='off')
+
+        if reason is None:
+            self._logger.info("Scheduled power {}".format('on' if on else 'off'))
+            self._request_power(on, force=False)
+
+        self._send_next_schedule()
+
+
+    def _get_next_schedule(self):
+        if self._scheduler is None:
+            return None
+
+        pending = self._scheduler.pending()
+        if not pending:
+            return None
+
+        return dict(action=pending[0].name, time=pending[0].when)
+
+
+    def _send_next_schedule(self):
+        self._plugin_manager.send_plugin_message(self._identifier, dict(nextSchedule=self._get_next_schedule()))
+
+
+    def prescan_file(self, path):
+        try:
+            file_hash = self._file_manager.get_metadata("local", path).get("hash")
+        except Exception:
+            file_hash = None
+
+        with self._prescanLock:
+            with self._tracer.span("prescan", path=path):
+                return self._prescanCache.get(self._file_manager.path_on_disk("local", path),
+                                              self._autoOnTriggerGCodeCommandsArray,
+                                              self._idleIgnoreCommandsArray,
+                                              file_hash=file_hash)
+
+
+    def _prescan_uploaded_file(self, path):
+        # fills the cache so selecting the file later does not scan it again
+        try:
+            result = self.prescan_file(path)
+        except Exception:
+            self._logger.exception("Error while pre-scanning {}".format(path))
+            return
+
+        self._logger.debug("Pre-scan of uploaded {}: {}".format(path, result))
+
+
+    def _prescan_selected_file(self, path):
+        try:
+            result = self.prescan_file(path)
+        except Exception:
+            self._logger.exception("Error while pre-scanning {}".format(path))
+            return
+
+        self._prescanResult = dict(path=path, result=result)
+        self._logger.debug("Pre-scan of {}: {}".format(path, result))
+
+        if not self.config['powerOffWhenIdle']:
+            return
+
+        timeout = self.config['idleTimeout'] * 60
+        long_gaps = [g for g in result['ignoredGaps'] if g['seconds'] >= timeout]
+        if long_gaps:
+            self._logger.warning("{} contains {} run(s) of idle-ignored commands longer than the idle timeout. Longest is {}s at line {}.".format(
+                path, len(long_gaps), long_gaps[0]['seconds'], long_gaps[0]['startLine']))
+            self._plugin_manager.send_plugin_message(self._identifier, dict(prescanWarning=dict(path=path, gaps=long_gaps, idleTimeout=timeout)))
+
+
     def hook_gcode_queuing(self, comm_instance, phase, cmd, cmd_type, gcode, *args, **kwargs):
         skipQueuing = False
 
@@ -475,9 +1080,12 @@ class PSUControl(octoprint.plugin.StartupPlugin,
                 comm_instance._log("PSUControl: ok")
                 skipQueuing = True
 
-        if (not self.isPSUOn and self.config['autoOn'] and (gcode in self._autoOnTriggerGCodeCommandsArray)):
+        if (not self.isPSUOn and self.config['autoOn'] and self._emergencyLatch is None and
+                (gcode in self._autoOnTriggerGCodeCommandsArray)):
             self._logger.info("Auto-On - Turning PSU On (Triggered by {})".format(gcode))
-            self.turn_psu_on()
+            with self._tracer.span("auto_on", gcode=gcode):
+                self._boost_polling()
+                self._request_power(True, force=False)
 
         if self.config['powerOffWhenIdle'] and self.isPSUOn and not self._skipIdleTimer:
             if not (gcode in self._idleIgnoreCommandsArray):
@@ -488,134 +1096,446 @@ class PSUControl(octoprint.plugin.StartupPlugin,
             return (None,)
 
 
+    def hook_gcode_received(self, comm_instance, line, *args, **kwargs):
+        if not self._firmwareResponseEvent.is_set():
+            self._firmwareResponseEvent.set()
+        return line
+
+
+    def hook_handle_connect(self, printer, *args, **kwargs):
+        if self._powerSaving.active and self._block_connect() and \
+                self._powerState.state == PowerStateMachine.OFF:
+            # polling is slowed down while power saving, the PSU may have been turned on since
+            if not self.get_psu_state(max_age=0):
+                self._logger.info("Skipping printer connection while the PSU is off")
+                return True
+        return False
+
+
+    def hook_temperatures_received(self, comm_instance, parsed_temperatures, *args, **kwargs):
+        if not self.config['enableRunawayDetection'] or self._runawayTriggered:
+            return parsed_temperatures
+
+        for heater, (actual, target) in parsed_temperatures.items():
+            if actual is None or target is None or target > 0:
+                self._runawayBaseline.pop(heater, None)
+                continue
+
+            baseline = self._runawayBaseline.get(heater)
+            if baseline is None or actual < baseline:
+                self._runawayBaseline[heater] = actual
+            elif actual - baseline > self.config['runawayTemperatureRise']:
+                self._runawayTriggered = True
+                reason = "Thermal runaway on {}: {:.1f}C with target 0, up from {:.1f}C".format(heater, actual, baseline)
+                thread = threading.Thread(target=self.emergency_off, args=(reason, time.time()))
+                thread.daemon = True
+                thread.start()
+                break
+
+        return parsed_temperatures
+
+
+    def emergency_off(self, reason, triggered=None, latch=True):
+        """Cut power immediately.
+
+        Skips the pre-off script, the heater wait and the post-switch delays,
+        and aborts any power operation in flight. With ``latch`` the PSU stays
+        off until the latch is cleared, and the job is cancelled.
+        """
+        if triggered is None:
+            triggered = time.time()
+
+        # latched before preempting, an operation starting after the preempt sees the latch
+        if latch:
+            self._emergencyLatch = reason
+        self._preemption.preempt()
+        self._waitForHeaters = False
+        self._firmwareResponseEvent.set()
+        with self._psuStateCondition:
+            self._psuStateCondition.notify_all()
+
+        with self._tracer.span("emergency_off", reason=reason) as span:
+            if self.config['switchingMethod'] == 'GCODE':
+                self._logger.warning("Emergency off with GCODE switching depends on the printer connection")
+
+            result = self._switch_psu(False, confirm=False)
+            latency = (time.time() - triggered) * 1000
+            span.set(result=result, latency=latency)
+
+        self._powerState.preempt(False)
+        if self.config['sensingMethod'] not in ('GPIO', 'SYSTEM', 'PLUGIN'):
+            self._noSensing_isPSUOn = False
+
+        stats = self._emergencyStats
+        stats['count'] += 1
+        stats['lastLatency'] = round(latency, 3)
+        stats['maxLatency'] = round(max(stats['maxLatency'], latency), 3)
+        stats['lastReason'] = reason
+        stats['lastTime'] = triggered
+
+        if latency > self.config['emergencyOffLatencyTarget']:
+            stats['overTarget'] += 1
+            self._logger.warning("Emergency off took {:.1f}ms, target is {}ms".format(latency, self.config['emergencyOffLatencyTarget']))
+
+        self._logger.warning("Emergency off ({}): {} in {:.1f}ms".format(reason, "PSU switched off" if result else "switching failed", latency))
+
+        message = dict(emergencyOff=dict(reason=reason, result=result, latency=latency))
+        if latch:
+            self._save_state()
+            message['emergencyLatch'] = reason
+        self._plugin_manager.send_plugin_message(self._identifier, message)
+
+        if self._workflow is not None:
+            self._workflow.cancel()
+
+        if latch:
+            if self._printer.is_printing() or self._printer.is_paused():
+                self._logger.info("Cancelling the print job after emergency off")
+                self._printer.cancel_print()
+
+            # GCODE switching needs the connection to keep the PSU off
+            if self.config['switchingMethod'] != 'GCODE':
+                self._printer.disconnect()
+
+        self.check_psu_state()
+        return result
+
+
+    def clear_emergency_off(self):
+        if self._emergencyLatch is None:
+            return
+
+        self._logger.info("Clearing emergency off: {}".format(self._emergencyLatch))
+        self._emergencyLatch = None
+        self._runawayTriggered = False
+        self._runawayBaseline.clear()
+        self._save_state()
+        self._plugin_manager.send_plugin_message(self._identifier, dict(emergencyLatch=None))
+
+
+    def start_print_workflow(self, path, origin="local", script=None, timeout=60):
+        """Power on, wait until ready, connect, run an optional script and print ``path``.
+
+        Returns the started workflow, or None if another one is still running.
+        """
+        def power_on(wf):
+            if self._powerState.state == PowerStateMachine.ON:
+                return False
+            if not self.turn_psu_on():
+                raise WorkflowError("Unable to switch PSU on")
+            wf.add_cleanup(lambda: self._printer.is_printing() or self.turn_psu_off())
+
+        def wait_ready(wf):
+            if not self._wait_for_psu_state(True, timeout):
+                raise WorkflowError("PSU not sensed on within {}s".format(timeout))
+
+        def connect(wf):
+            if self._printer.is_closed_or_error():
+                self._printer.connect()
+                wf.add_cleanup(lambda: self._printer.is_printing() or self._printer.disconnect())
+
+            def connected():
+                if self._printer.get_state_id() in ("ERROR", "CLOSED_WITH_ERROR"):
+                    raise WorkflowError("Printer connection failed")
+                return self._printer.is_operational()
+            wf.wait_for(connected, timeout, "printer connection")
+
+        def run_script(wf):
+            if not script:
+                return False
+            try:
+                self._printer.script(script)
+            except Exception as e:
+                raise WorkflowError("Unable to run script {}: {}".format(script, e))
+
+        def start_print(wf):
+            self._printer.select_file(path, origin == "sdcard", printAfterSelect=True)
+            wf.wait_for(self._printer.is_printing, timeout, "print job to start")
+
+        steps = [("power_on", power_on),
+                 ("wait_ready", wait_ready),
+                 ("connect", connect),
+                 ("script", run_script),
+                 ("print", start_print)]
+
+        with self._workflowLock:
+            if self._workflow is not None and self._workflow.is_active():
+                return None
+
+            self._workflow = Workflow("powerOnAndPrint", steps, on_update=self._send_workflow, logger=self._logger)
+            self._workflows[self._workflow.id] = self._workflow
+            while len(self._workflows) > 10:
+                self._workflows.popitem(last=False)
+
+        self._logger.info("Starting workflow {} for {}".format(self._workflow.id, path))
+        self._workflow.start()
+        return self._workflow
+
+
+    def _send_workflow(self, workflow):
+        self._plugin_manager.send_plugin_message(self._identifier, dict(workflow=workflow.to_dict()))
+
+
     def turn_psu_on(self):
+        return self._request_power(True)
+
+
+    def turn_psu_off(self):
+        return self._request_power(False)
+
+
+    def toggle_psu(self):
+        return self._request_power(None)
+
+
+    def _request_power(self, target, force=True, raise_rejected=False):
+        """Switch to ``target``, or toggle if it is None.
+
+        Requests held back by output protection return False, or raise
+        ``SwitchRejected`` with ``raise_rejected``.
+        """
+        name = 'toggle_psu' if target is None else ('turn_psu_on' if target else 'turn_psu_off')
+        with self._tracer.span(name):
+            try:
+                if target is None:
+                    return self._powerState.toggle()
+                return self._powerState.request(target, force=force)
+            except SwitchRejected as e:
+                self._logger.warning("Switching PSU {} rejected by output protection: {}".format(
+                    'toggle' if target is None else ('on' if target else 'off'), e))
+                if raise_rejected:
+                    raise
+                return False
+
+
+    def _pulse_gpio(self, name):
+        active = not self.config['invertonoffGPIOPin']
+        width = self.config['switchingGPIOPulseWidth'] / 1000.0
+        pin = self._configuredGPIOPins[name]
+
+        try:
+            pin.write(active)
+            elapsed = precise_sleep(width)
+        finally:
+            pin.write(not active)
+
+        error = abs(elapsed - width) * 1000
+        self._pulseStats['count'] += 1
+        self._pulseStats['lastWidth'] = round(elapsed * 1000, 3)
+        self._pulseStats['maxError'] = round(max(self._pulseStats['maxError'], error), 3)
+        self._logger.debug("Pulsed {} pin for {:.3f}ms".format(name, elapsed * 1000))
+
+
+    def _switch_psu(self, on, confirm=True):
+        state = 'On' if on else 'Off'
+
+        if self.config['switchingMethod'] == 'GCODE':
+            command = self.config['onGCodeCommand' if on else 'offGCodeCommand']
+            self._logger.debug("Switching PSU {} Using GCODE: {}".format(state, command))
+            self._printer.commands(command)
+        elif self.config['switchingMethod'] == 'SYSTEM':
+            command = self.config['onSysCommand' if on else 'offSysCommand']
+            self._logger.debug("Switching PSU {} Using SYSTEM: {}".format(state, command))
+
+            p = subprocess.Popen(command, shell=True)
+            self._logger.debug("{} system command executed. PID={}, Command={}".format(state, p.pid, command))
+            r = p.wait()
+
+            self._logger.debug("{} system command returned: {}".format(state, r))
+        elif self.config['switchingMethod'] == 'GPIO' and self.config['switchingGPIOMode'] in ('PULSE', 'LATCHING'):
+            mode = self.config['switchingGPIOMode']
+            sensed = self.config['sensingMethod'] != 'INTERNAL'
+
+            if mode == 'PULSE':
+                # a pulse toggles the PSU, so only pulse when it is not already in the requested state
+                is_on = self._sense(self.config['sensingMethod']) if sensed else self.isPSUOn
+                if bool(is_on) == on:
+                    self._logger.debug("PSU already {}, not pulsing".format(state))
+                    return True
+
+            name = 'reset' if mode == 'LATCHING' and not on else 'switch'
+            self._logger.debug("Switching PSU {} Using GPIO {} pulse: {}".format(state, mode, self.config['onoffGPIOPin' if name == 'switch' else 'resetGPIOPin']))
+
+            try:
+                self._pulse_gpio(name)
+            except Exception:
+                self._logger.exception("Exception while pulsing GPIO line")
+                return False
+
+            if confirm and sensed:
+                if not self._wait_for_psu_state(on, self.config['switchingGPIOConfirmTimeout']):
+                    self._logger.warning("PSU not sensed {} within {}s of the pulse".format(state.lower(), self.config['switchingGPIOConfirmTimeout']))
+                    return False
+        elif self.config['switchingMethod'] == 'GPIO':
+            self._logger.debug("Switching PSU {} Using GPIO: {}".format(state, self.config['onoffGPIOPin']))
+            pin_output = bool(int(on) ^ self.config['invertonoffGPIOPin'])
+
+            try:
+                self._configuredGPIOPins['switch'].write(pin_output)
+            except Exception:
+                self._logger.exception("Exception while writing GPIO line")
+                return False
+        elif self.config['switchingMethod'] == 'PLUGIN':
+            p = self.config['switchingPlugin']
+            self._logger.debug("Switching PSU {} Using PLUGIN: {}".format(state, p))
+
+            function = 'turn_psu_on' if on else 'turn_psu_off'
+            if p not in self._sub_plugins:
+                self._logger.error('Plugin {} is configured for switching but it is not registered.'.format(p))
+                return False
+            elif not hasattr(self._sub_plugins[p], function):
+                self._logger.error('Plugin {} is configured for switching but {} is not defined.'.format(p, function))
+                return False
+            else:
+                callback = getattr(self._sub_plugins[p], function)
+                try:
+                    r = callback()
+                except Exception:
+                    self._logger.exception(
+                        "Error while executing callback {}".format(
+                            callback
+                        ),
+                        extra={"callback": fqfn(callback)},
+                    )
+                    return False
+        else:
+            return False
+
+        self._outputProtection.record(on)
+        return True
+
+
+    def _turn_psu_on(self):
+        # captured before checking the latch, an emergency off after the check still preempts
+        preempt = self._preemption.begin()
+
+        if self._emergencyLatch is not None:
+            self._logger.warning("Not switching PSU On while emergency off is latched: {}".format(self._emergencyLatch))
+            return False
+
         if self.config['switchingMethod'] in ['GCODE', 'GPIO', 'SYSTEM', 'PLUGIN']:
+            if not self._outputProtection.acquire(True, abort=preempt.event):
+                return False
+
+            self._runawayTriggered = False
+            self._runawayBaseline.clear()
+
             self._logger.info("Switching PSU On")
-            if self.config['switchingMethod'] == 'GCODE':
-                self._logger.debug("Switching PSU On Using GCODE: {}".format(self.config['onGCodeCommand']))
-                self._printer.commands(self.config['onGCodeCommand'])
-            elif self.config['switchingMethod'] == 'SYSTEM':
-                self._logger.debug("Switching PSU On Using SYSTEM: {}".format(self.config['onSysCommand']))
-
-                p = subprocess.Popen(self.config['onSysCommand'], shell=True)
-                self._logger.debug("On system command executed. PID={}, Command={}".format(p.pid, self.config['onSysCommand']))
-                while p.poll() is None:
-                    time.sleep(0.1)
-                r = p.returncode
-
-                self._logger.debug("On system command returned: {}".format(r))
-            elif self.config['switchingMethod'] == 'GPIO':
-                self._logger.debug("Switching PSU On Using GPIO: {}".format(self.config['onoffGPIOPin']))
-                pin_output = bool(1 ^ self.config['invertonoffGPIOPin'])
+            with self._tracer.span("switch", method=self.config['switchingMethod'], state=True):
+                if not self._switch_psu(True):
+                    return False
 
-                try:
-                    self._configuredGPIOPins['switch'].write(pin_output)
-                except Exception :
-                    self._logger.exception("Exception while writing GPIO line")
-                    return
-            elif self.config['switchingMethod'] == 'PLUGIN':
-                p = self.config['switchingPlugin']
-                self._logger.debug("Switching PSU On Using PLUGIN: {}".format(p))
-
-                if p not in self._sub_plugins:
-                    self._logger.error('Plugin {} is configured for switching but it is not registered.'.format(p))
-                    return
-                elif not hasattr(self._sub_plugins[p], 'turn_psu_on'):
-                    self._logger.error('Plugin {} is configured for switching but turn_psu_on is not defined.'.format(p))
-                    return
-                else:
-                    callback = self._sub_plugins[p].turn_psu_on
-                    try:
-                        r = callback()
-                    except Exception:
-                        self._logger.exception(
-                            "Error while executing callback {}".format(
-                                callback
-                            ),
-                            extra={"callback": fqfn(callback)},
-                        )
-                        return
+            if preempt.is_preempted():
+                # an emergency off raced the switch, make sure it wins
+                self._switch_psu(False, confirm=False)
+                return False
+
+            thread = threading.Thread(target=self._exit_power_saving)
+            thread.daemon = True
+            thread.start()
+
+            self._stateConfirmed = True
+
+            self._boost_polling()
+            self._request_secondary_sense()
 
             if self.config['sensingMethod'] not in ('GPIO', 'SYSTEM', 'PLUGIN'):
                 self._noSensing_isPSUOn = True
 
-            time.sleep(0.1 + self.config['postOnDelay'])
+            with self._tracer.span("wait_ready"):
+                self._wait_for_power_ready(preempt)
 
-            self.check_psu_state()
+            if preempt.is_preempted():
+                return False
 
             if self.config['connectOnPowerOn'] and self._printer.is_closed_or_error():
-                self._printer.connect()
-                time.sleep(0.1)
+                self._firmwareResponseEvent.clear()
+                with self._tracer.span("connect"):
+                    self._printer.connect()
+                with self._tracer.span("wait_firmware"):
+                    self._wait_for_firmware_response()
+
+            if preempt.is_preempted():
+                return False
 
             if not self._printer.is_closed_or_error():
-                self._printer.script("psucontrol_post_on", must_be_set=False)
+                with self._tracer.span("script", script="psucontrol_post_on"):
+                    self._printer.script("psucontrol_post_on", must_be_set=False)
 
+            return True
 
-    def turn_psu_off(self):
+        return False
+
+
+    def _turn_psu_off(self):
         if self.config['switchingMethod'] in ['GCODE', 'GPIO', 'SYSTEM', 'PLUGIN']:
+            preempt = self._preemption.begin()
+            if not self._outputProtection.acquire(False, abort=preempt.event):
+                return False
+
             if not self._printer.is_closed_or_error():
-                self._printer.script("psucontrol_pre_off", must_be_set=False)
+                with self._tracer.span("script", script="psucontrol_pre_off"):
+                    self._printer.script("psucontrol_pre_off", must_be_set=False)
 
             self._logger.info("Switching PSU Off")
-            if self.config['switchingMethod'] == 'GCODE':
-                self._logger.debug("Switching PSU Off Using GCODE: {}".format(self.config['offGCodeCommand']))
-                self._printer.commands(self.config['offGCodeCommand'])
-            elif self.config['switchingMethod'] == 'SYSTEM':
-                self._logger.debug("Switching PSU Off Using SYSTEM: {}".format(self.config['offSysCommand']))
-
-                p = subprocess.Popen(self.config['offSysCommand'], shell=True)
-                self._logger.debug("Off system command executed. PID={}, Command={}".format(p.pid, self.config['offSysCommand']))
-                while p.poll() is None:
-                    time.sleep(0.1)
-                r = p.returncode
-
-                self._logger.debug("Off system command returned: {}".format(r))
-            elif self.config['switchingMethod'] == 'GPIO':
-                self._logger.debug("Switching PSU Off Using GPIO: {}".format(self.config['onoffGPIOPin']))
-                pin_output = bool(0 ^ self.config['invertonoffGPIOPin'])
+            with self._tracer.span("switch", method=self.config['switchingMethod'], state=False):
+                if not self._switch_psu(False):
+                    return False
 
-                try:
-                    self._configuredGPIOPins['switch'].write(pin_output)
-                except Exception:
-                    self._logger.exception("Exception while writing GPIO line")
-                    return
-            elif self.config['switchingMethod'] == 'PLUGIN':
-                p = self.config['switchingPlugin']
-                self._logger.debug("Switching PSU Off Using PLUGIN: {}".format(p))
-
-                if p not in self._sub_plugins:
-                    self._logger.error('Plugin {} is configured for switching but it is not registered.'.format(p))
-                    return
-                elif not hasattr(self._sub_plugins[p], 'turn_psu_off'):
-                    self._logger.error('Plugin {} is configured for switching but turn_psu_off is not defined.'.format(p))
-                    return
-                else:
-                    callback = self._sub_plugins[p].turn_psu_off
-                    try:
-                        r = callback()
-                    except Exception:
-                        self._logger.exception(
-                            "Error while executing callback {}".format(
-                                callback
-                            ),
-                            extra={"callback": fqfn(callback)},
-                        )
-                        return
+            self._stateConfirmed = True
+
+            self._boost_polling()
+            self._request_secondary_sense()
 
             if self.config['disconnectOnPowerOff']:
-                self._printer.disconnect()
+                with self._tracer.span("disconnect"):
+                    self._printer.disconnect()
 
             if self.config['sensingMethod'] not in ('GPIO', 'SYSTEM', 'PLUGIN'):
                 self._noSensing_isPSUOn = False
 
-            time.sleep(0.1)
             self.check_psu_state()
 
+            return True
 
-    def get_psu_state(self):
+        return False
+
+
+    def get_psu_state(self, max_age=None):
+        """Return the PSU state, sensing it first if the last sense is older than ``max_age`` seconds.
+
+        Concurrent callers share a single sense.
+        """
+        if max_age is not None and time.time() - self._lastSenseTime > max_age:
+            with self._tracer.span("fresh_sense", max_age=max_age):
+                self._senseFlight()
         return self.isPSUOn
 
 
+    def get_stats(self):
+        stats = dict(switching=self._powerState.get_stats(),
+                     sensingCalls=dict(self._senseStats, reads=self._senseFlight.get_stats()))
+
+        if self.config['senseAdaptivePolling']:
+            stats['polling'] = self._pollInterval.get_stats()
+        else:
+            stats['polling'] = dict(interval=self.config['sensePollingInterval'],
+                                    pollsPerMinute=round(60.0 / max(0.001, self.config['sensePollingInterval']), 2))
+
+        if self._senseDebouncer is not None:
+            stats['sensing'] = self._senseDebouncer.get_stats()
+
+        stats['outputProtection'] = self._outputProtection.get_stats()
+        stats['powerSaving'] = self._powerSaving.get_stats()
+
+        if self.config['switchingMethod'] == 'GPIO' and self.config['switchingGPIOMode'] != 'LEVEL':
+            stats['pulse'] = dict(self._pulseStats, width=self.config['switchingGPIOPulseWidth'])
+
+        stats['emergencyOff'] = dict(self._emergencyStats, latencyTarget=self.config['emergencyOffLatencyTarget'])
+
+        return stats
+
+
     def set_idle_timer_override(self, state):
         self._idleTimerOverride = state
         if state:
@@ -634,12 +1554,42 @@ class PSUControl(octoprint.plugin.StartupPlugin,
 
 
     def on_event(self, event, payload):
+        if self._workflow is not None:
+            self._workflow.notify()
+
+        if event == Events.FILE_SELECTED:
+            self._jobQueued = True
+        elif event in (Events.FILE_DESELECTED, Events.PRINT_DONE, Events.PRINT_FAILED, Events.PRINT_CANCELLED):
+            self._jobQueued = False
+
+        if event == Events.UPLOAD and self.config['prescanGCode'] and payload.get('target') == 'local' and \
+                valid_file_type(payload['path'], type="gcode"):
+            thread = threading.Thread(target=self._prescan_uploaded_file, args=(payload['path'],))
+            thread.daemon = True
+            thread.start()
+        elif event == Events.FILE_SELECTED and self.config['prescanGCode'] and payload.get('origin') == 'local':
+            self._prescanResult = None
+            thread = threading.Thread(target=self._prescan_selected_file, args=(payload['path'],))
+            thread.daemon = True
+            thread.start()
+        elif event == Events.PRINT_STARTED and self.config['autoOn'] and self.config['autoOnAtJobStart'] and not self.isPSUOn:
+            prescan = self._prescanResult
+            if (prescan is not None and prescan['path'] == payload.get('path') and
+                    prescan['result']['firstAutoOnTrigger'] is not None):
+                self._logger.info("Auto-On - Turning PSU On at job start (File triggers at line {})".format(
+                    prescan['result']['firstAutoOnTrigger']['line']))
+                self._boost_polling()
+                thread = threading.Thread(target=self._request_power, args=(True, False))
+                thread.daemon = True
+                thread.start()
+
         if event == Events.CLIENT_OPENED:
-            self._plugin_manager.send_plugin_message(self._identifier, dict(isPSUOn=self.isPSUOn))
+            self._plugin_manager.send_plugin_message(self._identifier, self._get_state_message())
             return
         elif event == Events.ERROR and self.config['turnOffWhenError']:
             self._logger.info("Firmware or communication error detected. Turning PSU Off")
-            self.turn_psu_off()
+            # errors also come from failed connection attempts while the printer is unpowered, so never latch
+            self.emergency_off("Firmware or communication error: {}".format(payload.get('error')), latch=False)
             return
 
 
@@ -649,23 +1599,36 @@ class PSUControl(octoprint.plugin.StartupPlugin,
             turnPSUOff=[],
             togglePSU=[],
             getPSUState=[],
+            getStats=[],
+            getTrace=[],
+            prescanFile=["path"],
             setPsuOverride=["state"],
+            powerOnAndPrint=["path"],
+            getWorkflow=["id"],
+            cancelWorkflow=["id"],
+            emergencyOff=[],
+            clearEmergencyOff=[],
         )
 
 
     def on_api_get(self, request):
-        return self.on_api_command("getPSUState", [])
+        data = dict()
+        if request.values.get('fresh', 'false') in valid_boolean_trues:
+            data['fresh'] = True
+        if 'max_age' in request.values:
+            data['max_age'] = request.values['max_age']
+        return self.on_api_command("getPSUState", data)
 
 
     def on_api_command(self, command, data):
-        if command in ['turnPSUOn', 'turnPSUOff', 'togglePSU', "setPsuOverride"]:
+        if command in ['turnPSUOn', 'turnPSUOff', 'togglePSU', "setPsuOverride", 'powerOnAndPrint', 'cancelWorkflow', 'emergencyOff', 'clearEmergencyOff']:
             try:
                 if not Permissions.PLUGIN_PSUCONTROL_CONTROL.can():
                     return make_response("Insufficient rights", 403)
             except:
                 if not user_permission.can():
                     return make_response("Insufficient rights", 403)
-        elif command in ['getPSUState']:
+        elif command in ['getPSUState', 'getStats', 'getTrace', 'prescanFile', 'getWorkflow']:
             try:
                 if not Permissions.STATUS.can():
                     return make_response("Insufficient rights", 403)
@@ -673,20 +1636,82 @@ class PSUControl(octoprint.plugin.StartupPlugin,
                 if not user_permission.can():
                     return make_response("Insufficient rights", 403)
 
-        if command == 'turnPSUOn':
-            self.turn_psu_on()
-        elif command == 'turnPSUOff':
-            self.turn_psu_off()
-        elif command == 'togglePSU':
-            if self.isPSUOn:
-                self.turn_psu_off()
-            else:
-                self.turn_psu_on()
+        # starting a print also needs the rights to select and print the file
+        if command == 'powerOnAndPrint':
+            try:
+                if not (Permissions.FILES_SELECT.can() and Permissions.PRINT.can()):
+                    return make_response("Insufficient rights", 403)
+            except:
+                if not user_permission.can():
+                    return make_response("Insufficient rights", 403)
+
+        if command in ('turnPSUOn', 'turnPSUOff', 'togglePSU'):
+            target = dict(turnPSUOn=True, turnPSUOff=False, togglePSU=None)[command]
+            if self._emergencyLatch is not None and (target or (target is None and not self.isPSUOn)):
+                return make_response(jsonify(error="Emergency off latched", reason=self._emergencyLatch), 409)
+
+            try:
+                self._request_power(target, raise_rejected=True)
+            except SwitchRejected as e:
+                return make_response(jsonify(error="Rejected by output protection",
+                                             reason=e.reason,
+                                             retryAfter=round(e.retry_after, 1),
+                                             rejected=self._outputProtection.rejected[e.reason]), 409)
         elif command == 'getPSUState':
-            return jsonify(isPSUOn=self.isPSUOn)
+            max_age = None
+            try:
+                if data.get('fresh'):
+                    max_age = 0
+                elif data.get('max_age') is not None:
+                    max_age = float(data['max_age'])
+            except (TypeError, ValueError):
+                return make_response("Invalid max_age", 400)
+
+            self.get_psu_state(max_age=max_age)
+            return jsonify(powerState=self._powerState.state,
+                           senseAge=round(time.time() - self._lastSenseTime, 3),
+                           **self._get_state_message())
+        elif command == 'getStats':
+            return jsonify(self.get_stats())
+        elif command == 'getTrace':
+            return jsonify(self._tracer.to_chrome_trace())
+        elif command == 'prescanFile':
+            if not self._file_manager.file_exists("local", data['path']):
+                return make_response("File not found", 404)
+            return jsonify(self.prescan_file(data['path']))
         elif command == "setPsuOverride":
             if 'state' in data.keys():
                 self.set_idle_timer_override(data['state'])
+        elif command == 'emergencyOff':
+            result = self.emergency_off(data.get('reason', "API request"))
+            return jsonify(result=result, latency=self._emergencyStats['lastLatency'])
+        elif command == 'clearEmergencyOff':
+            self.clear_emergency_off()
+        elif command == 'powerOnAndPrint':
+            origin = data.get('origin', 'local')
+            if origin not in ('local', 'sdcard'):
+                return make_response("Unknown origin {}".format(origin), 400)
+            if origin == 'local' and not self._file_manager.file_exists(origin, data['path']):
+                return make_response("File not found", 404)
+            if self._printer.is_printing() or self._printer.is_paused():
+                return make_response("Printer is busy", 409)
+
+            try:
+                timeout = float(data.get('timeout', 60))
+            except (TypeError, ValueError):
+                return make_response("Invalid timeout", 400)
+
+            workflow = self.start_print_workflow(data['path'], origin=origin, script=data.get('script'), timeout=timeout)
+            if workflow is None:
+                return make_response("Another workflow is running", 409)
+            return jsonify(workflow.to_dict())
+        elif command in ('getWorkflow', 'cancelWorkflow'):
+            workflow = self._workflows.get(data['id'])
+            if workflow is None:
+                return make_response("Unknown workflow", 404)
+            if command == 'cancelWorkflow':
+                workflow.cancel()
+            return jsonify(workflow.to_dict())
 
 
     def on_settings_save(self, data):
@@ -710,11 +1735,21 @@ class PSUControl(octoprint.plugin.StartupPlugin,
         self.cleanup_gpio()
 
         #configure GPIO
-        if self.config['switchingMethod'] == 'GPIO' or self.config['sensingMethod'] == 'GPIO':
+        if self._uses_gpio():
             self.configure_gpio()
 
         self._start_idle_timer()
 
+        self._reschedule()
+
+        if any(old_config.get(k) != self.config[k] for k in ('enableControlSocket', 'controlSocketPath', 'controlSocketMode', 'controlSocketGroup')):
+            self._start_control_socket()
+
+        if self._powerSaving.active and not self.config['enablePowerSaving']:
+            thread = threading.Thread(target=self._exit_power_saving)
+            thread.daemon = True
+            thread.start()
+
 
     def get_wizard_version(self):
         return 1
@@ -849,7 +1884,9 @@ class PSUControl(octoprint.plugin.StartupPlugin,
             "availableGPIODevices": self._availableGPIODevices,
             "availablePlugins": available_plugins,
             "hasGPIO": HAS_GPIO,
-            "supportsLineBias": SUPPORTS_LINE_BIAS
+            "hasControlSocket": HAS_CONTROL_SOCKET,
+            "supportsLineBias": SUPPORTS_LINE_BIAS,
+            "initialState": self._get_state_message()
         }
 
 
@@ -916,7 +1953,7 @@ class PSUControl(octoprint.plugin.StartupPlugin,
 
 
 __plugin_name__ = "PSU Control"
-__plugin_pythoncompat__ = ">=2.7,<4"
+__plugin_pythoncompat__ = ">=3.7,<4"
 
 def __plugin_load__():
     global __plugin_implementation__
@@ -925,6 +1962,9 @@ def __plugin_load__():
     global __plugin_hooks__
     __plugin_hooks__ = {
         "octoprint.comm.protocol.gcode.queuing": __plugin_implementation__.hook_gcode_queuing,
+        "octoprint.comm.protocol.gcode.received": __plugin_implementation__.hook_gcode_received,
+        "octoprint.comm.protocol.temperatures.received": __plugin_implementation__.hook_temperatures_received,
+        "octoprint.printer.handle_connect": __plugin_implementation__.hook_handle_connect,
         "octoprint.plugin.softwareupdate.check_config": __plugin_implementation__.get_update_information,
         "octoprint.events.register_custom_events": __plugin_implementation__.register_custom_events,
         "octoprint.access.permissions": __plugin_implementation__.get_additional_permissions,
@@ -937,5 +1977,6 @@ def __plugin_load__():
         get_psu_state = __plugin_implementation__.get_psu_state,
         turn_psu_on = __plugin_implementation__.turn_psu_on,
         turn_psu_off = __plugin_implementation__.turn_psu_off,
+        emergency_off = __plugin_implementation__.emergency_off,
         register_plugin = __plugin_implementation__.register_plugin
     )
@@ -79,5 +79,69 @@ def commands(cli_group, pass_octoprint_ctx, *args, **kwargs):
                 else:
                     click.echo('off')
 
-    return [turnPSUOn_command, turnPSUOff_command, togglePSU_command, getPSUState_command]
+    @click.option("--output", type=click.Path(dir_okay=False, writable=True), help="Write the trace to a file instead of stdout.")
+    @client_options
+    @click.command("trace")
+    def getTrace_command(output, apikey, host, port, httpuser, httppass, https, prefix):
+        """Dump recent operations as Chrome trace-event JSON"""
+        r = _api_command('getTrace', apikey, host, port, httpuser, httppass, https, prefix)
+
+        if r.status_code in [200, 204]:
+            if output:
+                with open(output, 'w') as f:
+                    f.write(r.text)
+            else:
+                click.echo(r.text)
+
+    @click.option("--json", "as_json", is_flag=True, help="Print the results as JSON.")
+    @click.option("--restart-window", type=float, default=600, show_default=True, help="Seconds after a power off in which a power on counts as an interruption.")
+    @click.option("--auto-on", "auto_on", multiple=True, help="Comma separated auto on trigger commands to try. May be repeated.")
+    @click.option("--idle-ignore", "idle_ignore", multiple=True, help="Comma separated idle ignore commands to try. May be repeated.")
+    @click.option("--wait-temp", "wait_temps", default="", help="Comma separated heater wait temperatures to try.")
+    @click.option("--idle-timeout", "idle_timeouts", default="", help="Comma separated idle timeouts in minutes to try.")
+    @click.option("--temperatures", "temperature_logs", multiple=True, type=click.File("r"), help="Temperature log with timestamp,temperature lines.")
+    @click.argument("serial_logs", nargs=-1, required=True, type=click.File("r"))
+    @click.command("simulate")
+    def simulate_command(serial_logs, temperature_logs, idle_timeouts, wait_temps, idle_ignore, auto_on, restart_window, as_json):
+        """Replay serial logs against idle power off settings"""
+        from octoprint_psucontrol.simulator import Recording, simulate, pareto_front
+
+        def configured(key, default):
+            value = cli_group.settings.get(["plugins", "psucontrol", key])
+            return default if value is None else value
+
+        try:
+            idle_timeouts = [float(v) for v in (idle_timeouts or str(configured('idleTimeout', 30))).split(',')]
+            wait_temps = [float(v) for v in (wait_temps or str(configured('idleTimeoutWaitTemp', 50))).split(',')]
+        except ValueError as e:
+            click.echo("Invalid number: {}".format(e), err=True)
+            sys.exit(1)
+
+        idle_ignore = [v.split(',') for v in idle_ignore] or [configured('idleIgnoreCommands', "M105").split(',')]
+        auto_on = [v.split(',') for v in auto_on] or [configured('autoOnTriggerGCodeCommands', "G0,G1,G2,G3,G10,G11,G28,G29,G32,M104,M106,M109,M140,M190").split(',')]
+
+        recording = Recording()
+        for f in serial_logs:
+            recording.add_serial_log(f)
+        for f in temperature_logs:
+            recording.add_temperature_log(f)
+        recording.finish()
+
+        results = pareto_front(simulate(recording, idle_timeouts, wait_temps, idle_ignore, auto_on, restart_window=restart_window))
+        results.sort(key=lambda r: (r['interruptions'], r['onHours']))
+
+        if as_json:
+            click.echo(json.dumps(results, indent=2))
+            return
+
+        click.echo("{} commands over {:.1f} hours".format(len(recording.commands), (recording.end - recording.start) / 3600.0))
+        click.echo("{:>8} {:>6} {:>9} {:>6} {:>8} {:>7} {:>13}  {:<20} {}".format(
+            "timeout", "temp", "on hours", "offs", "restarts", "missed", "interruptions", "ignore", "auto on"))
+        for r in results:
+            click.echo("{:>8g} {:>6g} {:>9.2f} {:>6} {:>8} {:>7} {:>13}  {:<20} {}{}".format(
+                r['idleTimeout'], r['idleTimeoutWaitTemp'], r['onHours'], r['powerOffs'], r['quickRestarts'],
+                r['missedCommands'], r['interruptions'], r['idleIgnoreCommands'], r['autoOnTriggerGCodeCommands'],
+                "  *" if r['pareto'] else ""))
+
+    return [turnPSUOn_command, turnPSUOff_command, togglePSU_command, getPSUState_command, getTrace_command, simulate_command]
 
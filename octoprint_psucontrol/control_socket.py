@@ -0,0 +1,178 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+__author__ = "Shawn Bruce <kantlivelong@gmail.com>"
+__license__ = "GNU Affero General Public License http://www.gnu.org/licenses/agpl.html"
+__copyright__ = "Copyright (C) 2017 Shawn Bruce - Released under terms of the AGPLv3 License"
+
+import errno
+import json
+import os
+import queue
+import select
+import socket
+import socketserver
+import stat
+import threading
+
+if not hasattr(socket, "AF_UNIX"):
+    raise ImportError("Unix domain sockets are not supported on this platform")
+
+import grp
+
+
+class ControlSocketHandler(socketserver.StreamRequestHandler):
+    """Handles one client connection.
+
+    Each request is a line, either a bare command (``on``, ``off``, ``toggle``,
+    ``status``, ``subscribe``) answered with a text line, or a JSON object
+    with a ``command`` key answered with a JSON line.
+    """
+    def _reply(self, as_json, text, **data):
+        if as_json:
+            data.setdefault('ok', not text.startswith('error'))
+            line = json.dumps(data)
+        else:
+            line = text
+        self.wfile.write((line + '\n').encode('utf-8'))
+        self.wfile.flush()
+
+    def _state_reply(self, as_json, is_on):
+        self._reply(as_json, 'on' if is_on else 'off', isPSUOn=bool(is_on))
+
+    def handle(self):
+        for raw in self.rfile:
+            line = raw.decode('utf-8', 'replace').strip()
+            if not line:
+                continue
+
+            as_json = line.startswith('{')
+            if as_json:
+                try:
+                    command = json.loads(line).get('command', '')
+                except (ValueError, AttributeError):
+                    self._reply(True, 'error invalid request', error='invalid request')
+                    continue
+            else:
+                command = line.lower()
+
+            if command == 'subscribe':
+                self._subscribe(as_json)
+                return
+
+            function = self.server.commands.get(command)
+            if function is None:
+                self._reply(as_json, 'error unknown command', error='unknown command')
+                continue
+
+            try:
+                result = function()
+            except Exception as e:
+                self.server.logger.exception("Error while executing control socket command {}".format(command))
+                self._reply(as_json, 'error {}'.format(e), error=str(e))
+                continue
+
+            if command == 'status':
+                self._state_reply(as_json, result)
+            elif result is False:
+                self._reply(as_json, 'error failed', error='failed')
+            else:
+                self._reply(as_json, 'ok')
+
+    def _closed(self):
+        readable, _, _ = select.select([self.connection], [], [], 0)
+        return bool(readable) and not self.connection.recv(1, socket.MSG_PEEK)
+
+    def _subscribe(self, as_json):
+        q = queue.Queue()
+        self.server.add_subscriber(q)
+        try:
+            self._state_reply(as_json, self.server.commands['status']())
+            while True:
+                try:
+                    is_on = q.get(timeout=1)
+                except queue.Empty:
+                    if self._closed():
+                        return
+                    continue
+                self._state_reply(as_json, is_on)
+        except (IOError, OSError):
+            pass
+        finally:
+            self.server.remove_subscriber(q)
+
+
+class ControlSocketServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, commands, logger, mode=0o660, group=None):
+        # resolve the group first so an unknown group fails before anything is created
+        gid = grp.getgrnam(group).gr_gid if group else -1
+
+        try:
+            st = os.lstat(path)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+        else:
+            if not stat.S_ISSOCK(st.st_mode):
+                raise OSError(errno.EEXIST, "Refusing to replace a file that is not a socket", path)
+            os.unlink(path)
+
+        socketserver.UnixStreamServer.__init__(self, path, ControlSocketHandler, bind_and_activate=False)
+
+        # only the owner may connect until the requested permissions are in place
+        umask = os.umask(0o177)
+        try:
+            self.server_bind()
+        except Exception:
+            self.server_close()
+            raise
+        finally:
+            os.umask(umask)
+
+        try:
+            os.chown(path, -1, gid)
+            os.chmod(path, mode)
+            self.server_activate()
+        except Exception:
+            self.server_close()
+            os.unlink(path)
+            raise
+
+        self.path = path
+        self.commands = commands
+        self.logger = logger
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def add_subscriber(self, q):
+        with self._lock:
+            self._subscribers.append(q)
+
+    def remove_subscriber(self, q):
+        with self._lock:
+            if q in self._subscribers:
+                self._subscribers.remove(q)
+
+    def publish(self, is_on):
+        with self._lock:
+            for q in self._subscribers:
+                q.put(is_on)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        # shutdown() waits for serve_forever() and would block if it never ran
+        if self._thread is not None:
+            self.shutdown()
+            self._thread = None
+        self.server_close()
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
@@ -0,0 +1,111 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+__author__ = "Shawn Bruce <kantlivelong@gmail.com>"
+__license__ = "GNU Affero General Public License http://www.gnu.org/licenses/agpl.html"
+__copyright__ = "Copyright (C) 2017 Shawn Bruce - Released under terms of the AGPLv3 License"
+
+import subprocess
+import threading
+import time
+
+
+def run_parallel(commands, timeout):
+    """Start all ``commands`` at once and wait for them, killing any still running after ``timeout`` seconds."""
+    start = time.time()
+    running = []
+    results = []
+
+    for command in commands:
+        try:
+            running.append((command, subprocess.Popen(command, shell=True)))
+        except OSError as e:
+            results.append(dict(command=command, returncode=None, seconds=0.0, error=str(e)))
+
+    while running:
+        now = time.time()
+        for command, p in list(running):
+            if p.poll() is not None:
+                results.append(dict(command=command, returncode=p.returncode, seconds=round(now - start, 3)))
+                running.remove((command, p))
+            elif now - start > timeout:
+                p.kill()
+                p.wait()
+                results.append(dict(command=command, returncode=p.returncode, seconds=round(now - start, 3), error="timed out"))
+                running.remove((command, p))
+
+        if running:
+            time.sleep(0.01)
+
+    return results
+
+
+class PowerSaving(object):
+    """Tracks the power saving state entered while the PSU is off.
+
+    ``enter`` and ``exit`` run their commands in parallel and are serialized
+    against each other, so a quick off and on can not interleave them.
+    """
+    def __init__(self, logger=None):
+        self._lock = threading.Lock()
+        self.active = False
+        self.entered_at = None
+        self.entries = 0
+        self.saved_seconds = 0.0
+        self.last_enter = None
+        self.last_exit = None
+        self.logger = logger
+
+    def enter(self, commands, timeout, actions=None):
+        with self._lock:
+            if self.active:
+                return None
+
+            start = time.time()
+            if actions is not None:
+                actions()
+            results = run_parallel(commands, timeout)
+            duration = time.time() - start
+
+            self.active = True
+            self.entered_at = start
+            self.entries += 1
+            self.last_enter = dict(seconds=round(duration, 3), commands=results)
+            self._log_failures(results)
+            return duration
+
+    def exit(self, commands, timeout, actions=None):
+        with self._lock:
+            if not self.active:
+                return None
+
+            start = time.time()
+            self.active = False
+            self.saved_seconds += start - self.entered_at
+            self.entered_at = None
+
+            if actions is not None:
+                actions()
+            results = run_parallel(commands, timeout)
+            duration = time.time() - start
+
+            self.last_exit = dict(seconds=round(duration, 3), commands=results)
+            self._log_failures(results)
+            return duration
+
+    def _log_failures(self, results):
+        if self.logger is None:
+            return
+        for r in results:
+            if r['returncode'] != 0:
+                self.logger.warning("Power saving command {} failed: {}".format(r['command'], r.get('error', r['returncode'])))
+
+    def get_stats(self):
+        saved = self.saved_seconds
+        if self.active:
+            saved += time.time() - self.entered_at
+        return dict(active=self.active,
+                    entries=self.entries,
+                    savedHours=round(saved / 3600.0, 3),
+                    lastEnter=self.last_enter,
+                    lastExit=self.last_exit)
@@ -0,0 +1,230 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+__author__ = "Shawn Bruce <kantlivelong@gmail.com>"
+__license__ = "GNU Affero General Public License http://www.gnu.org/licenses/agpl.html"
+__copyright__ = "Copyright (C) 2017 Shawn Bruce - Released under terms of the AGPLv3 License"
+
+import collections
+import hashlib
+import math
+import mmap
+import os
+import threading
+
+CHUNK_SIZE = 1024 * 1024
+MAX_GAPS = 5
+MOVE_COMMANDS = ('G0', 'G1')
+
+
+def get_gcode_command(line):
+    """Return the command of a G-code line, e.g. ``G1`` for ``N12 g1 X5 ; move``."""
+    line = line.split(';', 1)[0].strip()
+    if not line:
+        return None
+
+    parts = line.split(None, 2)
+    command = parts[0].upper()
+    if command.startswith('N') and command[1:].isdigit():
+        if len(parts) < 2:
+            return None
+        command = parts[1].upper()
+
+    return command.split('*', 1)[0]
+
+
+def get_dwell_seconds(line):
+    """Return the dwell time of a ``G4`` line in seconds."""
+    seconds = 0.0
+    for param in line.split(';', 1)[0].split()[1:]:
+        try:
+            if param[0] in 'Pp':
+                seconds = float(param[1:]) / 1000.0
+            elif param[0] in 'Ss':
+                seconds = float(param[1:])
+        except (ValueError, IndexError):
+            continue
+    return seconds
+
+
+def get_parameters(line):
+    """Return the numeric parameters of a G-code line, e.g. ``{'X': 5.0, 'F': 1200.0}`` for ``G1 X5 F1200``."""
+    params = dict()
+    for param in line.split(';', 1)[0].split()[1:]:
+        try:
+            params[param[0].upper()] = float(param[1:])
+        except (ValueError, IndexError):
+            continue
+    return params
+
+
+class _Motion(object):
+    """Follows the tool position through a file to estimate how long moves take."""
+    def __init__(self):
+        self.position = dict(X=0.0, Y=0.0, Z=0.0, E=0.0)
+        self.feedrate = None
+        self.relative = False
+        self.relative_e = False
+
+    def update(self, command, line):
+        """Apply a line and return the duration of its move in seconds, 0 if it is not one."""
+        if command == 'G90':
+            self.relative = self.relative_e = False
+        elif command == 'G91':
+            self.relative = self.relative_e = True
+        elif command == 'M82':
+            self.relative_e = False
+        elif command == 'M83':
+            self.relative_e = True
+        elif command == 'G92':
+            for axis, value in get_parameters(line).items():
+                if axis in self.position:
+                    self.position[axis] = value
+        if command not in MOVE_COMMANDS:
+            return 0.0
+
+        params = get_parameters(line)
+        if params.get('F', 0) > 0:
+            self.feedrate = params['F'] / 60.0
+
+        distance = 0.0
+        extrusion = 0.0
+        for axis in 'XYZE':
+            if axis not in params:
+                continue
+            relative = self.relative_e if axis == 'E' else self.relative
+            target = params[axis] + self.position[axis] if relative else params[axis]
+            delta = target - self.position[axis]
+            self.position[axis] = target
+            if axis == 'E':
+                extrusion = abs(delta)
+            else:
+                distance += delta * delta
+
+        if not self.feedrate:
+            return 0.0
+        # extrusion only moves run at the feedrate of the extruder
+        return (math.sqrt(distance) or extrusion) / self.feedrate
+
+
+def _iter_lines(f, hasher):
+    size = os.fstat(f.fileno()).st_size
+    if size == 0:
+        return
+
+    mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        if hasattr(mm, 'madvise') and hasattr(mmap, 'MADV_SEQUENTIAL'):
+            mm.madvise(mmap.MADV_SEQUENTIAL)
+
+        remainder = b''
+        for pos in range(0, size, CHUNK_SIZE):
+            chunk = mm[pos:pos + CHUNK_SIZE]
+            hasher.update(chunk)
+
+            lines = (remainder + chunk).split(b'\n')
+            remainder = lines.pop()
+            for line in lines:
+                yield line
+
+        if remainder:
+            yield remainder
+    finally:
+        mm.close()
+
+
+def scan_gcode(path, auto_on_commands, idle_ignore_commands):
+    """Stream ``path`` once and find the first auto-on trigger and the longest
+    runs made only of idle-ignored commands.
+
+    Run durations are estimated from ``G4`` dwells inside the run and, if
+    moves are idle-ignored, from the length and feedrate of the moves.
+    Other commands are assumed to take no time.
+    """
+    auto_on_commands = set(auto_on_commands)
+    idle_ignore_commands = set(idle_ignore_commands)
+    hasher = hashlib.sha1()
+
+    # positions are only needed when moves can be part of a run
+    motion = _Motion() if idle_ignore_commands.intersection(MOVE_COMMANDS) else None
+
+    first_trigger = None
+    gaps = []
+    run_start = None
+    run_seconds = 0.0
+    line_number = 0
+
+    def close_run(end):
+        if run_start is not None and run_seconds > 0:
+            gaps.append(dict(startLine=run_start, endLine=end, seconds=run_seconds))
+
+    with open(path, 'rb') as f:
+        for raw in _iter_lines(f, hasher):
+            line_number += 1
+            line = raw.decode('utf-8', 'replace')
+            command = get_gcode_command(line)
+            if command is None:
+                continue
+
+            if first_trigger is None and command in auto_on_commands:
+                first_trigger = dict(line=line_number, command=command)
+
+            move_seconds = motion.update(command, line) if motion is not None else 0.0
+
+            if command in idle_ignore_commands:
+                if run_start is None:
+                    run_start = line_number
+                    run_seconds = 0.0
+                if command == 'G4':
+                    run_seconds += get_dwell_seconds(line)
+                else:
+                    run_seconds += move_seconds
+            else:
+                close_run(line_number - 1)
+                run_start = None
+
+        close_run(line_number)
+
+    gaps.sort(key=lambda g: g['seconds'], reverse=True)
+
+    return dict(hash=hasher.hexdigest(),
+                lines=line_number,
+                firstAutoOnTrigger=first_trigger,
+                ignoredGaps=gaps[:MAX_GAPS])
+
+
+class PrescanCache(object):
+    """LRU cache of scan results keyed by file hash and the command lists used."""
+    def __init__(self, size=64):
+        self.size = size
+        self._results = collections.OrderedDict()
+        self._hashes = dict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _file_key(path):
+        st = os.stat(path)
+        return (path, st.st_size, st.st_mtime)
+
+    def get(self, path, auto_on_commands, idle_ignore_commands, file_hash=None):
+        commands = (tuple(auto_on_commands), tuple(idle_ignore_commands))
+
+        with self._lock:
+            if file_hash is None:
+                file_hash = self._hashes.get(self._file_key(path))
+
+            if file_hash is not None and (file_hash, commands) in self._results:
+                self._results.move_to_end((file_hash, commands))
+                return self._results[(file_hash, commands)]
+
+        result = scan_gcode(path, auto_on_commands, idle_ignore_commands)
+
+        with self._lock:
+            if len(self._hashes) > self.size * 4:
+                self._hashes.clear()
+            self._hashes[self._file_key(path)] = result['hash']
+            self._results[(result['hash'], commands)] = result
+            while len(self._results) > self.size:
+                self._results.popitem(last=False)
+
+        return result
@@ -0,0 +1,130 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+__author__ = "Shawn Bruce <kantlivelong@gmail.com>"
+__license__ = "GNU Affero General Public License http://www.gnu.org/licenses/agpl.html"
+__copyright__ = "Copyright (C) 2017 Shawn Bruce - Released under terms of the AGPLv3 License"
+
+import datetime
+import heapq
+import itertools
+import threading
+import time
+
+
+class ScheduledCall(object):
+    def __init__(self, when, seq, function, args, kwargs, name):
+        self.when = when
+        self.seq = seq
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.name = name
+        self.cancelled = False
+
+    def __lt__(self, other):
+        return (self.when, self.seq) < (other.when, other.seq)
+
+
+class Scheduler(threading.Thread):
+    """Runs all scheduled calls from a single thread using a priority queue.
+
+    Cancelled calls stay in the heap and are skipped when they come due.
+    """
+    def __init__(self, logger=None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self._queue = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._stopped = False
+        self.logger = logger
+
+    def schedule(self, when, function, args=None, kwargs=None, name=None):
+        if args is None:
+            args = []
+        if kwargs is None:
+            kwargs = dict()
+
+        call = ScheduledCall(when, next(self._counter), function, args, kwargs, name)
+        with self._condition:
+            heapq.heappush(self._queue, call)
+            self._condition.notify()
+        return call
+
+    def cancel(self, call):
+        with self._condition:
+            call.cancelled = True
+            self._condition.notify()
+
+    def clear(self):
+        with self._condition:
+            for call in self._queue:
+                call.cancelled = True
+            self._queue = []
+            self._condition.notify()
+
+    def pending(self):
+        with self._condition:
+            return sorted(c for c in self._queue if not c.cancelled)
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+
+    def run(self):
+        while True:
+            with self._condition:
+                while True:
+                    if self._stopped:
+                        return
+
+                    while self._queue and self._queue[0].cancelled:
+                        heapq.heappop(self._queue)
+
+                    if not self._queue:
+                        self._condition.wait()
+                        continue
+
+                    delay = self._queue[0].when - time.time()
+                    if delay <= 0:
+                        call = heapq.heappop(self._queue)
+                        break
+
+                    self._condition.wait(delay)
+
+            try:
+                call.function(*call.args, **call.kwargs)
+            except Exception:
+                if self.logger is not None:
+                    self.logger.exception("Error while executing scheduled call {}".format(call.name))
+
+
+def parse_time_of_day(value):
+    hour, minute = value.split(':', 1)
+    return int(hour), int(minute)
+
+
+def parse_local_datetime(value):
+    return datetime.datetime.strptime(value[:16], "%Y-%m-%dT%H:%M")
+
+
+def next_weekly_occurrence(time_of_day, days, now=None):
+    """Return the next local datetime after ``now`` at ``time_of_day`` on one of ``days`` (Monday is 0)."""
+    if now is None:
+        now = datetime.datetime.now()
+
+    hour, minute = parse_time_of_day(time_of_day)
+    days = set(int(d) for d in days)
+
+    for offset in range(8):
+        candidate = (now + datetime.timedelta(days=offset)).replace(hour=hour, minute=minute, second=0, microsecond=0)
+        if candidate > now and candidate.weekday() in days:
+            return candidate
+
+    return None
+
+
+def to_timestamp(dt):
+    return time.mktime(dt.timetuple())
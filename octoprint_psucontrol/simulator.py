@@ -0,0 +1,267 @@
+# coding=utf-8
+from __future__ import absolute_import, division
+
+__author__ = "Shawn Bruce <kantlivelong@gmail.com>"
+__license__ = "GNU Affero General Public License http://www.gnu.org/licenses/agpl.html"
+__copyright__ = "Copyright (C) 2017 Shawn Bruce - Released under terms of the AGPLv3 License"
+
+# Replays recorded serial logs through the idle power off and auto on rules
+# to compare settings offline.
+#
+# The rules follow hook_gcode_queuing, _idle_poweroff and _wait_for_heaters:
+# - the idle timer starts at power on and restarts on every command that is
+#   not in idleIgnoreCommands,
+# - when it expires the heaters are checked right away and then every
+#   HEATER_CHECK_INTERVAL seconds until the hottest tool is at or below
+#   idleTimeoutWaitTemp, activity in between aborts the power off,
+# - while off, the first command in autoOnTriggerGCodeCommands powers on
+#   again, any other non-ignored command is counted as missed.
+#
+# Auto on trigger commands are always treated as activity, which only differs
+# from the plugin if a trigger command is also in idleIgnoreCommands.
+
+import bisect
+import datetime
+import itertools
+import math
+import re
+
+from .prescan import get_gcode_command
+from .scheduler import to_timestamp
+
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except ImportError:
+    HAS_NUMPY = False
+
+HEATER_CHECK_INTERVAL = 5
+SERIAL_LOG_TIME_FORMAT = "%Y-%m-%d %H:%M"
+
+_tool_temperature_re = re.compile(r'\bT\d*:\s*(-?\d+(?:\.\d+)?)')
+
+
+class Recording(object):
+    """Commands sent and tool temperatures, both as time ordered lists."""
+    def __init__(self):
+        self.command_times = []
+        self.commands = []
+        self.temperature_times = []
+        self.temperatures = []
+        self._last_minute = (None, None)
+
+    def _parse_time(self, value):
+        # consecutive lines mostly share the same minute, only parse it once
+        minute = value[:16]
+        if self._last_minute[0] != minute:
+            self._last_minute = (minute, to_timestamp(datetime.datetime.strptime(minute, SERIAL_LOG_TIME_FORMAT)))
+        return self._last_minute[1] + int(value[17:19]) + int(value[20:]) / 1000.0
+
+    def add_serial_log(self, f):
+        """Read an OctoPrint ``serial.log``."""
+        for line in f:
+            stamp, _, message = line.rstrip('\r\n').partition(' - ')
+            if message.startswith('Send: '):
+                command = get_gcode_command(message[6:])
+                if command is not None:
+                    self.command_times.append(self._parse_time(stamp))
+                    self.commands.append(command)
+            elif message.startswith('Recv: ') and 'T' in message:
+                temperatures = [float(v) for v in _tool_temperature_re.findall(message)]
+                if temperatures:
+                    self.temperature_times.append(self._parse_time(stamp))
+                    self.temperatures.append(max(temperatures))
+
+    def add_temperature_log(self, f):
+        """Read ``timestamp,temperature`` lines, the timestamp in epoch seconds."""
+        for line in f:
+            parts = line.strip().split(',')
+            if len(parts) < 2:
+                continue
+            try:
+                self.temperature_times.append(float(parts[0]))
+                self.temperatures.append(float(parts[1]))
+            except ValueError:
+                continue
+
+    def finish(self):
+        order = sorted(range(len(self.command_times)), key=self.command_times.__getitem__)
+        self.command_times = [self.command_times[i] for i in order]
+        self.commands = [self.commands[i] for i in order]
+
+        order = sorted(range(len(self.temperature_times)), key=self.temperature_times.__getitem__)
+        self.temperature_times = [self.temperature_times[i] for i in order]
+        self.temperatures = [self.temperatures[i] for i in order]
+
+    @property
+    def start(self):
+        return self.command_times[0] if self.command_times else 0.0
+
+    @property
+    def end(self):
+        return max(self.command_times[-1:] + self.temperature_times[-1:]) if self.command_times else 0.0
+
+
+def _gaps(recording, idle_ignore, auto_on):
+    """Split the recording into gaps between activity.
+
+    Returns activity times, trigger times and the (start, end) of every gap.
+    The last gap runs to the end of the recording.
+    """
+    idle_ignore = set(idle_ignore)
+    auto_on = set(auto_on)
+
+    activity = [t for t, c in zip(recording.command_times, recording.commands) if c in auto_on or c not in idle_ignore]
+    triggers = [t for t, c in zip(recording.command_times, recording.commands) if c in auto_on]
+    starts = activity
+    ends = activity[1:] + [recording.end]
+    return activity, triggers, starts, ends
+
+
+def _summarize(recording, off_times, on_times, missed, restart_window):
+    total = recording.end - recording.start
+    off = 0.0
+    interruptions = 0
+    quick_restarts = 0
+    for off_time, on_time, m in zip(off_times, on_times, missed):
+        off += min(on_time, recording.end) - off_time
+        quick = on_time - off_time < restart_window
+        quick_restarts += int(quick)
+        interruptions += int(quick or m > 0)
+
+    return dict(onHours=round((total - off) / 3600.0, 3),
+                powerOffs=len(off_times),
+                quickRestarts=quick_restarts,
+                missedCommands=int(sum(missed)),
+                interruptions=interruptions)
+
+
+def _simulate_python(recording, idle_timeouts, wait_temps, idle_ignore, auto_on, restart_window):
+    activity, triggers, starts, ends = _gaps(recording, idle_ignore, auto_on)
+    temperature_times = recording.temperature_times
+    temperatures = recording.temperatures
+
+    # gaps shorter than every timeout can never end in a power off
+    shortest = min(idle_timeouts) * 60
+    gaps = [(start, end) for start, end in zip(starts, ends) if end - start > shortest]
+
+    results = []
+    for wait_temp, idle_timeout in itertools.product(wait_temps, idle_timeouts):
+        cooled_times = [t for t, v in zip(temperature_times, temperatures) if v <= wait_temp]
+        off_times = []
+        on_times = []
+        missed = []
+        on_until = -float('inf')
+
+        for start, end in gaps:
+            if start < on_until:
+                # already switched off and not yet powered on again
+                continue
+
+            off_time = start + idle_timeout * 60
+            if off_time >= end:
+                continue
+
+            i = bisect.bisect_right(temperature_times, off_time) - 1
+            if i >= 0 and temperatures[i] > wait_temp:
+                k = bisect.bisect_left(cooled_times, off_time)
+                if k == len(cooled_times):
+                    continue
+                off_time += math.ceil((cooled_times[k] - off_time) / HEATER_CHECK_INTERVAL) * HEATER_CHECK_INTERVAL
+                if off_time >= end:
+                    continue
+
+            j = bisect.bisect_left(triggers, off_time)
+            on_time = triggers[j] if j < len(triggers) else float('inf')
+            on_until = on_time
+
+            off_times.append(off_time)
+            on_times.append(on_time)
+            missed.append(bisect.bisect_left(activity, on_time) - bisect.bisect_left(activity, off_time))
+
+        result = _summarize(recording, off_times, on_times, missed, restart_window)
+        result.update(idleTimeout=idle_timeout, idleTimeoutWaitTemp=wait_temp)
+        results.append(result)
+
+    return results
+
+
+def _simulate_numpy(recording, idle_timeouts, wait_temps, idle_ignore, auto_on, restart_window):
+    activity, triggers, starts, ends = _gaps(recording, idle_ignore, auto_on)
+    activity = np.asarray(activity, dtype=float)
+    triggers = np.append(np.asarray(triggers, dtype=float), np.inf)
+    starts = np.asarray(starts, dtype=float)
+    ends = np.asarray(ends, dtype=float)
+    temperature_times = np.asarray(recording.temperature_times, dtype=float)
+    temperatures = np.asarray(recording.temperatures, dtype=float)
+    timeouts = np.asarray(idle_timeouts, dtype=float) * 60
+
+    # gaps shorter than every timeout can never end in a power off
+    keep = (ends - starts) > timeouts.min()
+    starts = starts[keep]
+    ends = ends[keep]
+
+    results = []
+    for wait_temp in wait_temps:
+        # one row per idle timeout, one column per gap
+        off = starts[None, :] + timeouts[:, None]
+
+        if len(temperature_times):
+            i = np.searchsorted(temperature_times, off, side='right') - 1
+            hot = (i >= 0) & (temperatures[np.maximum(i, 0)] > wait_temp)
+
+            cooled_times = np.append(temperature_times[temperatures <= wait_temp], np.inf)
+            cooled = cooled_times[np.searchsorted(cooled_times[:-1], off, side='left')]
+            with np.errstate(invalid='ignore'):
+                delayed = off + np.ceil((cooled - off) / HEATER_CHECK_INTERVAL) * HEATER_CHECK_INTERVAL
+            off = np.where(hot, delayed, off)
+
+        candidate = off < ends[None, :]
+        on = np.where(candidate, triggers[np.searchsorted(triggers[:-1], np.where(candidate, off, 0), side='left')], -np.inf)
+
+        # a gap starting while an earlier power off is still in effect is skipped
+        covered_until = np.maximum.accumulate(on, axis=1)
+        covered_until = np.concatenate([np.full((len(timeouts), 1), -np.inf), covered_until[:, :-1]], axis=1)
+        valid = candidate & (starts[None, :] >= covered_until)
+
+        missed = np.searchsorted(activity, on, side='left') - np.searchsorted(activity, off, side='left')
+
+        for row, idle_timeout in enumerate(idle_timeouts):
+            v = valid[row]
+            result = _summarize(recording, off[row][v].tolist(), on[row][v].tolist(), missed[row][v].tolist(), restart_window)
+            result.update(idleTimeout=idle_timeout, idleTimeoutWaitTemp=wait_temp)
+            results.append(result)
+
+    return results
+
+
+def simulate(recording, idle_timeouts, wait_temps, idle_ignore_options, auto_on_options, restart_window=600, use_numpy=None):
+    """Evaluate every combination of the given settings.
+
+    ``idle_ignore_options`` and ``auto_on_options`` are lists of command lists.
+    A power off counts as an interruption if commands were missed while off
+    or if power came back within ``restart_window`` seconds.
+    """
+    if use_numpy is None:
+        use_numpy = HAS_NUMPY
+    function = _simulate_numpy if use_numpy else _simulate_python
+
+    results = []
+    if not recording.command_times:
+        return results
+
+    for idle_ignore, auto_on in itertools.product(idle_ignore_options, auto_on_options):
+        for result in function(recording, idle_timeouts, wait_temps, idle_ignore, auto_on, restart_window):
+            result.update(idleIgnoreCommands=','.join(idle_ignore), autoOnTriggerGCodeCommands=','.join(auto_on))
+            results.append(result)
+
+    return results
+
+
+def pareto_front(results):
+    """Mark results no other result beats on both on hours and interruptions."""
+    for r in results:
+        r['pareto'] = not any(o['onHours'] <= r['onHours'] and o['interruptions'] <= r['interruptions'] and
+                              (o['onHours'] < r['onHours'] or o['interruptions'] < r['interruptions'])
+                              for o in results)
+    return results
@@ -14,6 +14,7 @@ $(function() {
         self.scripts_gcode_psucontrol_pre_off = ko.observable(undefined);
 
         self.isPSUOn = ko.observable(undefined);
+        self.isPSUStateConfirmed = ko.observable(true);
         self.idleTimeLeft = ko.observable(undefined);
         self.idleTimeLeftString = ko.pureComputed(function () {
             if (self.isPSUOn() && !(self.idleTimeLeft() === null || self.idleTimeLeft() === undefined)) return self.idleTimeLeft();
@@ -21,6 +22,19 @@ $(function() {
         });
 
         self.idleTimerOverride = ko.observable(undefined);
+        self.applyingState = false;
+
+        self.nextSchedule = ko.observable(undefined);
+        self.nextScheduleString = ko.pureComputed(function () {
+            var next = self.nextSchedule();
+            if (!next) return "-";
+            return (next.action === "on" ? "On" : "Off") + " at " + new Date(next.time * 1000).toLocaleString();
+        });
+
+        self.emergencyLatch = ko.observable(null);
+
+        self.schedules = ko.observableArray([]);
+        self.scheduleDays = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"];
 
         self.psu_indicator = $("#psucontrol_indicator");
         self.psu_switch = $("#sidebar_plugin_psucontrol_wrapper");
@@ -69,6 +83,28 @@ $(function() {
         self.onSettingsShown = function () {
             self.scripts_gcode_psucontrol_post_on(self.settings.scripts.gcode["psucontrol_post_on"]());
             self.scripts_gcode_psucontrol_pre_off(self.settings.scripts.gcode["psucontrol_pre_off"]());
+
+            self.schedules(_.map(ko.mapping.toJS(self.settings.plugins.psucontrol.schedules), self.createSchedule));
+        };
+
+        self.createSchedule = function(data) {
+            return {
+                type: ko.observable(data.type || "window"),
+                enabled: ko.observable(data.enabled === undefined ? true : data.enabled),
+                days: ko.observableArray(data.days || [0, 1, 2, 3, 4, 5, 6]),
+                on: ko.observable(data.on || ""),
+                off: ko.observable(data.off || ""),
+                action: ko.observable(data.action || "off"),
+                at: ko.observable(data.at || "")
+            };
+        };
+
+        self.addSchedule = function() {
+            self.schedules.push(self.createSchedule({}));
+        };
+
+        self.removeSchedule = function(schedule) {
+            self.schedules.remove(schedule);
         };
 
         self.onSettingsHidden = function () {
@@ -77,6 +113,14 @@ $(function() {
         };
 
         self.onSettingsBeforeSave = function () {
+            self.settings.plugins.psucontrol.schedules(_.map(self.schedules(), function(schedule) {
+                var data = ko.toJS(schedule);
+                if (data.type === "window") {
+                    return {type: data.type, enabled: data.enabled, days: data.days, on: data.on, off: data.off};
+                }
+                return {type: data.type, enabled: data.enabled, action: data.action, at: data.at};
+            }));
+
             if (self.scripts_gcode_psucontrol_post_on() !== undefined) {
                 if (self.scripts_gcode_psucontrol_post_on() != self.settings.scripts.gcode["psucontrol_post_on"]()) {
                     self.settings.plugins.psucontrol.scripts_gcode_psucontrol_post_on = self.scripts_gcode_psucontrol_post_on;
@@ -104,30 +148,74 @@ $(function() {
                 self.idleTimerOverride(false);
             });
 
-            $.ajax({
-                url: API_BASEURL + "plugin/psucontrol",
-                type: "POST",
-                dataType: "json",
-                data: JSON.stringify({
-                    command: "getPSUState"
-                }),
-                contentType: "application/json; charset=UTF-8"
-            }).done(function(data) {
-                self.isPSUOn(data.isPSUOn);
+            self.isPSUStateConfirmed.subscribe(function(confirmed) {
+                self.psu_indicator.toggleClass("psu_unconfirmed", !confirmed);
+                self.psu_switch.toggleClass("psu_unconfirmed", !confirmed);
             });
+
+            // State embedded at render time. The websocket sends the current state once connected.
+            var initialState = $("#psucontrol_initial_state").text();
+            if (initialState) {
+                self.applyState(JSON.parse(initialState));
+            }
         }
 
+        self.applyState = function(data) {
+            // state coming from the server must not be posted back to it
+            self.applyingState = true;
+            try {
+                if (data.isPSUOn !== undefined) {
+                    self.isPSUOn(data.isPSUOn);
+                }
+
+                if (data.confirmed !== undefined) {
+                    self.isPSUStateConfirmed(data.confirmed);
+                }
+
+                if (data.idleTimeLeft !== undefined) {
+                    self.idleTimeLeft(data.idleTimeLeft);
+                }
+
+                // after isPSUOn, which resets the override
+                if (data.idleTimerOverride !== undefined) {
+                    self.idleTimerOverride(data.idleTimerOverride);
+                }
+
+                if (data.nextSchedule !== undefined) {
+                    self.nextSchedule(data.nextSchedule);
+                }
+
+                if (data.emergencyLatch !== undefined) {
+                    self.emergencyLatch(data.emergencyLatch);
+                }
+            } finally {
+                self.applyingState = false;
+            }
+        };
+
         self.onDataUpdaterPluginMessage = function(plugin, data) {
             if (plugin != "psucontrol") {
                 return;
             }
 
-            if (data.isPSUOn !== undefined) {
-                self.isPSUOn(data.isPSUOn);
+            self.applyState(data);
+
+            if (data.emergencyOff !== undefined) {
+                new PNotify({
+                    title: "PSU Control",
+                    text: "Emergency off: " + data.emergencyOff.reason + ". The PSU stays off until the emergency off is cleared.",
+                    type: "error",
+                    hide: false
+                });
             }
 
-            if (data.idleTimeLeft !== undefined) {
-                self.idleTimeLeft(data.idleTimeLeft);
+            if (data.prescanWarning !== undefined) {
+                new PNotify({
+                    title: "PSU Control",
+                    text: data.prescanWarning.path + " has " + data.prescanWarning.gaps.length + " pause(s) longer than the idle timeout. The PSU may be turned off during the print.",
+                    type: "warning",
+                    hide: false
+                });
             }
         };
 
@@ -148,6 +236,27 @@ $(function() {
             }
         };
 
+        self.showSwitchRejected = function(jqXHR) {
+            if (jqXHR.status !== 409 || !jqXHR.responseJSON) {
+                return;
+            }
+
+            if (jqXHR.responseJSON.error === "Emergency off latched") {
+                new PNotify({
+                    title: "PSU Control",
+                    text: "The PSU stays off until the emergency off is cleared (" + jqXHR.responseJSON.reason + ").",
+                    type: "error"
+                });
+                return;
+            }
+
+            new PNotify({
+                title: "PSU Control",
+                text: "Switching was limited by output protection (" + jqXHR.responseJSON.reason + "). Try again in " + jqXHR.responseJSON.retryAfter + "s.",
+                type: "notice"
+            });
+        };
+
         self.turnPSUOn = function() {
             $.ajax({
                 url: API_BASEURL + "plugin/psucontrol",
@@ -157,7 +266,7 @@ $(function() {
                     command: "turnPSUOn"
                 }),
                 contentType: "application/json; charset=UTF-8"
-            })
+            }).fail(self.showSwitchRejected)
         };
 
         self.turnPSUOff = function() {
@@ -169,10 +278,26 @@ $(function() {
                     command: "turnPSUOff"
                 }),
                 contentType: "application/json; charset=UTF-8"
+            }).fail(self.showSwitchRejected)
+        };
+
+        self.clearEmergencyOff = function() {
+            $.ajax({
+                url: API_BASEURL + "plugin/psucontrol",
+                type: "POST",
+                dataType: "json",
+                data: JSON.stringify({
+                    command: "clearEmergencyOff"
+                }),
+                contentType: "application/json; charset=UTF-8"
             })
         };
 
         self.setIdleTimerOverride = function() {
+            if (self.applyingState) {
+                return;
+            }
+
             $.ajax({
                 url: API_BASEURL + "plugin/psucontrol",
                 type: "POST",
@@ -0,0 +1,104 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+__author__ = "Shawn Bruce <kantlivelong@gmail.com>"
+__license__ = "GNU Affero General Public License http://www.gnu.org/licenses/agpl.html"
+__copyright__ = "Copyright (C) 2017 Shawn Bruce - Released under terms of the AGPLv3 License"
+
+import collections
+import os
+import threading
+import time
+
+
+class _NullSpan(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def set(self, **kwargs):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span(object):
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.ts = time.time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        dur = time.perf_counter() - self.start
+        if exc_type is not None:
+            self.args['error'] = exc_type.__name__
+        self.tracer._record(self.name, self.ts, dur, self.args)
+        return False
+
+    def set(self, **kwargs):
+        self.args.update(kwargs)
+
+
+class Tracer(object):
+    """Records spans into a bounded ring and exports them as Chrome trace events.
+
+    When disabled, ``span`` returns a shared no-op context manager.
+    """
+    def __init__(self, size=5000):
+        self.enabled = False
+        self._events = collections.deque(maxlen=size)
+        self._threads = dict()
+        self._lock = threading.Lock()
+
+    def configure(self, enabled, size):
+        with self._lock:
+            self.enabled = enabled
+            if size != self._events.maxlen:
+                self._events = collections.deque(self._events, maxlen=size)
+
+    def span(self, name, **args):
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, args)
+
+    def _record(self, name, ts, dur, args):
+        thread = threading.current_thread()
+        with self._lock:
+            self._threads[thread.ident] = thread.name
+            self._events.append((name, ts, dur, thread.ident, args))
+
+    def clear(self):
+        with self._lock:
+            self._events.clear()
+            self._threads.clear()
+
+    def to_chrome_trace(self):
+        pid = os.getpid()
+
+        with self._lock:
+            events = list(self._events)
+            threads = dict(self._threads)
+
+        trace_events = []
+        for tid, name in threads.items():
+            trace_events.append(dict(name="thread_name", ph="M", pid=pid, tid=tid, args=dict(name=name)))
+
+        for name, ts, dur, tid, args in events:
+            trace_events.append(dict(name=name,
+                                     cat="psucontrol",
+                                     ph="X",
+                                     ts=int(ts * 1000000),
+                                     dur=int(dur * 1000000),
+                                     pid=pid,
+                                     tid=tid,
+                                     args=args))
+
+        return dict(traceEvents=trace_events, displayTimeUnit="ms")
@@ -1,5 +1,17 @@
 # coding=utf-8
+import collections
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
 import threading
+import time
+
+IN_ATTRIB = 0x00000004
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_CLOEXEC = 0o2000000
 
 class ResettableTimer(threading.Thread):
     def __init__(self, interval, function, args=None, kwargs=None, on_reset=None, on_cancelled=None):
@@ -49,3 +61,642 @@ class ResettableTimer(threading.Thread):
 
         if callable(self.on_reset):
             self.on_reset()
+
+
+def _get_libc():
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+def _nearest_existing_dir(path):
+    d = os.path.dirname(os.path.abspath(path))
+    while not os.path.isdir(d):
+        d = os.path.dirname(d)
+    return d
+
+
+def wait_for_path(path, timeout):
+    """Wait up to ``timeout`` seconds for ``path`` to appear.
+
+    Uses inotify on the parent directory when available and falls back to
+    polling otherwise. Returns True if the path exists.
+    """
+    if os.path.exists(path):
+        return True
+
+    deadline = time.time() + timeout
+    libc = _get_libc()
+    fd = -1
+    if libc is not None:
+        fd = libc.inotify_init1(os.O_NONBLOCK | IN_CLOEXEC)
+
+    if fd < 0:
+        while time.time() < deadline:
+            if os.path.exists(path):
+                return True
+            time.sleep(0.05)
+        return os.path.exists(path)
+
+    try:
+        watched = None
+        while True:
+            d = _nearest_existing_dir(path)
+            if d != watched:
+                libc.inotify_add_watch(fd, d.encode(), IN_CREATE | IN_MOVED_TO | IN_ATTRIB)
+                watched = d
+
+            if os.path.exists(path):
+                return True
+
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+
+            r, _, _ = select.select([fd], [], [], remaining)
+            if r:
+                try:
+                    while os.read(fd, 4096):
+                        pass
+                except OSError as e:
+                    if e.errno != errno.EAGAIN:
+                        raise
+    finally:
+        os.close(fd)
+
+
+class DebouncedInput(threading.Thread):
+    """Samples ``read`` at ``rate`` Hz into a fixed-size ring buffer.
+
+    The filtered state only changes once the buffer majority crosses the
+    hysteresis thresholds and the new value has been stable for
+    ``stable_time`` seconds.
+
+    While paused nothing is sampled in the background and ``read`` samples
+    the line once instead.
+    """
+    def __init__(self, read, rate, samples, stable_time, on_change=None, logger=None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self._stop_event = threading.Event()
+        self._resume_event = threading.Event()
+        self._paused = False
+
+        self.read_function = read
+        self.period = 1.0 / max(1, rate)
+        self.size = max(1, samples)
+        self.stable_time = stable_time
+        self.on_change = on_change
+        self.logger = logger
+
+        self._high = (self.size * 3 + 3) // 4
+        self._low = self.size // 4
+
+        self._buffer = [False] * self.size
+        self._index = 0
+        self._ones = 0
+        self._candidate = False
+        self._candidate_since = 0
+        self.state = False
+
+        self.sample_count = 0
+        self.error_count = 0
+        self.edge_count = 0
+        self.rejected_count = 0
+        self.change_count = 0
+        self.cpu_percent = 0.0
+        self._raw_last = False
+
+    def _prime(self):
+        try:
+            v = bool(self.read_function())
+        except Exception:
+            v = False
+        self._buffer = [v] * self.size
+        self._ones = self.size if v else 0
+        self._raw_last = v
+        self._candidate = v
+        self.state = v
+
+    def _sample(self, now):
+        try:
+            v = bool(self.read_function())
+        except Exception:
+            self.error_count += 1
+            if self.error_count == 1 and self.logger is not None:
+                self.logger.exception("Exception while sampling GPIO line")
+            return
+
+        self.sample_count += 1
+        old = self._buffer[self._index]
+        self._buffer[self._index] = v
+        self._index = (self._index + 1) % self.size
+        self._ones += int(v) - int(old)
+
+        if self._ones >= self._high:
+            candidate = True
+        elif self._ones <= self._low:
+            candidate = False
+        else:
+            candidate = self._candidate
+
+        if v != self._raw_last:
+            self._raw_last = v
+            self.edge_count += 1
+
+        if candidate != self._candidate:
+            if candidate == self.state:
+                # flipped back before it was stable long enough
+                self.rejected_count += 1
+            self._candidate = candidate
+            self._candidate_since = now
+
+        if self._candidate != self.state and now - self._candidate_since >= self.stable_time:
+            self.state = self._candidate
+            self.change_count += 1
+            if callable(self.on_change):
+                self.on_change()
+
+    def run(self):
+        self._prime()
+
+        next_sample = time.time()
+        cpu_mark = time.thread_time()
+        wall_mark = next_sample
+
+        while not self._stop_event.is_set():
+            if self._paused:
+                self._resume_event.wait()
+                self._resume_event.clear()
+                next_sample = wall_mark = time.time()
+                cpu_mark = time.thread_time()
+                continue
+
+            now = time.time()
+            self._sample(now)
+
+            if now - wall_mark >= 1.0:
+                cpu = time.thread_time()
+                self.cpu_percent = (cpu - cpu_mark) / (now - wall_mark) * 100
+                cpu_mark = cpu
+                wall_mark = now
+
+            next_sample += self.period
+            delay = next_sample - time.time()
+            if delay < 0:
+                # fell behind, don't try to catch up
+                next_sample = time.time()
+                delay = 0
+            self._stop_event.wait(delay)
+
+    def read(self):
+        if self._paused:
+            self._prime()
+        return self.state
+
+    def pause(self):
+        self._paused = True
+        self.cpu_percent = 0.0
+
+    def resume(self):
+        if not self._paused:
+            return
+        self._prime()
+        self._paused = False
+        self._resume_event.set()
+
+    def stop(self):
+        self._stop_event.set()
+        self._resume_event.set()
+
+    def get_stats(self):
+        return dict(
+            state=self.state,
+            paused=self._paused,
+            rate=round(1.0 / self.period),
+            samples=self.size,
+            stableTime=self.stable_time,
+            sampleCount=self.sample_count,
+            errorCount=self.error_count,
+            rawEdges=self.edge_count,
+            rejectedGlitches=self.rejected_count,
+            stateChanges=self.change_count,
+            cpuPercent=round(self.cpu_percent, 2)
+        )
+
+
+class _PowerOperation(object):
+    def __init__(self, target):
+        self.target = target
+        self.owner = threading.current_thread().ident
+        self.done = False
+        self.result = None
+        self.error = None
+        self.preempted = False
+
+
+class PowerStateMachine(object):
+    """Serializes power on/off operations.
+
+    Only one operation runs at a time. A request for the same target as the
+    operation in flight is merged into it and waits for its result, a request
+    for the opposite target waits for it to finish before running.
+    """
+    OFF = "OFF"
+    TURNING_ON = "TURNING_ON"
+    ON = "ON"
+    TURNING_OFF = "TURNING_OFF"
+
+    def __init__(self, turn_on, turn_off):
+        self._condition = threading.Condition()
+        self._turn_on = turn_on
+        self._turn_off = turn_off
+        self._operation = None
+        self.state = self.OFF
+
+        self.request_count = 0
+        self.merged_count = 0
+        self.skipped_count = 0
+        self.executed_count = 0
+        self.preempted_count = 0
+
+    def _wait_for(self, op):
+        while not op.done:
+            self._condition.wait()
+
+        if op.error is not None:
+            raise op.error
+        return op.result
+
+    def request(self, target, force=True):
+        """Bring the PSU to ``target`` and return whether it succeeded.
+
+        Without ``force`` nothing is done if the PSU is already in the
+        requested state.
+        """
+        target = bool(target)
+
+        with self._condition:
+            self.request_count += 1
+
+            while self._operation is not None:
+                op = self._operation
+                if op.target == target:
+                    self.merged_count += 1
+                    if op.owner == threading.current_thread().ident:
+                        # re-entered from within the operation itself
+                        return True
+                    return self._wait_for(op)
+
+                while not op.done:
+                    self._condition.wait()
+
+            if not force and self.state == (self.ON if target else self.OFF):
+                self.skipped_count += 1
+                return True
+
+            previous = self.state
+            op = _PowerOperation(target)
+            self._operation = op
+            self.state = self.TURNING_ON if target else self.TURNING_OFF
+
+        try:
+            if target:
+                op.result = bool(self._turn_on())
+            else:
+                op.result = bool(self._turn_off())
+        except Exception as e:
+            op.error = e
+            op.result = False
+
+        with self._condition:
+            self.executed_count += 1
+            if op.preempted:
+                pass
+            elif op.result:
+                self.state = self.ON if target else self.OFF
+            else:
+                self.state = previous
+            op.done = True
+            self._operation = None
+            self._condition.notify_all()
+
+        if op.error is not None:
+            raise op.error
+        return op.result
+
+    def toggle(self):
+        with self._condition:
+            if self._operation is not None:
+                target = self._operation.target
+            else:
+                target = self.state != self.ON
+
+        return self.request(target)
+
+    def preempt(self, is_on):
+        """Settle on ``is_on`` right away, ahead of any operation in flight.
+
+        The operation in flight keeps running but its result no longer
+        changes the state.
+        """
+        with self._condition:
+            self.preempted_count += 1
+            if self._operation is not None:
+                self._operation.preempted = True
+            self.state = self.ON if is_on else self.OFF
+
+    def sensed(self, is_on):
+        """Update the settled state from sensing while nothing is in flight."""
+        with self._condition:
+            if self._operation is None:
+                self.state = self.ON if is_on else self.OFF
+
+    def get_stats(self):
+        return dict(
+            state=self.state,
+            requests=self.request_count,
+            merged=self.merged_count,
+            skipped=self.skipped_count,
+            preempted=self.preempted_count,
+            executed=self.executed_count
+        )
+
+
+class Preemption(object):
+    """Lets an emergency abort the power operations in flight.
+
+    An operation captures a ``PreemptToken`` when it starts and is preempted
+    once ``preempt`` moved the generation past the one it captured. Every
+    generation has its own event, so a new operation never clears the event
+    an older one is waiting on.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._event = threading.Event()
+        self.generation = 0
+
+    def begin(self):
+        with self._lock:
+            return PreemptToken(self, self.generation, self._event)
+
+    def preempt(self):
+        with self._lock:
+            self.generation += 1
+            event, self._event = self._event, threading.Event()
+        event.set()
+
+
+class PreemptToken(object):
+    def __init__(self, preemption, generation, event):
+        self._preemption = preemption
+        self.generation = generation
+        self.event = event
+
+    def is_preempted(self):
+        return self._preemption.generation != self.generation
+
+    def wait(self, timeout):
+        """Sleep for ``timeout`` seconds and return whether it was preempted."""
+        self.event.wait(timeout)
+        return self.is_preempted()
+
+
+class AdaptivePollInterval(object):
+    """Picks the delay until the next sensing poll.
+
+    Polls at ``fast_interval`` for ``fast_window`` seconds after ``boost``,
+    at ``base_interval`` while printing or right after a state change, and
+    otherwise backs off by ``backoff`` per stable poll up to ``max_interval``.
+    """
+    def __init__(self, base_interval=5, fast_interval=0.25, fast_window=10, max_interval=60, backoff=1.5):
+        self._boost_until = 0
+        self._polls = collections.deque(maxlen=4096)
+        self.configure(base_interval, fast_interval, fast_window, max_interval, backoff)
+
+    def configure(self, base_interval, fast_interval, fast_window, max_interval, backoff):
+        self.base_interval = base_interval
+        self.fast_interval = min(fast_interval, base_interval)
+        self.fast_window = fast_window
+        self.max_interval = max(max_interval, base_interval)
+        self.backoff = max(1.0, backoff)
+        self.current = self.base_interval
+
+    def boost(self):
+        self._boost_until = time.time() + self.fast_window
+
+    def next_interval(self, changed, printing):
+        now = time.time()
+        self._polls.append(now)
+
+        if changed or printing:
+            self.current = self.base_interval
+        else:
+            self.current = min(self.max_interval, self.current * self.backoff)
+
+        if now < self._boost_until:
+            return self.fast_interval
+        return self.current
+
+    def get_stats(self, window=300):
+        now = time.time()
+        polls = sum(1 for t in self._polls if now - t <= window)
+        return dict(
+            interval=self.current,
+            boosted=now < self._boost_until,
+            pollsPerMinute=round(polls * 60.0 / window, 2)
+        )
+
+
+def precise_sleep(duration, spin=0.002):
+    """Sleep for ``duration`` seconds and return the time actually slept.
+
+    Sleeps normally until ``spin`` seconds before the deadline and busy
+    waits the rest, which keeps the error well under a millisecond.
+    """
+    start = time.perf_counter()
+    deadline = start + duration
+    while True:
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+            break
+        if remaining > spin:
+            time.sleep(remaining - spin)
+    return time.perf_counter() - start
+
+
+class _Flight(object):
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """Merges concurrent calls of ``function`` into one.
+
+    A caller arriving while a call is in flight waits for it and shares its
+    result instead of starting another call.
+    """
+    def __init__(self, function):
+        self._function = function
+        self._lock = threading.Lock()
+        self._flight = None
+
+        self.call_count = 0
+        self.merged_count = 0
+
+    def __call__(self):
+        with self._lock:
+            flight = self._flight
+            if flight is None:
+                owner = True
+                flight = self._flight = _Flight()
+                self.call_count += 1
+            else:
+                owner = False
+                self.merged_count += 1
+
+        if owner:
+            try:
+                flight.result = self._function()
+            except Exception as e:
+                flight.error = e
+            finally:
+                with self._lock:
+                    self._flight = None
+                flight.event.set()
+        else:
+            flight.event.wait()
+
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    def get_stats(self):
+        return dict(calls=self.call_count, merged=self.merged_count)
+
+
+class SwitchRejected(Exception):
+    def __init__(self, reason, retry_after):
+        Exception.__init__(self, "{} (retry in {:.1f}s)".format(reason, retry_after))
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class OutputProtection(object):
+    """Limits how often the switched output may change.
+
+    A change is held back until the current state has lasted its minimum
+    dwell time, and power on is held back while the rolling window already
+    holds the maximum number of cycles.
+    """
+    QUEUE = 'QUEUE'
+    REJECT = 'REJECT'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state = None
+        self._changed = 0
+        self._cycles = collections.deque()
+
+        self.enabled = False
+        self.min_on = 0
+        self.min_off = 0
+        self.max_cycles = 0
+        self.window = 0
+        self.policy = self.QUEUE
+        self.max_queue = 0
+
+        self.rejected = collections.Counter()
+        self.queued_count = 0
+        self.queued_seconds = 0.0
+
+    def configure(self, enabled, min_on, min_off, max_cycles, window, policy, max_queue):
+        self.enabled = enabled
+        self.min_on = max(0, min_on)
+        self.min_off = max(0, min_off)
+        self.max_cycles = max(0, max_cycles)
+        self.window = max(0, window)
+        self.policy = policy
+        self.max_queue = max(0, max_queue)
+
+    def delay(self, on, now=None):
+        """Return how long to wait before switching to ``on`` is allowed and why."""
+        if now is None:
+            now = time.time()
+
+        with self._lock:
+            if not self.enabled or self._state is None or self._state == on:
+                return 0, None
+
+            if self._state:
+                delay, reason = self._changed + self.min_on - now, 'minOnTime'
+            else:
+                delay, reason = self._changed + self.min_off - now, 'minOffTime'
+
+            if on and self.max_cycles:
+                while self._cycles and self._cycles[0] <= now - self.window:
+                    self._cycles.popleft()
+                if len(self._cycles) >= self.max_cycles:
+                    budget = self._cycles[0] + self.window - now
+                    if budget > delay:
+                        delay, reason = budget, 'cycleBudget'
+
+            return max(0, delay), reason
+
+    def acquire(self, on, abort=None):
+        """Block until switching to ``on`` is allowed, or raise ``SwitchRejected``.
+
+        ``abort`` is an optional ``threading.Event`` that ends a queued wait early.
+        Returns False if the wait was aborted.
+        """
+        while True:
+            delay, reason = self.delay(on)
+            if delay <= 0:
+                return True
+
+            if self.policy == self.REJECT or delay > self.max_queue:
+                with self._lock:
+                    self.rejected[reason] += 1
+                raise SwitchRejected(reason, delay)
+
+            with self._lock:
+                self.queued_count += 1
+                self.queued_seconds += delay
+
+            if abort is not None:
+                if abort.wait(delay):
+                    return False
+            else:
+                time.sleep(delay)
+
+    def record(self, on, now=None):
+        """Note that the output was switched to ``on``."""
+        if now is None:
+            now = time.time()
+
+        with self._lock:
+            if self._state == on:
+                return
+            self._state = on
+            self._changed = now
+            if on:
+                self._cycles.append(now)
+
+    def get_stats(self):
+        now = time.time()
+        with self._lock:
+            return dict(
+                enabled=self.enabled,
+                policy=self.policy,
+                rejected=dict(self.rejected),
+                rejectedTotal=sum(self.rejected.values()),
+                queued=self.queued_count,
+                queuedSeconds=round(self.queued_seconds, 3),
+                cyclesInWindow=sum(1 for t in self._cycles if t > now - self.window)
+            )
@@ -0,0 +1,140 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+__author__ = "Shawn Bruce <kantlivelong@gmail.com>"
+__license__ = "GNU Affero General Public License http://www.gnu.org/licenses/agpl.html"
+__copyright__ = "Copyright (C) 2017 Shawn Bruce - Released under terms of the AGPLv3 License"
+
+import collections
+import threading
+import time
+import uuid
+
+
+class WorkflowError(Exception):
+    pass
+
+
+class WorkflowCancelled(WorkflowError):
+    pass
+
+
+class Workflow(threading.Thread):
+    """Runs a list of named steps in order on its own thread.
+
+    Each step is called with the workflow and may register cleanup functions
+    with ``add_cleanup``. If a step fails or the workflow is cancelled, the
+    registered cleanups run in reverse order.
+    """
+    def __init__(self, name, steps, on_update=None, logger=None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.state = 'PENDING'
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+        self.steps = collections.OrderedDict((n, dict(state='PENDING', started=None, finished=None)) for n, _ in steps)
+        self._functions = steps
+        self._cleanups = []
+        self._cancelled = False
+        self._condition = threading.Condition()
+        self._on_update = on_update
+        self.logger = logger
+
+    def to_dict(self):
+        return dict(id=self.id,
+                    name=self.name,
+                    state=self.state,
+                    error=self.error,
+                    created=self.created,
+                    finished=self.finished,
+                    steps=[dict(name=n, **s) for n, s in self.steps.items()])
+
+    def is_active(self):
+        return self.state in ('PENDING', 'RUNNING')
+
+    def add_cleanup(self, function):
+        self._cleanups.append(function)
+
+    def cancel(self):
+        with self._condition:
+            self._cancelled = True
+            self._condition.notify_all()
+
+    def notify(self):
+        with self._condition:
+            self._condition.notify_all()
+
+    def wait_for(self, predicate, timeout, description):
+        """Block until ``predicate()`` is true, re-checking on every ``notify``."""
+        deadline = time.time() + timeout
+        with self._condition:
+            while not predicate():
+                if self._cancelled:
+                    raise WorkflowCancelled("Cancelled")
+
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise WorkflowError("Timed out after {}s waiting for {}".format(timeout, description))
+
+                self._condition.wait(min(remaining, 1.0))
+
+    def _update(self):
+        if self._on_update is None:
+            return
+        try:
+            self._on_update(self)
+        except Exception:
+            if self.logger is not None:
+                self.logger.exception("Error while publishing workflow progress")
+
+    def run(self):
+        self.state = 'RUNNING'
+        self._update()
+
+        try:
+            for name, function in self._functions:
+                if self._cancelled:
+                    raise WorkflowCancelled("Cancelled")
+
+                step = self.steps[name]
+                step['state'] = 'RUNNING'
+                step['started'] = time.time()
+                self._update()
+
+                try:
+                    if function(self) is False:
+                        step['state'] = 'SKIPPED'
+                    else:
+                        step['state'] = 'DONE'
+                except Exception:
+                    step['state'] = 'FAILED'
+                    raise
+                finally:
+                    step['finished'] = time.time()
+                    self._update()
+
+            self.state = 'DONE'
+        except WorkflowCancelled:
+            self.state = 'CANCELLED'
+            self._cleanup()
+        except Exception as e:
+            if not isinstance(e, WorkflowError) and self.logger is not None:
+                self.logger.exception("Error in workflow {}".format(self.name))
+            self.state = 'FAILED'
+            self.error = str(e)
+            self._cleanup()
+        finally:
+            self.finished = time.time()
+            self._update()
+
+    def _cleanup(self):
+        while self._cleanups:
+            function = self._cleanups.pop()
+            try:
+                function()
+            except Exception:
+                if self.logger is not None:
+                    self.logger.exception("Error while cleaning up workflow {}".format(self.name))
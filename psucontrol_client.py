@@ -0,0 +1,58 @@
+# coding=utf-8
+from __future__ import absolute_import, print_function
+
+__author__ = "Shawn Bruce <kantlivelong@gmail.com>"
+__license__ = "GNU Affero General Public License http://www.gnu.org/licenses/agpl.html"
+__copyright__ = "Copyright (C) 2017 Shawn Bruce - Released under terms of the AGPLv3 License"
+
+# Minimal client for the PSU Control socket. Deliberately does not import OctoPrint.
+
+import argparse
+import os
+import socket
+import sys
+
+DEFAULT_SOCKET = os.path.join(os.path.expanduser("~"), ".octoprint", "data", "psucontrol", "control.sock")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Control PSU Control through its local socket.")
+    parser.add_argument("command", choices=["on", "off", "toggle", "status", "subscribe"])
+    parser.add_argument("--socket", default=os.environ.get("PSUCONTROL_SOCKET", DEFAULT_SOCKET),
+                        help="Path of the control socket.")
+    parser.add_argument("--return-int", action="store_true", help="Return the PSU state as a boolean integer.")
+    args = parser.parse_args()
+
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        s.connect(args.socket)
+    except (IOError, OSError) as e:
+        print("Unable to connect to {}: {}".format(args.socket, e), file=sys.stderr)
+        sys.exit(1)
+
+    s.sendall((args.command + "\n").encode("utf-8"))
+    f = s.makefile("r")
+
+    try:
+        for line in f:
+            line = line.strip()
+            if line.startswith("error"):
+                print(line, file=sys.stderr)
+                sys.exit(1)
+
+            if args.return_int and line in ("on", "off"):
+                line = str(int(line == "on"))
+
+            print(line)
+            sys.stdout.flush()
+
+            if args.command != "subscribe":
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        s.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -45,6 +45,9 @@ def params():
 	# we only have our plugin package to install
 	packages = [plugin_package]
 
+	# the socket client is kept outside the plugin package so it can run without importing OctoPrint
+	py_modules = ["psucontrol_client"]
+
 	# we might have additional data files in sub folders that need to be installed too
 	package_data = {plugin_package: package_data_dirs(plugin_package, ['static', 'templates', 'translations'] + plugin_additional_data)}
 	include_package_data = True
@@ -59,7 +62,8 @@ def params():
 	# Hook the plugin into the "octoprint.plugin" entry point, mapping the plugin_identifier to the plugin_package.
 	# That way OctoPrint will be able to find the plugin and load it.
 	entry_points = {
-		"octoprint.plugin": ["%s = %s" % (plugin_identifier, plugin_package)]
+		"octoprint.plugin": ["%s = %s" % (plugin_identifier, plugin_package)],
+		"console_scripts": ["psucontrol-client = psucontrol_client:main"]
 	}
 
 	return locals()
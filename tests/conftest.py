@@ -0,0 +1,136 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+__author__ = "Shawn Bruce <kantlivelong@gmail.com>"
+__license__ = "GNU Affero General Public License http://www.gnu.org/licenses/agpl.html"
+__copyright__ = "Copyright (C) 2017 Shawn Bruce - Released under terms of the AGPLv3 License"
+
+import logging
+from unittest import mock
+
+import flask
+import pytest
+from octoprint.events import Events
+
+import octoprint_psucontrol
+
+# normally registered by OctoPrint through register_custom_events
+if not hasattr(Events, "PLUGIN_PSUCONTROL_PSU_STATE_CHANGED"):
+    Events.PLUGIN_PSUCONTROL_PSU_STATE_CHANGED = "plugin_psucontrol_psu_state_changed"
+
+
+class Settings(object):
+    """Plugin settings backed by a dict, falling back to the plugin defaults."""
+    def __init__(self, defaults, values):
+        self._defaults = defaults
+        self._values = dict(values)
+        self._global = dict()
+        self._scripts = dict()
+
+    def get(self, path, **kwargs):
+        return self._values.get(path[0], self._defaults.get(path[0]))
+
+    def get_int(self, path, **kwargs):
+        return int(self.get(path))
+
+    def get_float(self, path, **kwargs):
+        return float(self.get(path))
+
+    def get_boolean(self, path, **kwargs):
+        return bool(self.get(path))
+
+    def set(self, path, value, **kwargs):
+        self._values[path[0]] = value
+
+    def save(self, *args, **kwargs):
+        pass
+
+    def global_get(self, path, **kwargs):
+        return self._global.get(tuple(path))
+
+    def global_set(self, path, value, **kwargs):
+        self._global[tuple(path)] = value
+
+    def listScripts(self, script_type):
+        return list(self._scripts.keys())
+
+    def saveScript(self, script_type, name, script):
+        self._scripts[name] = script
+
+
+class FakePSU(object):
+    """A sub plugin switching and sensing a simulated PSU."""
+    def __init__(self):
+        self.on = False
+        self.switch_count = 0
+
+    def turn_psu_on(self):
+        self.on = True
+        self.switch_count += 1
+
+    def turn_psu_off(self):
+        self.on = False
+        self.switch_count += 1
+
+    def get_psu_state(self):
+        return self.on
+
+
+def create_printer():
+    printer = mock.MagicMock()
+    printer.is_printing.return_value = False
+    printer.is_paused.return_value = False
+    printer.is_closed_or_error.return_value = True
+    printer.is_operational.return_value = False
+    printer.get_state_id.return_value = "CLOSED"
+    printer.get_current_temperatures.return_value = dict()
+    return printer
+
+
+@pytest.fixture
+def psu():
+    return FakePSU()
+
+
+@pytest.fixture
+def make_plugin(tmp_path, psu):
+    """Create a plugin switched and sensed through ``psu`` without starting its threads."""
+    def make(**settings):
+        values = dict(switchingMethod='PLUGIN',
+                      switchingPlugin='fakepsu',
+                      sensingMethod='PLUGIN',
+                      sensingPlugin='fakepsu')
+        values.update(settings)
+
+        plugin = octoprint_psucontrol.PSUControl()
+        plugin._identifier = "psucontrol"
+        plugin._logger = logging.getLogger("octoprint.plugins.psucontrol")
+        plugin._settings = Settings(plugin.get_settings_defaults(), values)
+        plugin._printer = create_printer()
+        plugin._plugin_manager = mock.MagicMock()
+        plugin._event_bus = mock.MagicMock()
+        plugin._file_manager = mock.MagicMock()
+        plugin._data_folder = str(tmp_path)
+        plugin._sub_plugins['fakepsu'] = psu
+        plugin.on_settings_initialized()
+        plugin._powerSaving.logger = plugin._logger
+        return plugin
+
+    return make
+
+
+@pytest.fixture
+def plugin(make_plugin):
+    return make_plugin()
+
+
+@pytest.fixture
+def permissions(monkeypatch):
+    """Grant every permission to API calls made inside a request context.
+
+    Single permissions can be revoked with ``permissions.X.can.return_value = False``.
+    """
+    permissions = mock.MagicMock()
+    monkeypatch.setattr(octoprint_psucontrol, "Permissions", permissions)
+    with flask.Flask(__name__).test_request_context():
+        yield permissions
@@ -0,0 +1,126 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+__author__ = "Shawn Bruce <kantlivelong@gmail.com>"
+__license__ = "GNU Affero General Public License http://www.gnu.org/licenses/agpl.html"
+__copyright__ = "Copyright (C) 2017 Shawn Bruce - Released under terms of the AGPLv3 License"
+
+import importlib
+import json
+import logging
+import os
+import socket
+import stat
+import sys
+
+import pytest
+
+from octoprint_psucontrol.control_socket import ControlSocketServer
+
+LOGGER = logging.getLogger("octoprint.plugins.psucontrol")
+
+
+@pytest.fixture
+def state():
+    return dict(on=False)
+
+
+@pytest.fixture
+def commands(state):
+    def switch(on):
+        state['on'] = on
+    return dict(on=lambda: switch(True),
+                off=lambda: switch(False),
+                toggle=lambda: switch(not state['on']),
+                status=lambda: state['on'])
+
+
+@pytest.fixture
+def server(tmp_path, commands):
+    server = ControlSocketServer(str(tmp_path / "control.sock"), commands, LOGGER)
+    server.start()
+    yield server
+    server.stop()
+
+
+def _connect(path):
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    s.settimeout(5)
+    s.connect(path)
+    return s, s.makefile('rwb')
+
+
+def _request(f, line):
+    f.write((line + '\n').encode('utf-8'))
+    f.flush()
+    return f.readline().decode('utf-8').strip()
+
+
+def test_commands(server, state):
+    s, f = _connect(server.path)
+    try:
+        assert _request(f, "status") == "off"
+        assert _request(f, "on") == "ok"
+        assert state['on']
+        assert _request(f, "TOGGLE") == "ok"
+        assert _request(f, "nonsense") == "error unknown command"
+        assert json.loads(_request(f, '{"command": "status"}')) == dict(ok=True, isPSUOn=False)
+        assert json.loads(_request(f, '{"command": "fly"}')) == dict(ok=False, error="unknown command")
+    finally:
+        s.close()
+
+
+def test_subscribe(server, state):
+    s, f = _connect(server.path)
+    try:
+        assert _request(f, "subscribe") == "off"
+        server.publish(True)
+        assert f.readline().decode('utf-8').strip() == "on"
+    finally:
+        s.close()
+
+
+def test_permissions(tmp_path, commands):
+    path = str(tmp_path / "control.sock")
+    server = ControlSocketServer(path, commands, LOGGER, mode=0o600)
+    try:
+        assert stat.S_ISSOCK(os.lstat(path).st_mode)
+        assert stat.S_IMODE(os.lstat(path).st_mode) == 0o600
+    finally:
+        server.stop()
+    assert not os.path.exists(path)
+
+
+def test_replaces_stale_socket(tmp_path, commands):
+    path = str(tmp_path / "control.sock")
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(path)
+    stale.close()
+
+    server = ControlSocketServer(path, commands, LOGGER)
+    server.stop()
+
+
+def test_refuses_to_replace_other_files(tmp_path, commands):
+    path = tmp_path / "control.sock"
+    path.write_text("keep me")
+
+    with pytest.raises(OSError):
+        ControlSocketServer(str(path), commands, LOGGER)
+    assert path.read_text() == "keep me"
+
+
+def test_unknown_group_creates_nothing(tmp_path, commands):
+    path = tmp_path / "control.sock"
+
+    with pytest.raises(KeyError):
+        ControlSocketServer(str(path), commands, LOGGER, group="no-such-group-psucontrol")
+    assert not os.path.lexists(str(path))
+
+
+def test_unavailable_without_unix_sockets(monkeypatch):
+    monkeypatch.delattr(socket, "AF_UNIX")
+    monkeypatch.delitem(sys.modules, "octoprint_psucontrol.control_socket")
+
+    with pytest.raises(ImportError):
+        importlib.import_module("octoprint_psucontrol.control_socket")
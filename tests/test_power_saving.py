@@ -0,0 +1,58 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+__author__ = "Shawn Bruce <kantlivelong@gmail.com>"
+__license__ = "GNU Affero General Public License http://www.gnu.org/licenses/agpl.html"
+__copyright__ = "Copyright (C) 2017 Shawn Bruce - Released under terms of the AGPLv3 License"
+
+import logging
+import threading
+import time
+
+from octoprint_psucontrol.power_saving import run_parallel, PowerSaving
+
+
+def test_run_parallel_runs_at_once():
+    start = time.time()
+    results = run_parallel(["sleep 0.3", "sleep 0.3", "exit 3"], 5)
+
+    assert time.time() - start < 0.55
+    assert sorted(r['returncode'] for r in results) == [0, 0, 3]
+
+
+def test_run_parallel_kills_after_timeout():
+    start = time.time()
+    result, = run_parallel(["sleep 10"], 0.2)
+
+    assert time.time() - start < 2
+    assert result['error'] == "timed out"
+
+
+def test_power_saving_enter_and_exit():
+    saving = PowerSaving(logging.getLogger("octoprint.plugins.psucontrol"))
+    actions = []
+
+    assert saving.enter(["exit 0"], 5, actions=lambda: actions.append("enter")) is not None
+    # already active
+    assert saving.enter(["exit 0"], 5) is None
+    assert saving.get_stats()['active']
+
+    assert saving.exit(["exit 1"], 5) is not None
+    assert saving.exit(["exit 0"], 5) is None
+    stats = saving.get_stats()
+    assert actions == ["enter"]
+    assert stats['entries'] == 1
+    assert not stats['active']
+    assert stats['lastExit']['commands'][0]['returncode'] == 1
+
+
+def test_power_saving_serializes_enter_and_exit():
+    saving = PowerSaving()
+    entering = threading.Thread(target=saving.enter, args=(["sleep 0.3"], 5))
+    entering.start()
+    time.sleep(0.1)
+
+    # waits for the enter to finish instead of interleaving with it
+    assert saving.exit([], 5) is not None
+    entering.join(5)
+    assert not saving.active
@@ -0,0 +1,109 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+__author__ = "Shawn Bruce <kantlivelong@gmail.com>"
+__license__ = "GNU Affero General Public License http://www.gnu.org/licenses/agpl.html"
+__copyright__ = "Copyright (C) 2017 Shawn Bruce - Released under terms of the AGPLv3 License"
+
+import time
+
+import pytest
+from octoprint.events import Events
+
+import octoprint_psucontrol
+from octoprint_psucontrol import prescan
+from octoprint_psucontrol.prescan import PrescanCache, get_dwell_seconds, get_gcode_command, get_parameters, scan_gcode
+
+AUTO_ON = ["G0", "G1", "G28", "M104"]
+
+
+def _write(tmp_path, text, name="part.gcode"):
+    path = tmp_path / name
+    path.write_text(text)
+    return str(path)
+
+
+def test_line_parsing():
+    assert get_gcode_command("N12 g1 X5 ; move") == "G1"
+    assert get_gcode_command("M105*34") == "M105"
+    assert get_gcode_command("; only a comment") is None
+    assert get_dwell_seconds("G4 P1500") == 1.5
+    assert get_dwell_seconds("G4 S2 ; wait") == 2.0
+    assert get_parameters("G1 X5 y-2.5 F1200 ; Z9") == dict(X=5.0, Y=-2.5, F=1200.0)
+
+
+def test_scan_dwells(tmp_path):
+    path = _write(tmp_path, "M105\nG28\nM105\nG4 S90\nM105\nG4 P500\nG1 X1\nG4 S10\n")
+    result = scan_gcode(path, AUTO_ON, ["M105", "G4"])
+
+    assert result['lines'] == 8
+    assert result['firstAutoOnTrigger'] == dict(line=2, command="G28")
+    assert result['ignoredGaps'] == [dict(startLine=3, endLine=6, seconds=90.5),
+                                     dict(startLine=8, endLine=8, seconds=10.0)]
+
+
+def test_scan_without_dwells_has_no_gaps(tmp_path):
+    path = _write(tmp_path, "G1 F600 X10\nM105\nM105\nG1 X20\n")
+    assert scan_gcode(path, AUTO_ON, ["M105"])['ignoredGaps'] == []
+
+
+def test_scan_estimates_ignored_moves(tmp_path):
+    # 10mm/s: 30mm, 40mm diagonal 50mm, 20mm relative, 5mm extrusion only
+    path = _write(tmp_path, "G28\nG90\nG1 F600\nG1 X30 Y40\nG91\nG1 Z20\nG92 E0\nG1 E5\nM104 S200\n")
+    result = scan_gcode(path, ["M104"], ["G1", "G90", "G91", "G92"])
+
+    assert result['firstAutoOnTrigger'] == dict(line=9, command="M104")
+    assert len(result['ignoredGaps']) == 1
+    assert result['ignoredGaps'][0]['startLine'] == 2
+    assert result['ignoredGaps'][0]['seconds'] == pytest.approx(7.5)
+
+
+def test_cache(tmp_path, monkeypatch):
+    path = _write(tmp_path, "G28\nM105\nG4 S60\n")
+    scans = []
+    original = prescan.scan_gcode
+    monkeypatch.setattr(prescan, "scan_gcode", lambda *args: scans.append(args) or original(*args))
+
+    cache = PrescanCache()
+    first = cache.get(path, AUTO_ON, ["M105", "G4"])
+    assert cache.get(path, AUTO_ON, ["M105", "G4"]) is first
+    assert cache.get(path, AUTO_ON, ["M105", "G4"], file_hash=first['hash']) is first
+    assert len(scans) == 1
+
+    cache.get(path, AUTO_ON, ["M105"])
+    assert len(scans) == 2
+
+    _write(tmp_path, "G28\nM105\nG4 S120\n")
+    assert cache.get(path, AUTO_ON, ["M105", "G4"])['ignoredGaps'][0]['seconds'] == 120
+    assert len(scans) == 3
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    cache = PrescanCache(size=2)
+    paths = [_write(tmp_path, "G28\nG4 S{}\n".format(i), "{}.gcode".format(i)) for i in range(3)]
+    for path in paths:
+        cache.get(path, AUTO_ON, ["G4"])
+    assert len(cache._results) == 2
+
+
+def _wait(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_upload_is_scanned(make_plugin, tmp_path, monkeypatch):
+    # the file type registry needs the plugin manager
+    monkeypatch.setattr(octoprint_psucontrol, "valid_file_type", lambda path, type=None: path.endswith(".gcode"))
+    plugin = make_plugin(prescanGCode=True)
+    path = _write(tmp_path, "G28\nM105\nG4 S60\n")
+    plugin._file_manager.path_on_disk.return_value = path
+    plugin._file_manager.get_metadata.return_value = dict()
+
+    plugin.on_event(Events.UPLOAD, dict(name="part.gcode", path="part.gcode", target="local"))
+    assert _wait(lambda: len(plugin._prescanCache._results) == 1)
+
+    plugin.on_event(Events.UPLOAD, dict(name="part.stl", path="part.stl", target="local"))
+    time.sleep(0.1)
+    plugin._file_manager.path_on_disk.assert_called_once_with("local", "part.gcode")
@@ -0,0 +1,370 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+__author__ = "Shawn Bruce <kantlivelong@gmail.com>"
+__license__ = "GNU Affero General Public License http://www.gnu.org/licenses/agpl.html"
+__copyright__ = "Copyright (C) 2017 Shawn Bruce - Released under terms of the AGPLv3 License"
+
+import json
+import threading
+import time
+from unittest import mock
+
+import pytest
+from octoprint.events import Events
+
+
+def test_power_ready_waits_for_serial_port(make_plugin, tmp_path):
+    plugin = make_plugin(sensingMethod='INTERNAL', connectOnPowerOn=True)
+    port = tmp_path / "ttyACM0"
+    plugin._settings.global_set(["serial", "port"], str(port))
+
+    # slower than the old fixed 0.1s delay, well within powerReadyTimeout
+    threading.Timer(0.5, port.touch).start()
+    start = time.time()
+    plugin._wait_for_power_ready(plugin._preemption.begin())
+    assert port.exists()
+    assert time.time() - start < 2
+
+
+def test_power_ready_post_on_delay_caps_probes(make_plugin, tmp_path):
+    plugin = make_plugin(sensingMethod='INTERNAL', connectOnPowerOn=True, postOnDelay=3)
+    port = tmp_path / "ttyACM0"
+    plugin._settings.global_set(["serial", "port"], str(port))
+
+    # no extra delay once the port is there
+    threading.Timer(0.2, port.touch).start()
+    start = time.time()
+    plugin._wait_for_power_ready(plugin._preemption.begin())
+    assert time.time() - start < 1
+
+    # and no longer than postOnDelay if it never appears
+    port.unlink()
+    plugin.config['postOnDelay'] = 0.3
+    start = time.time()
+    plugin._wait_for_power_ready(plugin._preemption.begin())
+    assert 0.25 < time.time() - start < 1
+
+
+def test_power_ready_without_probes_uses_fixed_delay(make_plugin):
+    plugin = make_plugin(sensingMethod='INTERNAL', postOnDelay=0.2)
+
+    start = time.time()
+    plugin._wait_for_power_ready(plugin._preemption.begin())
+    assert 0.25 < time.time() - start < 1
+
+
+def test_tiered_sensing(make_plugin, psu):
+    plugin = make_plugin(sensingMethodSecondary='SYSTEM', senseSystemCommand='exit 0')
+
+    psu.on = True
+    assert plugin._sense_tiered() is True
+    assert plugin._sense_tiered() is True
+    # both agree, the secondary source is only read again at its interval
+    assert plugin._senseStats == dict(primary=2, secondary=1, conflicts=0)
+
+    psu.on = False
+    assert plugin._sense_tiered() is True
+    assert plugin._senseStats == dict(primary=3, secondary=2, conflicts=1)
+
+    plugin.config['senseConflictResolution'] = 'PRIMARY'
+    assert plugin._sense_tiered() is False
+    plugin.config['senseConflictResolution'] = 'ON'
+    assert plugin._sense_tiered() is True
+
+
+def test_tiered_sensing_ignores_same_method(make_plugin):
+    plugin = make_plugin(sensingMethodSecondary='PLUGIN')
+    assert plugin.config['sensingMethodSecondary'] == ''
+
+
+def test_restore_state(make_plugin, tmp_path):
+    (tmp_path / "state.json").write_text(json.dumps(dict(isPSUOn=True, timestamp=0)))
+    plugin = make_plugin()
+    plugin._restore_state()
+    assert plugin.isPSUOn is True
+    assert plugin._stateConfirmed is False
+
+
+def test_restore_state_without_state(make_plugin, tmp_path):
+    (tmp_path / "state.json").write_text(json.dumps(dict(timestamp=0)))
+    plugin = make_plugin()
+    plugin._restore_state()
+    assert plugin.isPSUOn is False
+
+
+def test_get_psu_state_returns_full_state(plugin, psu, permissions):
+    psu.on = True
+    plugin._update_psu_state()
+    plugin._idleTimerOverride = True
+    data = plugin.on_api_command("getPSUState", dict(fresh=True)).get_json()
+
+    assert data['isPSUOn'] is True
+    assert data['idleTimerOverride'] is True
+    for key in ('confirmed', 'idleTimeLeft', 'nextSchedule', 'powerState', 'senseAge'):
+        assert key in data
+    assert 'idleDeadline' not in data
+
+
+def test_switching_resets_idle_timer_override(plugin, psu):
+    plugin._idleTimerOverride = True
+    psu.on = True
+    plugin._update_psu_state()
+    assert plugin._idleTimerOverride is False
+
+
+def _emergency_off(plugin, psu):
+    psu.on = True
+    plugin._update_psu_state()
+    plugin.emergency_off("test")
+    plugin._update_psu_state()
+    assert not psu.on
+
+
+def test_emergency_off_survives_auto_on(make_plugin, psu):
+    plugin = make_plugin(autoOn=True)
+    _emergency_off(plugin, psu)
+
+    plugin.hook_gcode_queuing(mock.MagicMock(), "queuing", "G1 X10", None, "G1")
+    assert not psu.on
+    assert plugin.turn_psu_on() is False
+    assert not psu.on
+
+
+def test_emergency_off_survives_restart(make_plugin, psu):
+    _emergency_off(make_plugin(), psu)
+
+    plugin = make_plugin()
+    plugin._restore_state()
+    assert plugin._emergencyLatch == "test"
+    assert plugin.turn_psu_on() is False
+
+
+def test_clear_emergency_off(make_plugin, psu):
+    # the poll thread is not running to confirm the PSU is ready
+    plugin = make_plugin(autoOn=True, powerReadyTimeout=0.1)
+    _emergency_off(plugin, psu)
+    plugin._runawayTriggered = True
+
+    plugin.clear_emergency_off()
+    assert plugin._runawayTriggered is False
+    plugin.hook_gcode_queuing(mock.MagicMock(), "queuing", "G1 X10", None, "G1")
+    assert psu.on
+
+
+def test_emergency_off_api_refuses_power_on(make_plugin, psu, permissions):
+    plugin = make_plugin(powerReadyTimeout=0.1)
+    _emergency_off(plugin, psu)
+
+    for command in ("turnPSUOn", "togglePSU"):
+        response = plugin.on_api_command(command, dict())
+        assert response.status_code == 409
+        assert response.get_json()['reason'] == "test"
+    assert not psu.on
+
+    plugin.on_api_command("clearEmergencyOff", dict())
+    assert plugin.on_api_command("turnPSUOn", dict()) is None
+    assert psu.on
+
+
+def test_emergency_off_stops_the_printer(plugin, psu):
+    plugin._printer.is_printing.return_value = True
+    _emergency_off(plugin, psu)
+
+    plugin._printer.cancel_print.assert_called_once_with()
+    plugin._printer.disconnect.assert_called_once_with()
+
+
+def test_emergency_off_keeps_gcode_connection(make_plugin, psu):
+    plugin = make_plugin(switchingMethod='GCODE')
+    plugin.emergency_off("test")
+
+    plugin._printer.commands.assert_called_once_with(plugin.config['offGCodeCommand'])
+    plugin._printer.disconnect.assert_not_called()
+
+
+def test_system_switching_returns_when_the_command_exits(make_plugin):
+    plugin = make_plugin(switchingMethod='SYSTEM', offSysCommand='exit 0')
+
+    start = time.time()
+    assert plugin._switch_psu(False, confirm=False)
+    # used to poll the command every 100ms
+    assert time.time() - start < 0.09
+
+
+def test_get_psu_state_max_age(plugin, psu):
+    psu.on = True
+    assert plugin.get_psu_state(max_age=0) is True
+    reads = plugin._senseFlight.call_count
+
+    psu.on = False
+    # recent enough, served without sensing
+    assert plugin.get_psu_state(max_age=60) is True
+    assert plugin._senseFlight.call_count == reads
+    assert plugin.get_psu_state(max_age=0) is False
+
+
+class PulsePin(object):
+    """A GPIO line driving a PSU that toggles or latches on the end of each pulse."""
+    def __init__(self, plugin, psu, target=None):
+        self.plugin = plugin
+        self.psu = psu
+        self.target = target
+        self.writes = []
+
+    def write(self, value):
+        self.writes.append(value)
+        if len(self.writes) % 2 == 0:
+            self.psu.on = (not self.psu.on) if self.target is None else self.target
+            self.plugin._update_psu_state()
+
+
+def test_pulse_switching(make_plugin, psu):
+    plugin = make_plugin(switchingMethod='GPIO', switchingGPIOMode='PULSE', switchingGPIOPulseWidth=20)
+    pin = plugin._configuredGPIOPins['switch'] = PulsePin(plugin, psu)
+
+    assert plugin._switch_psu(True)
+    assert psu.on
+    assert pin.writes == [True, False]
+    assert 20 <= plugin._pulseStats['lastWidth'] < 25
+
+    # a pulse would toggle it back off
+    assert plugin._switch_psu(True)
+    assert pin.writes == [True, False]
+
+
+def test_pulse_switching_inverted(make_plugin, psu):
+    plugin = make_plugin(switchingMethod='GPIO', switchingGPIOMode='PULSE', invertonoffGPIOPin=True)
+    pin = plugin._configuredGPIOPins['switch'] = PulsePin(plugin, psu)
+
+    assert plugin._switch_psu(True)
+    assert pin.writes == [False, True]
+
+
+def test_pulse_switching_unconfirmed(make_plugin, psu):
+    plugin = make_plugin(switchingMethod='GPIO', switchingGPIOMode='PULSE', switchingGPIOConfirmTimeout=0.2)
+    plugin._configuredGPIOPins['switch'] = PulsePin(plugin, psu, target=False)
+
+    assert plugin._switch_psu(True) is False
+
+
+def test_latching_switching(make_plugin, psu):
+    plugin = make_plugin(switchingMethod='GPIO', switchingGPIOMode='LATCHING')
+    switch = plugin._configuredGPIOPins['switch'] = PulsePin(plugin, psu, target=True)
+    reset = plugin._configuredGPIOPins['reset'] = PulsePin(plugin, psu, target=False)
+
+    assert plugin._switch_psu(True)
+    assert plugin._switch_psu(False)
+    assert not psu.on
+    assert len(switch.writes) == 2
+    assert len(reset.writes) == 2
+
+
+def test_output_protection_rejects_through_the_api(make_plugin, psu, permissions):
+    plugin = make_plugin(enableOutputProtection=True, outputProtectionPolicy='REJECT', outputMinOnTime=60)
+    plugin._outputProtection.record(True)
+    psu.on = True
+    plugin._update_psu_state()
+
+    response = plugin.on_api_command("turnPSUOff", dict())
+    assert response.status_code == 409
+    assert response.get_json()['reason'] == 'minOnTime'
+    assert psu.on
+
+    # emergency off is never held back
+    plugin.emergency_off("test")
+    assert not psu.on
+
+
+def _power_saving(plugin):
+    plugin._powerSaving.enter([], 5)
+    plugin._powerState.sensed(False)
+
+
+def test_connect_blocked_while_power_saving(make_plugin):
+    plugin = make_plugin(enablePowerSaving=True)
+    assert plugin.hook_handle_connect(plugin._printer) is False
+
+    _power_saving(plugin)
+    assert plugin.hook_handle_connect(plugin._printer) is True
+
+    plugin.config['powerSavingBlockConnect'] = False
+    assert plugin.hook_handle_connect(plugin._printer) is False
+
+
+def test_connect_senses_before_refusing(make_plugin, psu):
+    plugin = make_plugin(enablePowerSaving=True)
+    _power_saving(plugin)
+
+    # turned on at the wall, not yet seen by the slowed down polling
+    psu.on = True
+    assert plugin.hook_handle_connect(plugin._printer) is False
+    assert plugin.isPSUOn
+
+
+def test_connect_never_blocked_with_gcode_switching(make_plugin):
+    plugin = make_plugin(enablePowerSaving=True, switchingMethod='GCODE')
+    _power_saving(plugin)
+
+    assert plugin.hook_handle_connect(plugin._printer) is False
+
+
+def test_power_saving_cancels_connection_attempts(make_plugin):
+    plugin = make_plugin(enablePowerSaving=True)
+    plugin._printer.get_state_id.return_value = "CONNECTING"
+    plugin._enter_power_saving()
+    plugin._printer.disconnect.assert_called_once_with()
+
+    plugin = make_plugin(enablePowerSaving=True, switchingMethod='GCODE')
+    plugin._printer.get_state_id.return_value = "CONNECTING"
+    plugin._enter_power_saving()
+    plugin._printer.disconnect.assert_not_called()
+
+
+def test_error_event_turns_off_without_latching(make_plugin, psu):
+    plugin = make_plugin(turnOffWhenError=True, powerReadyTimeout=0.1)
+    psu.on = True
+    plugin._update_psu_state()
+
+    plugin.on_event(Events.ERROR, dict(error="No more candidates to test", reason="autodetect"))
+    assert not psu.on
+    assert plugin._emergencyLatch is None
+    plugin._printer.disconnect.assert_not_called()
+
+    assert plugin.turn_psu_on()
+    assert psu.on
+
+
+@pytest.mark.parametrize("latch", [True, False])
+def test_emergency_off_racing_power_on(make_plugin, psu, latch):
+    plugin = make_plugin(powerReadyTimeout=0.1)
+    acquire = plugin._outputProtection.acquire
+
+    def emergency_then_acquire(on, abort=None):
+        # lands after the latch check, before the switch
+        plugin.emergency_off("test", latch=latch)
+        return acquire(on, abort=abort)
+
+    plugin._outputProtection.acquire = emergency_then_acquire
+    assert plugin.turn_psu_on() is False
+    assert not psu.on
+
+
+def test_restore_state_with_level_switching(make_plugin, tmp_path):
+    (tmp_path / "state.json").write_text(json.dumps(dict(isPSUOn=True, emergencyLatch="test")))
+    plugin = make_plugin(switchingMethod='GPIO', switchingGPIOMode='LEVEL', sensingMethod='INTERNAL')
+    plugin._restore_state()
+
+    assert plugin.isPSUOn is False
+    assert plugin._noSensing_isPSUOn is False
+    assert plugin._emergencyLatch == "test"
+
+
+def test_power_saving_pauses_debouncing(make_plugin):
+    plugin = make_plugin(enablePowerSaving=True)
+    plugin._senseDebouncer = mock.MagicMock()
+
+    plugin._enter_power_saving()
+    plugin._senseDebouncer.pause.assert_called_once_with()
+    plugin._exit_power_saving()
+    plugin._senseDebouncer.resume.assert_called_once_with()
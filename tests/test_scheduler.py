@@ -0,0 +1,119 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+__author__ = "Shawn Bruce <kantlivelong@gmail.com>"
+__license__ = "GNU Affero General Public License http://www.gnu.org/licenses/agpl.html"
+__copyright__ = "Copyright (C) 2017 Shawn Bruce - Released under terms of the AGPLv3 License"
+
+import datetime
+import logging
+import threading
+import time
+
+import pytest
+
+from octoprint_psucontrol.scheduler import Scheduler, next_weekly_occurrence
+
+
+@pytest.fixture
+def scheduler():
+    scheduler = Scheduler(logger=logging.getLogger("octoprint.plugins.psucontrol"))
+    scheduler.start()
+    yield scheduler
+    scheduler.stop()
+    scheduler.join(5)
+
+
+def _wait(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_scheduler_runs_calls_in_time_order(scheduler):
+    calls = []
+    now = time.time()
+    scheduler.schedule(now + 0.2, calls.append, args=["second"])
+    scheduler.schedule(now + 0.1, calls.append, args=["first"])
+    scheduler.schedule(now + 0.1, calls.append, args=["first again"])
+
+    assert _wait(lambda: len(calls) == 3)
+    assert calls == ["first", "first again", "second"]
+
+
+def test_scheduler_cancel_and_pending(scheduler):
+    calls = []
+    now = time.time()
+    keep = scheduler.schedule(now + 0.2, calls.append, args=["kept"], name="on")
+    dropped = scheduler.schedule(now + 0.1, calls.append, args=["cancelled"], name="off")
+    scheduler.cancel(dropped)
+
+    assert scheduler.pending() == [keep]
+    assert _wait(lambda: calls)
+    time.sleep(0.1)
+    assert calls == ["kept"]
+
+    scheduler.schedule(time.time() + 0.1, calls.append, args=["cleared"])
+    scheduler.clear()
+    time.sleep(0.2)
+    assert calls == ["kept"]
+    assert scheduler.pending() == []
+
+
+def test_scheduler_survives_errors(scheduler):
+    calls = []
+
+    def fail():
+        raise RuntimeError("scheduled call failed")
+
+    scheduler.schedule(time.time(), fail)
+    scheduler.schedule(time.time() + 0.05, calls.append, args=["after"])
+    assert _wait(lambda: calls == ["after"])
+
+
+def test_next_weekly_occurrence():
+    monday = datetime.datetime(2024, 1, 1, 10, 0)
+
+    assert next_weekly_occurrence("11:30", [0], now=monday) == datetime.datetime(2024, 1, 1, 11, 30)
+    assert next_weekly_occurrence("09:00", [0], now=monday) == datetime.datetime(2024, 1, 8, 9, 0)
+    assert next_weekly_occurrence("09:00", [2, 4], now=monday) == datetime.datetime(2024, 1, 3, 9, 0)
+    assert next_weekly_occurrence("09:00", [], now=monday) is None
+
+
+def test_scheduled_power_runs_off_the_scheduler_thread(plugin):
+    plugin._scheduler = Scheduler()
+    release = threading.Event()
+    requests = []
+
+    def slow_request(target, force=True, raise_rejected=False):
+        requests.append(target)
+        release.wait(5)
+        return True
+
+    plugin._request_power = slow_request
+
+    start = time.time()
+    plugin._run_window_event(dict(type='window', on='08:00', off='20:00'), True)
+    plugin._run_window_event(dict(type='window', on='08:00', off='20:00'), False)
+    assert time.time() - start < 0.5
+
+    assert _wait(lambda: sorted(requests) == [False, True])
+    release.set()
+    assert sorted(c.name for c in plugin._scheduler.pending()) == ['off', 'on']
+
+
+def test_scheduled_power_off_postponed_while_printing(plugin):
+    plugin._scheduler = Scheduler()
+    plugin._printer.is_printing.return_value = True
+    requests = []
+    plugin._request_power = lambda target, force=True, raise_rejected=False: requests.append(target)
+
+    plugin._scheduled_power(False)
+    assert requests == []
+    assert [c.name for c in plugin._scheduler.pending()] == ['off']
+
+    plugin._printer.is_printing.return_value = False
+    plugin._scheduled_power(False)
+    assert requests == [False]
+    assert plugin._scheduler.pending() == []
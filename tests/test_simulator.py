@@ -0,0 +1,118 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+__author__ = "Shawn Bruce <kantlivelong@gmail.com>"
+__license__ = "GNU Affero General Public License http://www.gnu.org/licenses/agpl.html"
+__copyright__ = "Copyright (C) 2017 Shawn Bruce - Released under terms of the AGPLv3 License"
+
+import datetime
+import random
+
+import pytest
+
+from octoprint_psucontrol import simulator
+from octoprint_psucontrol.simulator import Recording, pareto_front, simulate
+
+START = datetime.datetime(2017, 1, 1, 12, 0)
+
+
+def _serial_log(*entries):
+    """Format ``(seconds, message)`` entries as serial.log lines."""
+    for seconds, message in entries:
+        stamp = START + datetime.timedelta(seconds=seconds)
+        yield "{},{:03d} - {}\n".format(stamp.strftime("%Y-%m-%d %H:%M:%S"), stamp.microsecond // 1000, message)
+
+
+def _recording(*entries):
+    recording = Recording()
+    recording.add_serial_log(_serial_log(*entries))
+    recording.finish()
+    return recording
+
+
+def _simulate(recording, use_numpy, idle_timeouts=(5,), wait_temps=(50,)):
+    return simulate(recording, list(idle_timeouts), list(wait_temps), [["M105"]], [["G1"]], use_numpy=use_numpy)
+
+
+def _modes():
+    return [False, True] if simulator.HAS_NUMPY else [False]
+
+
+def test_serial_log_parsing():
+    recording = _recording((0.25, "Send: N1 G28*18"),
+                           (1, "Recv: ok T:210.5 /210.0 B:60.0 /60.0 T1:180.0 /0.0"),
+                           (2, "Recv: echo:busy"))
+
+    assert recording.commands == ["G28"]
+    assert recording.command_times[0] % 60 == pytest.approx(0.25)
+    assert recording.temperatures == [210.5]
+
+
+@pytest.mark.parametrize("use_numpy", _modes())
+def test_idle_power_off_and_auto_on(use_numpy):
+    recording = _recording((0, "Send: G28"),
+                           (10, "Send: M105"),
+                           (1200, "Send: G1 X10"))
+
+    result, = _simulate(recording, use_numpy)
+
+    assert result['powerOffs'] == 1
+    assert result['missedCommands'] == 0
+    assert result['interruptions'] == 0
+    assert result['onHours'] == round(300 / 3600.0, 3)
+
+
+@pytest.mark.parametrize("use_numpy", _modes())
+def test_power_off_waits_for_heaters(use_numpy):
+    recording = _recording((0, "Send: G28"),
+                           (0, "Recv: ok T:200.0 /0.0"),
+                           (398, "Recv: ok T:40.0 /0.0"),
+                           (700, "Send: G1 X10"))
+
+    result, = _simulate(recording, use_numpy)
+
+    # first check at the idle timeout, then every HEATER_CHECK_INTERVAL seconds
+    assert result['onHours'] == round(400 / 3600.0, 3)
+    # powered on again within the restart window
+    assert result['interruptions'] == 1
+
+
+@pytest.mark.parametrize("use_numpy", _modes())
+def test_missed_commands(use_numpy):
+    recording = _recording((0, "Send: G28"),
+                           (600, "Send: M117 Hello"),
+                           (700, "Send: G1 X10"))
+
+    result, = _simulate(recording, use_numpy)
+
+    assert result['powerOffs'] == 1
+    assert result['missedCommands'] == 1
+    assert result['interruptions'] == 1
+
+
+@pytest.mark.skipif(not simulator.HAS_NUMPY, reason="numpy is not installed")
+def test_numpy_matches_python():
+    rng = random.Random(2017)
+    entries = []
+    t = 0.0
+    for _ in range(2000):
+        t += rng.expovariate(1 / 30.0) if rng.random() < 0.95 else rng.uniform(300, 3000)
+        entries.append((t, "Send: " + rng.choice(["G1 X1", "G28", "M105", "M117 Hi", "G4 P100"])))
+        entries.append((t, "Recv: ok T:{:.1f} /0.0".format(rng.uniform(20, 220))))
+    recording = _recording(*entries)
+
+    arguments = (recording, [1, 5, 10, 30], [40, 50, 80], [["M105"], ["M105", "G4"]], [["G1"], ["G1", "G28"]])
+    python = simulate(*arguments, use_numpy=False)
+    numpy = simulate(*arguments, use_numpy=True)
+
+    assert len(python) == 4 * 3 * 2 * 2
+    assert numpy == python
+
+
+def test_pareto_front():
+    results = pareto_front([dict(onHours=1, interruptions=5),
+                            dict(onHours=2, interruptions=1),
+                            dict(onHours=2, interruptions=2),
+                            dict(onHours=3, interruptions=0)])
+
+    assert [r['pareto'] for r in results] == [True, True, False, True]
@@ -0,0 +1,56 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+__author__ = "Shawn Bruce <kantlivelong@gmail.com>"
+__license__ = "GNU Affero General Public License http://www.gnu.org/licenses/agpl.html"
+__copyright__ = "Copyright (C) 2017 Shawn Bruce - Released under terms of the AGPLv3 License"
+
+import pytest
+
+from octoprint_psucontrol.tracing import Tracer
+
+
+def test_disabled_tracer_records_nothing():
+    tracer = Tracer()
+    with tracer.span("switch", state=True) as span:
+        span.set(result=True)
+    assert tracer.to_chrome_trace()['traceEvents'] == []
+
+
+def test_span_export():
+    tracer = Tracer()
+    tracer.configure(True, 10)
+
+    with tracer.span("turn_psu_on"):
+        with tracer.span("switch", state=True) as span:
+            span.set(result=True)
+
+    events = [e for e in tracer.to_chrome_trace()['traceEvents'] if e['ph'] == 'X']
+    assert [e['name'] for e in events] == ["switch", "turn_psu_on"]
+    assert events[0]['args'] == dict(state=True, result=True)
+    assert events[1]['ts'] <= events[0]['ts']
+    assert events[1]['dur'] >= events[0]['dur']
+
+
+def test_span_records_errors():
+    tracer = Tracer()
+    tracer.configure(True, 10)
+
+    with pytest.raises(ValueError):
+        with tracer.span("sense"):
+            raise ValueError()
+
+    event = tracer.to_chrome_trace()['traceEvents'][-1]
+    assert event['args'] == dict(error="ValueError")
+
+
+def test_buffer_is_bounded():
+    tracer = Tracer()
+    tracer.configure(True, 3)
+
+    for i in range(5):
+        with tracer.span("poll", i=i):
+            pass
+
+    events = [e for e in tracer.to_chrome_trace()['traceEvents'] if e['ph'] == 'X']
+    assert [e['args']['i'] for e in events] == [2, 3, 4]
@@ -0,0 +1,431 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+__author__ = "Shawn Bruce <kantlivelong@gmail.com>"
+__license__ = "GNU Affero General Public License http://www.gnu.org/licenses/agpl.html"
+__copyright__ = "Copyright (C) 2017 Shawn Bruce - Released under terms of the AGPLv3 License"
+
+import threading
+import time
+
+import pytest
+
+from octoprint_psucontrol.util import wait_for_path, DebouncedInput, PowerStateMachine, AdaptivePollInterval, SingleFlight, precise_sleep, OutputProtection, SwitchRejected, Preemption
+
+
+def test_wait_for_path_existing(tmp_path):
+    path = tmp_path / "ttyUSB0"
+    path.touch()
+    assert wait_for_path(str(path), 0)
+
+
+def test_wait_for_path_appears(tmp_path):
+    path = tmp_path / "serial" / "by-id" / "usb-printer"
+
+    def create():
+        path.parent.mkdir(parents=True)
+        path.touch()
+
+    threading.Timer(0.2, create).start()
+    start = time.time()
+    assert wait_for_path(str(path), 5)
+    assert time.time() - start < 2
+
+
+def test_wait_for_path_timeout(tmp_path):
+    start = time.time()
+    assert not wait_for_path(str(tmp_path / "missing"), 0.2)
+    assert 0.15 < time.time() - start < 1
+
+
+def _feed(debouncer, values, start=0.0, period=0.01):
+    """Sample ``values`` one after the other at ``period`` spaced times."""
+    values = iter(values)
+    debouncer.read_function = lambda: next(values)
+    now = start
+    for _ in range(1000):
+        try:
+            debouncer._sample(now)
+        except StopIteration:
+            break
+        now += period
+    return now
+
+
+def test_debounce_ignores_glitches():
+    changes = []
+    debouncer = DebouncedInput(lambda: False, 100, 8, 0.05, on_change=lambda: changes.append(True))
+    debouncer._prime()
+
+    _feed(debouncer, [True, False, True, False, False, True] + [False] * 20)
+    assert debouncer.read() is False
+    assert changes == []
+    assert debouncer.edge_count == 6
+
+
+def test_debounce_changes_after_stable_time():
+    changes = []
+    debouncer = DebouncedInput(lambda: False, 100, 8, 0.05, on_change=lambda: changes.append(debouncer.read()))
+    debouncer._prime()
+
+    # 6 of 8 samples high crosses the upper threshold, the state follows 50ms later
+    _feed(debouncer, [True] * 10)
+    assert debouncer.read() is False
+    _feed(debouncer, [True] * 3, start=0.1)
+    assert debouncer.read() is True
+    assert changes == [True]
+
+
+def test_debounce_rejects_short_pulses():
+    debouncer = DebouncedInput(lambda: False, 100, 8, 0.1)
+    debouncer._prime()
+
+    # crosses the threshold but drops back before the stable time is reached
+    _feed(debouncer, [True] * 7 + [False] * 8)
+    assert debouncer.read() is False
+    assert debouncer.rejected_count == 1
+    assert debouncer.change_count == 0
+
+
+def test_debounce_pause():
+    line = dict(value=False)
+    debouncer = DebouncedInput(lambda: line['value'], 200, 4, 0)
+    debouncer.start()
+    try:
+        time.sleep(0.05)
+        debouncer.pause()
+        time.sleep(0.05)
+        samples = debouncer.sample_count
+        time.sleep(0.1)
+        assert debouncer.sample_count == samples
+
+        # reads the line directly while paused
+        line['value'] = True
+        assert debouncer.read() is True
+        assert debouncer.get_stats()['paused']
+
+        debouncer.resume()
+        time.sleep(0.1)
+        assert debouncer.sample_count > samples
+        assert debouncer.read() is True
+    finally:
+        debouncer.stop()
+        debouncer.join(1)
+    assert not debouncer.is_alive()
+
+
+class Switch(object):
+    """Turn on/off functions for a PowerStateMachine that can be held in flight."""
+    def __init__(self):
+        self.calls = []
+        self.release = threading.Event()
+        self.release.set()
+        self.entered = threading.Event()
+        self.result = True
+
+    def _switch(self, on):
+        self.calls.append(on)
+        self.entered.set()
+        self.release.wait(5)
+        return self.result
+
+    def turn_on(self):
+        return self._switch(True)
+
+    def turn_off(self):
+        return self._switch(False)
+
+
+def _start(function, *args):
+    results = []
+    thread = threading.Thread(target=lambda: results.append(function(*args)))
+    thread.start()
+    return thread, results
+
+
+def test_state_machine_request():
+    switch = Switch()
+    machine = PowerStateMachine(switch.turn_on, switch.turn_off)
+
+    assert machine.request(True)
+    assert machine.state == PowerStateMachine.ON
+    assert machine.request(True, force=False)
+    assert switch.calls == [True]
+    assert machine.skipped_count == 1
+
+
+def test_state_machine_merges_same_target():
+    switch = Switch()
+    switch.release.clear()
+    machine = PowerStateMachine(switch.turn_on, switch.turn_off)
+
+    first, first_result = _start(machine.request, True)
+    switch.entered.wait(5)
+    second, second_result = _start(machine.request, True)
+    time.sleep(0.1)
+    assert machine.state == PowerStateMachine.TURNING_ON
+
+    switch.release.set()
+    first.join(5)
+    second.join(5)
+    assert first_result == second_result == [True]
+    assert switch.calls == [True]
+    assert machine.merged_count == 1
+
+
+def test_state_machine_serializes_opposite_targets():
+    switch = Switch()
+    switch.release.clear()
+    machine = PowerStateMachine(switch.turn_on, switch.turn_off)
+
+    on, _ = _start(machine.request, True)
+    switch.entered.wait(5)
+    off, _ = _start(machine.request, False)
+    time.sleep(0.1)
+    assert switch.calls == [True]
+
+    switch.release.set()
+    on.join(5)
+    off.join(5)
+    assert switch.calls == [True, False]
+    assert machine.state == PowerStateMachine.OFF
+
+
+def test_state_machine_failure_keeps_previous_state():
+    switch = Switch()
+    switch.result = False
+    machine = PowerStateMachine(switch.turn_on, switch.turn_off)
+
+    assert not machine.request(True)
+    assert machine.state == PowerStateMachine.OFF
+
+    def fail():
+        raise RuntimeError("switch failed")
+
+    machine = PowerStateMachine(fail, switch.turn_off)
+    with pytest.raises(RuntimeError):
+        machine.request(True)
+    assert machine.state == PowerStateMachine.OFF
+
+
+def test_state_machine_reentrant_request():
+    machine = PowerStateMachine(lambda: machine.request(True), lambda: True)
+    assert machine.request(True)
+    assert machine.state == PowerStateMachine.ON
+
+
+def test_state_machine_preempt():
+    switch = Switch()
+    switch.release.clear()
+    machine = PowerStateMachine(switch.turn_on, switch.turn_off)
+
+    on, _ = _start(machine.request, True)
+    switch.entered.wait(5)
+    machine.preempt(False)
+    assert machine.state == PowerStateMachine.OFF
+
+    # the operation in flight finishing no longer changes the state
+    switch.release.set()
+    on.join(5)
+    assert machine.state == PowerStateMachine.OFF
+
+
+def test_state_machine_toggle_and_sensed():
+    switch = Switch()
+    machine = PowerStateMachine(switch.turn_on, switch.turn_off)
+
+    machine.sensed(True)
+    assert machine.state == PowerStateMachine.ON
+    assert machine.toggle()
+    assert switch.calls == [False]
+    assert machine.state == PowerStateMachine.OFF
+
+
+def test_poll_interval_backs_off_to_max():
+    interval = AdaptivePollInterval(base_interval=5, fast_interval=0.25, fast_window=10, max_interval=20, backoff=2)
+
+    assert [interval.next_interval(False, False) for _ in range(4)] == [10, 20, 20, 20]
+    assert interval.next_interval(True, False) == 5
+    assert interval.next_interval(False, True) == 5
+
+
+def test_poll_interval_boost():
+    interval = AdaptivePollInterval(base_interval=5, fast_interval=0.25, fast_window=0.2, max_interval=60, backoff=1.5)
+
+    interval.boost()
+    assert interval.next_interval(False, False) == 0.25
+    assert interval.get_stats()['boosted']
+    time.sleep(0.25)
+    assert interval.next_interval(False, False) > 5
+
+
+def test_poll_interval_configure_limits():
+    interval = AdaptivePollInterval()
+    interval.configure(2, 5, 10, 1, 0.5)
+
+    # the fast interval never exceeds the base interval and the max never drops below it
+    assert interval.fast_interval == 2
+    assert interval.max_interval == 2
+    assert interval.next_interval(False, False) == 2
+
+
+def test_single_flight_merges_concurrent_calls():
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def read():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return len(calls)
+
+    flight = SingleFlight(read)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flight())) for _ in range(5)]
+    threads[0].start()
+    assert started.wait(5)
+    for t in threads[1:]:
+        t.start()
+    while flight.merged_count < 4:
+        time.sleep(0.01)
+    release.set()
+    for t in threads:
+        t.join(5)
+
+    assert results == [1] * 5
+    assert flight.get_stats() == dict(calls=1, merged=4)
+
+    # a later call starts a new flight
+    assert flight() == 2
+    assert flight.get_stats() == dict(calls=2, merged=4)
+
+
+def test_single_flight_shares_errors():
+    def read():
+        raise IOError("sensor unavailable")
+
+    flight = SingleFlight(read)
+    with pytest.raises(IOError):
+        flight()
+    # the failed flight does not stick
+    with pytest.raises(IOError):
+        flight()
+    assert flight.call_count == 2
+
+
+@pytest.mark.parametrize("duration", [0, 0.001, 0.02])
+def test_precise_sleep(duration):
+    start = time.perf_counter()
+    elapsed = precise_sleep(duration)
+
+    assert duration <= elapsed <= time.perf_counter() - start
+    assert elapsed - duration < 0.005
+
+
+def _protection(policy=OutputProtection.REJECT, **kwargs):
+    settings = dict(min_on=10, min_off=5, max_cycles=0, window=0, max_queue=0)
+    settings.update(kwargs)
+    protection = OutputProtection()
+    protection.configure(True, settings['min_on'], settings['min_off'], settings['max_cycles'],
+                         settings['window'], policy, settings['max_queue'])
+    return protection
+
+
+def test_protection_minimum_dwell():
+    protection = _protection()
+
+    assert protection.delay(True, now=0) == (0, None)
+    protection.record(True, now=0)
+    assert protection.delay(True, now=1) == (0, None)
+    assert protection.delay(False, now=4) == (6, 'minOnTime')
+    assert protection.delay(False, now=10) == (0, 'minOnTime')
+
+    protection.record(False, now=10)
+    assert protection.delay(True, now=12) == (3, 'minOffTime')
+
+
+def test_protection_cycle_budget():
+    protection = _protection(min_on=0, min_off=0, max_cycles=2, window=100)
+
+    for now in (0, 10):
+        protection.record(True, now=now)
+        protection.record(False, now=now + 1)
+
+    assert protection.delay(True, now=20) == (80, 'cycleBudget')
+    # the first cycle leaves the window
+    assert protection.delay(True, now=100)[0] == 0
+    # the budget only limits power on
+    assert protection.delay(False, now=20)[0] == 0
+
+
+def test_protection_disabled():
+    protection = _protection()
+    protection.enabled = False
+    protection.record(True)
+
+    assert protection.delay(False) == (0, None)
+    assert protection.acquire(False)
+
+
+def test_protection_reject():
+    protection = _protection()
+    protection.record(True)
+
+    with pytest.raises(SwitchRejected) as e:
+        protection.acquire(False)
+    assert e.value.reason == 'minOnTime'
+    assert 9 < e.value.retry_after <= 10
+    assert protection.get_stats()['rejected'] == dict(minOnTime=1)
+
+
+def test_protection_queue():
+    protection = _protection(OutputProtection.QUEUE, min_on=0.2, max_queue=1)
+    protection.record(True)
+
+    start = time.time()
+    assert protection.acquire(False)
+    assert 0.15 < time.time() - start < 1
+    assert protection.get_stats()['queued'] == 1
+
+    # waits longer than max_queue are rejected
+    protection = _protection(OutputProtection.QUEUE, min_on=10, max_queue=1)
+    protection.record(True)
+    with pytest.raises(SwitchRejected):
+        protection.acquire(False)
+
+
+def test_protection_queue_abort():
+    protection = _protection(OutputProtection.QUEUE, min_on=10, max_queue=60)
+    protection.record(True)
+    abort = threading.Event()
+    threading.Timer(0.1, abort.set).start()
+
+    start = time.time()
+    assert protection.acquire(False, abort=abort) is False
+    assert time.time() - start < 1
+
+
+def test_preemption():
+    preemption = Preemption()
+    old = preemption.begin()
+    assert not old.is_preempted()
+
+    preemption.preempt()
+    new = preemption.begin()
+    assert old.is_preempted()
+    assert old.event.is_set()
+    # operations started after the preempt run normally
+    assert not new.is_preempted()
+    assert not new.event.is_set()
+
+
+def test_preemption_wakes_waits():
+    preemption = Preemption()
+    token = preemption.begin()
+    threading.Timer(0.1, preemption.preempt).start()
+
+    start = time.time()
+    assert token.wait(5)
+    assert time.time() - start < 1
+    assert not preemption.begin().wait(0.01)
@@ -0,0 +1,111 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+__author__ = "Shawn Bruce <kantlivelong@gmail.com>"
+__license__ = "GNU Affero General Public License http://www.gnu.org/licenses/agpl.html"
+__copyright__ = "Copyright (C) 2017 Shawn Bruce - Released under terms of the AGPLv3 License"
+
+import threading
+
+import pytest
+
+from octoprint_psucontrol.workflow import Workflow, WorkflowError
+
+
+def _run(steps):
+    workflow = Workflow("test", steps)
+    workflow.start()
+    workflow.join(5)
+    assert not workflow.is_alive()
+    return workflow
+
+
+def _states(workflow):
+    return [step['state'] for step in workflow.steps.values()]
+
+
+def test_runs_steps_in_order():
+    calls = []
+    workflow = _run([("a", lambda wf: calls.append("a")),
+                     ("b", lambda wf: False),
+                     ("c", lambda wf: calls.append("c"))])
+
+    assert calls == ["a", "c"]
+    assert workflow.state == 'DONE'
+    assert _states(workflow) == ['DONE', 'SKIPPED', 'DONE']
+    assert [step['name'] for step in workflow.to_dict()['steps']] == ["a", "b", "c"]
+
+
+def test_failure_runs_cleanups_in_reverse():
+    cleanups = []
+
+    def first(wf):
+        wf.add_cleanup(lambda: cleanups.append("first"))
+
+    def second(wf):
+        wf.add_cleanup(lambda: cleanups.append("second"))
+        raise WorkflowError("broken")
+
+    workflow = _run([("first", first), ("second", second), ("third", lambda wf: None)])
+
+    assert workflow.state == 'FAILED'
+    assert workflow.error == "broken"
+    assert _states(workflow) == ['DONE', 'FAILED', 'PENDING']
+    assert cleanups == ["second", "first"]
+
+
+def test_cancel_while_waiting():
+    cleanups = []
+    waiting = threading.Event()
+
+    def wait(wf):
+        wf.add_cleanup(lambda: cleanups.append("wait"))
+        waiting.set()
+        wf.wait_for(lambda: False, 5, "nothing")
+
+    workflow = Workflow("test", [("wait", wait)])
+    workflow.start()
+    assert waiting.wait(5)
+    workflow.cancel()
+    workflow.join(5)
+
+    assert workflow.state == 'CANCELLED'
+    assert cleanups == ["wait"]
+
+
+def test_wait_for_wakes_on_notify():
+    ready = []
+
+    workflow = Workflow("test", [("wait", lambda wf: wf.wait_for(lambda: ready, 5, "ready"))])
+    workflow.start()
+    ready.append(True)
+    workflow.notify()
+    workflow.join(2)
+
+    assert workflow.state == 'DONE'
+
+
+def test_wait_for_times_out():
+    workflow = _run([("wait", lambda wf: wf.wait_for(lambda: False, 0.1, "nothing"))])
+
+    assert workflow.state == 'FAILED'
+    assert "nothing" in workflow.error
+
+
+@pytest.mark.parametrize("denied", ["PRINT", "FILES_SELECT"])
+def test_power_on_and_print_needs_print_rights(plugin, permissions, denied):
+    getattr(permissions, denied).can.return_value = False
+
+    response = plugin.on_api_command("powerOnAndPrint", dict(path="test.gcode"))
+
+    assert response.status_code == 403
+    assert plugin._workflow is None
+
+
+def test_power_on_and_print_with_print_rights(plugin, permissions):
+    plugin.start_print_workflow = lambda path, **kwargs: Workflow("powerOnAndPrint", [])
+
+    response = plugin.on_api_command("powerOnAndPrint", dict(path="test.gcode"))
+
+    assert response.status_code == 200
+    assert response.get_json()['name'] == "powerOnAndPrint"